@@ -0,0 +1,50 @@
+# ===== Inits + Definitions =========================
+import io
+import zlib
+import numpy as np
+from PIL import Image
+
+"""
+This module contains the functions that run inside the writer processes of the frame sinks.
+The writer processes are spawned, so every process imports the module of the functions it runs.
+The module therefore lives next to the Synthesis package instead of inside it and only depends on numpy and PIL,
+importing it through the package would load the package __init__ with torch and the generator in every process.
+"""
+
+
+# ===== Methods =========================
+
+def encodeFrame(frame, frameFormat, compressLevel):
+    """
+    Encodes a frame in memory, runs inside the writer processes
+    Args:
+        frame: The uint8 RGB frame of shape [H, W, 3]
+        frameFormat: One of the encoded frame formats of the frame sinks (png, fastPng or zlib)
+        compressLevel: Compression level of the format
+
+    Returns: The encoded frame as bytes
+
+    """
+    if frameFormat == "zlib":
+        return zlib.compress(np.ascontiguousarray(frame).tobytes(), compressLevel)
+
+    buffer = io.BytesIO()
+    Image.fromarray(frame, "RGB").save(buffer, format="png", compress_level=compressLevel)
+
+    return buffer.getvalue()
+
+
+def saveFrame(filePath, frame, frameFormat, compressLevel):
+    """
+    Encodes a frame and writes it to the disk, runs inside the writer processes
+    Args:
+        filePath: Path of the frame file
+        frame: The uint8 RGB frame of shape [H, W, 3]
+        frameFormat: One of the encoded frame formats of the frame sinks (png, fastPng or zlib)
+        compressLevel: Compression level of the format
+
+    Returns: -
+
+    """
+    with open(filePath, "wb") as file:
+        file.write(encodeFrame(frame, frameFormat, compressLevel))
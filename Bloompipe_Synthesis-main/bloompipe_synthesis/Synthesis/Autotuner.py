@@ -0,0 +1,292 @@
+# ===== Inits + Definitions =========================
+import os
+import json
+import time
+import hashlib
+import threading
+import torch
+
+from stylegan2 import dnnlib
+
+"""
+This module picks the fastest way to run the synthesis network of a loaded generator on the current hardware.
+The first time a model is used on a device, it benchmarks the candidate execution plans (fused or non-fused
+modulated convolutions, factorized demodulation, custom or reference ops and the batch size) and persists
+the winner per model hash, device and thread count, so that later jobs can reuse it right away.
+"""
+
+# ===== Global-Variables =========================
+
+# File in which the winning plans are stored
+PLAN_CACHE_FILE = dnnlib.make_cache_dir_path("bloompipe", "synthesisPlans.json")
+
+# Variants of the modulated convolution
+MODCONV_CANDIDATES = [
+    {"fusedModconv": True, "factorizedDemod": False},
+    {"fusedModconv": False, "factorizedDemod": False},
+    {"fusedModconv": False, "factorizedDemod": True},
+]
+
+# Batch size with which the different plans are compared
+PROBE_BATCH_SIZE = 4
+
+# Batch sizes tried for the winning plan
+BATCH_SIZE_CANDIDATES = [1, 2, 4, 8, 16, 32, 64]
+
+# A bigger batch is only chosen if it is at least this much faster per frame
+MIN_BATCH_IMPROVEMENT = 0.05
+
+# Stop trying bigger batches once a single run takes longer than this (in seconds)
+MAX_RUN_SECONDS = 30.0
+
+NUM_WARMUP_RUNS = 1
+NUM_TIMED_RUNS = 2
+
+# Lock that lets only one style be tuned at a time in this process, so that concurrent tuning runs
+# do not skew each other's timings and do not overwrite each other's plans
+tuningLock = threading.Lock()
+
+# Plan used if no plan could be benchmarked
+DEFAULT_PLAN = {
+    "fusedModconv": None,
+    "factorizedDemod": True,
+    "refBiasAct": False,
+    "refUpfirdn2d": False,
+    "batchSize": 14
+}
+
+
+# ===== Methods =========================
+
+def getPlan(Gs, device, modelHash=None):
+    """
+    Returns the execution plan for the generator on the device, tuning it at first use
+    Args:
+        Gs: The loaded generator
+        device: The torch device the generator runs on
+        modelHash: Hash of the generator weights, computed from the generator if not provided
+
+    Returns: The plan as a dictionary
+
+    """
+    if modelHash is None:
+        modelHash = getModelHash(Gs)
+
+    planKey = "{}|{}|{}".format(modelHash, getDeviceName(device), torch.get_num_threads())
+    plans = loadPlans()
+
+    if planKey not in plans:
+        with tuningLock:
+            # Reload the plans, because another job might have stored this plan while waiting for the lock
+            plans = loadPlans()
+
+            if planKey not in plans:
+                plans[planKey] = tunePlan(Gs, device)
+                savePlans(plans)
+
+    plan = dict(DEFAULT_PLAN, **plans[planKey])
+    print("Using synthesis plan: {}".format(plan))
+
+    return plan
+
+
+def applyPlan(plan):
+    """
+    Returns the synthesis arguments of a plan, including its op implementations.
+    The implementations are passed with every call instead of being set globally,
+    so that jobs with different plans can run at the same time
+    Args:
+        plan: The plan to apply
+
+    Returns: Keyword arguments for the synthesis network
+
+    """
+    return {
+        "fused_modconv": plan["fusedModconv"],
+        "factorized_demod": plan["factorizedDemod"],
+        "bias_act_impl": "ref" if plan["refBiasAct"] else "cuda",
+        "upfirdn2d_impl": "ref" if plan["refUpfirdn2d"] else "cuda"
+    }
+
+
+def tunePlan(Gs, device):
+    """
+    Benchmarks all candidate plans and then the batch sizes of the fastest one
+    Args:
+        Gs: The loaded generator
+        device: The torch device the generator runs on
+
+    Returns: The fastest plan
+
+    """
+    print("Tuning synthesis plan for {}...".format(getDeviceName(device)))
+
+    # Custom ops exist for the GPU and the CPU
+    implCandidates = [(False, False), (False, True), (True, False), (True, True)]
+
+    # Compare the plans at the probe batch size
+    bestPlan = None
+    bestTime = None
+    for refBiasAct, refUpfirdn2d in implCandidates:
+        for modconv in MODCONV_CANDIDATES:
+            plan = dict(modconv, refBiasAct=refBiasAct, refUpfirdn2d=refUpfirdn2d, batchSize=PROBE_BATCH_SIZE)
+            frameTime = benchmarkPlan(Gs, device, plan)
+
+            if frameTime is not None and (bestTime is None or frameTime < bestTime):
+                bestPlan = plan
+                bestTime = frameTime
+
+    if bestPlan is None:
+        print("Tuning failed - Using default plan")
+        return dict(DEFAULT_PLAN)
+
+    # Try increasing batch sizes until memory runs out or runs get too long
+    bestBatchTime = None
+    for batchSize in BATCH_SIZE_CANDIDATES:
+        plan = dict(bestPlan, batchSize=batchSize)
+        runStart = time.perf_counter()
+        frameTime = benchmarkPlan(Gs, device, plan)
+        runTime = (time.perf_counter() - runStart) / (NUM_WARMUP_RUNS + NUM_TIMED_RUNS)
+
+        if frameTime is None:
+            break
+
+        if bestBatchTime is None or frameTime < bestBatchTime * (1 - MIN_BATCH_IMPROVEMENT):
+            bestPlan = plan
+            bestBatchTime = frameTime
+
+        if runTime > MAX_RUN_SECONDS:
+            break
+
+    print("Tuned synthesis plan: {}".format(bestPlan))
+
+    return bestPlan
+
+
+def benchmarkPlan(Gs, device, plan):
+    """
+    Measures the synthesis time per frame of a plan with random latents
+    Args:
+        Gs: The loaded generator
+        device: The torch device the generator runs on
+        plan: The plan to measure
+
+    Returns: The fastest measured time per frame in seconds, or None if the plan ran out of memory or failed
+
+    """
+    synthesisKWArgs = applyPlan(plan)
+    batchSize = plan["batchSize"]
+    runTimes = []
+
+    try:
+        z = torch.randn([batchSize, Gs.z_dim], device=device)
+
+        for _ in range(NUM_WARMUP_RUNS + NUM_TIMED_RUNS):
+            synchronize(device)
+            runStart = time.perf_counter()
+
+            Gs.infer(z, noise_mode="const", force_fp32=True, **synthesisKWArgs)
+
+            synchronize(device)
+            runTimes.append(time.perf_counter() - runStart)
+    except RuntimeError as exception:
+        # A failing candidate is skipped, the other candidates can still be tuned
+        if not isOutOfMemory(exception):
+            print("Plan {} failed: {}".format(plan, exception))
+        return None
+    finally:
+        if device.type == "cuda":
+            torch.cuda.empty_cache()
+
+    return min(runTimes[NUM_WARMUP_RUNS:]) / batchSize
+
+
+def isOutOfMemory(exception):
+    """
+    Checks if an exception was raised because the device ran out of memory
+    Args:
+        exception: The raised exception
+
+    Returns: True if the exception is an out of memory error
+
+    """
+    message = str(exception).lower()
+    return "out of memory" in message or "can't allocate memory" in message
+
+
+def synchronize(device):
+    """
+    Waits until all queued work on the device is done, so that it can be timed
+    Args:
+        device: The torch device
+
+    Returns: -
+
+    """
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def getDeviceName(device):
+    """
+    Returns a name that identifies the hardware behind a torch device
+    Args:
+        device: The torch device
+
+    Returns: The device name as a string
+
+    """
+    if device.type == "cuda":
+        return "cuda:" + torch.cuda.get_device_name(device)
+
+    return device.type
+
+
+def getModelHash(Gs):
+    """
+    Hashes the architecture and the weights of a generator
+    Args:
+        Gs: The generator
+
+    Returns: The hex digest of the generator
+
+    """
+    modelHash = hashlib.sha1()
+    modelHash.update(json.dumps(Gs.init_kwargs, sort_keys=True, default=str).encode())
+
+    for name, tensor in Gs.state_dict().items():
+        modelHash.update(name.encode())
+        modelHash.update(tensor.detach().cpu().numpy().tobytes())
+
+    return modelHash.hexdigest()
+
+
+def loadPlans():
+    """
+    Loads all persisted plans
+    Returns: Dictionary of plans by model hash, device and thread count
+
+    """
+    if not os.path.exists(PLAN_CACHE_FILE):
+        return {}
+
+    try:
+        with open(PLAN_CACHE_FILE, "r") as file:
+            return json.load(file)
+    except ValueError:
+        return {}
+
+
+def savePlans(plans):
+    """
+    Persists the plans, replacing the file atomically so that concurrent readers never see a partial file
+    Args:
+        plans: Dictionary of plans by model hash, device and thread count
+
+    Returns: -
+
+    """
+    os.makedirs(os.path.dirname(PLAN_CACHE_FILE), exist_ok=True)
+
+    with dnnlib.util.atomic_write(PLAN_CACHE_FILE) as file:
+        json.dump(plans, file, indent=2)
@@ -0,0 +1,211 @@
+# ===== Inits + Definitions =========================
+import os
+import resource
+import torch
+
+"""
+This module sizes the synthesis batches from the memory a single frame of the loaded model needs
+and the memory that is currently available on the device, so that big machines are fully used
+and small machines do not run out of memory.
+"""
+
+# ===== Global-Variables =========================
+
+# Share of the available memory the batches may use, the rest is kept as headroom
+MEMORY_HEADROOM = 0.75
+
+# Batch sizes used to measure the memory per frame
+SMALL_PROBE_BATCH = 1
+LARGE_PROBE_BATCH = 3
+
+# Bytes per float32 value
+FLOAT_BYTES = 4
+
+# Activation-sized buffers that exist at the same time while a block is running
+# (input, modulated input, upsampled and filtered output, bias/activation temporaries)
+ACTIVATION_COPIES = 6
+
+# Memory information files of linux and of the container cgroups (v2 and v1)
+MEMINFO_FILE = "/proc/meminfo"
+CGROUP_FILES = [
+    ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+    ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes")
+]
+
+
+# ===== Methods =========================
+
+def getBatchSize(frameMemory, device, maxBatchSize):
+    """
+    Calculates how many frames fit into the memory that is currently available
+    Args:
+        frameMemory: Bytes a single frame needs during the synthesis
+        device: The torch device the synthesis runs on
+        maxBatchSize: Upper limit of the batch size, e.g. the tuned batch size
+
+    Returns: The batch size
+
+    """
+    availableMemory = getAvailableMemory(device)
+
+    if availableMemory is None or not frameMemory:
+        return maxBatchSize
+
+    batchSize = int(availableMemory * MEMORY_HEADROOM // frameMemory)
+
+    return max(1, min(maxBatchSize, batchSize))
+
+
+def measureFrameMemory(Gs, device, synthesisKWArgs):
+    """
+    Measures how much memory a single frame needs during the synthesis
+    by comparing the peak memory of a small and a large batch
+    Args:
+        Gs: The loaded generator
+        device: The torch device the generator runs on
+        synthesisKWArgs: Keyword arguments for the synthesis network
+
+    Returns: The bytes needed per frame
+
+    """
+    print("Measuring memory per frame...")
+
+    peakMemory = {}
+    for batchSize in [SMALL_PROBE_BATCH, LARGE_PROBE_BATCH]:
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats(device)
+            baseMemory = torch.cuda.memory_allocated(device)
+        else:
+            baseMemory = getPeakResidentMemory()
+
+        z = torch.randn([batchSize, Gs.z_dim], device=device)
+        Gs.infer(z, noise_mode="const", force_fp32=True, **synthesisKWArgs)
+        del z
+
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+            peakMemory[batchSize] = torch.cuda.max_memory_allocated(device) - baseMemory
+        else:
+            peakMemory[batchSize] = getPeakResidentMemory() - baseMemory
+
+    frameMemory = (peakMemory[LARGE_PROBE_BATCH] - peakMemory[SMALL_PROBE_BATCH]) \
+        / (LARGE_PROBE_BATCH - SMALL_PROBE_BATCH)
+
+    # The peak resident memory of the process only grows if the batch needed more than any run before,
+    # so fall back to an estimate from the architecture if no growth could be measured
+    frameMemory = max(frameMemory, estimateFrameMemory(Gs))
+
+    print("Memory per frame: {:.1f} MB".format(frameMemory / 2 ** 20))
+
+    return frameMemory
+
+
+def estimateFrameMemory(Gs):
+    """
+    Estimates the memory per frame from the widest activations of the synthesis network
+    Args:
+        Gs: The loaded generator
+
+    Returns: The estimated bytes needed per frame
+
+    """
+    synthesis = Gs.synthesis
+    frameMemory = 0
+
+    for res in synthesis.block_resolutions:
+        block = getattr(synthesis, f"b{res}")
+        channels = block.conv1.weight.shape[0]
+        frameMemory = max(frameMemory, channels * res * res * FLOAT_BYTES * ACTIVATION_COPIES)
+
+    return frameMemory
+
+
+def getAvailableMemory(device):
+    """
+    Returns the memory that is currently available for the synthesis on the device
+    Args:
+        device: The torch device
+
+    Returns: The available bytes or None if they can not be determined
+
+    """
+    if device.type == "cuda":
+        # Memory cached by the torch allocator can be reused as well
+        cachedMemory = torch.cuda.memory_reserved(device) - torch.cuda.memory_allocated(device)
+
+        if hasattr(torch.cuda, "mem_get_info"):
+            freeMemory, _ = torch.cuda.mem_get_info(device)
+        else:
+            freeMemory = torch.cuda.get_device_properties(device).total_memory - torch.cuda.memory_reserved(device)
+
+        return freeMemory + cachedMemory
+
+    availableMemory = readMeminfo("MemAvailable")
+
+    # Containers can be limited further than the machine
+    for limitFile, usageFile in CGROUP_FILES:
+        limit = readIntFile(limitFile)
+        usage = readIntFile(usageFile)
+
+        if limit is not None and usage is not None:
+            containerMemory = max(0, limit - usage)
+            availableMemory = containerMemory if availableMemory is None else min(availableMemory, containerMemory)
+            break
+
+    return availableMemory
+
+
+def getPeakResidentMemory():
+    """
+    Returns the peak resident memory of this process
+    Returns: The peak resident memory in bytes
+
+    """
+    # Linux reports the peak resident memory in kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def readMeminfo(key):
+    """
+    Reads a value from the linux memory information
+    Args:
+        key: Name of the value, e.g. MemAvailable
+
+    Returns: The value in bytes or None if it is not available
+
+    """
+    if not os.path.exists(MEMINFO_FILE):
+        return None
+
+    with open(MEMINFO_FILE, "r") as file:
+        for line in file:
+            name, value = line.split(":", 1)
+            if name == key:
+                # Values are given in kilobytes
+                return int(value.split()[0]) * 1024
+
+    return None
+
+
+def readIntFile(path):
+    """
+    Reads a file containing a single integer, like the cgroup memory files
+    Args:
+        path: Path to the file
+
+    Returns: The integer or None if the file does not exist or contains no limit
+
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as file:
+        content = file.read().strip()
+
+    # cgroup v2 reports "max" if the memory is not limited
+    if not content.isdigit():
+        return None
+
+    return int(content)
@@ -1,7 +1,9 @@
 # ===== Inits + Definitions =========================
 import math
+import contextlib
 import sys
 import os
+import time
 import numpy as np
 import torch
 import random
@@ -9,12 +11,14 @@ import random
 from matplotlib import pyplot as plt
 from tqdm import tqdm
 from scipy.stats import truncnorm
-from PIL import Image
 from .ArrayInterpolations import *
 
 LSD_DIRECTORY = str(os.getcwd())
 sys.path.insert(0, LSD_DIRECTORY + "/Synthesis")
 from stylegan2 import dnnlib, legacy
+from stylegan2.training import networks
+from stylegan2.torch_utils import misc
+from . import Autotuner, BatchSizer, FrameSinks, Checkpoints, RenderCache, ModelCache, StyleCatalog
 
 
 # ===== Global-Variables =========================
@@ -28,6 +32,9 @@ np.random.seed(3111)
 # random.seed(1222)
 PLOT_OUTPUT_PATH = "../../Bloompipe_Test/plot_sequence/vector_movement_{}.png"
 
+# Extension of styles exported by stylegan2/export_generator.py, which are loaded without unpickling
+GENERATOR_EXTENSION = ".gen"
+
 
 # ===== Methods ==================================
 class BloomyDreams:
@@ -94,14 +101,38 @@ class BloomyDreams:
         self.motionRandomness = None  # How much the motion between the vectors jiggles
         self.fps = fps  # FPS of the generated video
         self.outPath = None  # Path of the output file
+        self.videoPath = None  # Path of the video file, if the frames are encoded to a video directly
+        self.audioPath = None  # Path of the audio file that is muxed into the video
+        self.audioStart = 0.0  # Second of the audio file at which the video starts
+        self.tarPath = None  # Path of the tar archive, if the frames are packed while rendering
+        self.frameFormat = "png"  # Format of the intermediate frames
+        self.checkpointPath = None  # Folder of the checkpoint that records the progress of the synthesis
+        self.seed = None  # Random seed of the motion vectors
+        self.numpyRandom = None  # Random generators of the motion vectors of this job, seeded by seedRandom
+        self.pythonRandom = None
+        self.dedupTolerance = 0.0  # Largest latent difference at which consecutive frames share their pixels
+        self.keyframeStride = 1  # Only every k-th frame is synthesized, the frames in between are blended
+        self.keyframePulseJump = 0.2  # Pulse change between two frames at which both frames are synthesized
+        self.keyframeMaxDistance = 0.1  # Largest latent distance between two keyframes that is still blended
+        self.previewResolution = None  # Resolution at which the synthesis stops for a preview
+        self.previewUpscale = False  # If the preview frames are upscaled to the full resolution
+        self.renderCachePath = None  # Folder in which the frames of the last render are kept for reuse
+        self.reuseTolerance = 0.0  # Largest latent difference at which a frame of the last render is reused
+        self.coarseResolution = None  # Blocks up to this resolution follow only the base motion, not the audio
+        self.coarseTolerance = 0.0  # Largest base motion difference at which frames share the coarse block outputs
+        self.renderCache = None  # Motion vectors and seed of the last render
+        self.lastCheckpoint = None  # Time of the last recorded checkpoint
         self.pulseDirection = None  # Motion direction of vector dimensions
         self.currentMotion = None  # Motion vector of current frame used to update motion directions
         self.frameDuration = None  # Frame duration in seconds
         self.numFrames = len(pulseAudio)  # Amount of frames
         self.finalMotion = None  # Motion vectors of the generate function
+        self.baseMotion = None  # Motion vectors without the audio motion
         self.style = style  # Picture style
         self.numDimensions = 512  # Amount of vector dimensions
         self.styleExists = False  # Checks if style has already been loaded
+        self.plan = None  # Fastest way to run the synthesis on the current hardware
+        self.frameMemory = None  # Memory a single frame needs during the synthesis in bytes
 
         print("Frames in current video: {}".format(self.numFrames))
 
@@ -116,7 +147,25 @@ class BloomyDreams:
             pulseReact: float = 0.5,
             videoSmoothness: float = 0.75,
             motionRandomness: float = 0.5,
-            truncation: float = 1.0
+            truncation: float = 1.0,
+            videoPath: str = None,
+            audioPath: str = None,
+            audioStart: float = 0.0,
+            tarPath: str = None,
+            frameFormat: str = "png",
+            checkpointPath: str = None,
+            seed: int = None,
+            dedupTolerance: float = 0.0,
+            keyframeStride: int = 1,
+            keyframePulseJump: float = 0.2,
+            keyframeMaxDistance: float = 0.1,
+            previewResolution: int = None,
+            previewUpscale: bool = False,
+            renderCachePath: str = None,
+            reuseTolerance: float = 0.0,
+            coarseResolution: int = None,
+            coarseTolerance: float = 0.0,
+            styleLease=None
     ):
         """
         This is the full pipeline of the video generation.
@@ -133,6 +182,33 @@ class BloomyDreams:
             videoSmoothness:
             motionRandomness:
             truncation:
+            videoPath: If set, the frames are encoded into this video file instead of being written as images
+            audioPath: Audio file that is muxed into the video
+            audioStart: Second of the audio file at which the video starts
+            tarPath: If set, the frames are packed into this tar archive instead of being written to outPath
+            frameFormat: Format of the intermediate frames, one of FrameSinks.FRAME_FORMATS
+            checkpointPath: If set, the progress is recorded in this folder and an interrupted job
+                            with the same parameters continues after its last durably written frames
+            seed: Random seed of the motion vectors, a new one is drawn if not set
+            dedupTolerance: Consecutive frames whose motion vectors differ by at most this value in every
+                            dimension are only synthesized once, None synthesizes every frame
+            keyframeStride: Synthesize only every k-th frame and blend the frames in between, 1 synthesizes all
+            keyframePulseJump: Frames at which the pulse changes by more than this are always synthesized
+            keyframeMaxDistance: Keyframes whose motion vectors are further apart (root mean square)
+                                 get additional keyframes in between
+            previewResolution: If set, the synthesis stops at the block of this resolution, e.g. 128 or 256,
+                               which renders a low-resolution preview at a fraction of the cost
+            previewUpscale: If the preview frames are upscaled to the full resolution of the style
+            renderCachePath: If set, the frames of this render are kept in this folder and the next render
+                             of the job only synthesizes the frames whose motion vectors changed
+            reuseTolerance: Frames whose motion vectors differ from the last render by at most this value
+                            in every dimension are taken from the render cache, None synthesizes every frame
+            coarseResolution: If set, the audio only modulates the blocks above this resolution, e.g. 32,
+                              and the outputs of the blocks up to it are synthesized once per base motion vector
+            coarseTolerance: Consecutive frames whose base motion vectors differ by at most this value
+                             in every dimension share the outputs of the coarse blocks
+            styleLease: Context manager that is held while the style is loaded, e.g. StyleStore.leaseStyle,
+                        None if the style files are already in place
 
         Returns: Status of the synthesis success
 
@@ -170,28 +246,146 @@ class BloomyDreams:
             self.videoSmoothness = videoSmoothness
             self.motionRandomness = motionRandomness
             self.truncation = truncation
+            self.videoPath = videoPath
+            self.audioPath = audioPath
+            self.audioStart = audioStart
+            self.tarPath = tarPath
+            self.frameFormat = frameFormat
+            self.checkpointPath = checkpointPath
+            self.seed = seed
+            self.dedupTolerance = dedupTolerance
+            self.keyframeStride = keyframeStride
+            self.keyframePulseJump = keyframePulseJump
+            self.keyframeMaxDistance = keyframeMaxDistance
+            self.previewResolution = previewResolution
+            self.previewUpscale = previewUpscale
+            self.renderCachePath = renderCachePath
+            self.reuseTolerance = reuseTolerance
+            self.coarseResolution = coarseResolution
+            self.coarseTolerance = coarseTolerance
 
             # Initialise style
             if not self.styleExists:
                 if not callable(self.style):
-                    self.styleganInit()
+                    with styleLease if styleLease is not None else contextlib.nullcontext():
+                        self.styleganInit()
 
                 self.styleExists = True
 
-            # Generate vectors
-            self.generateMotionVectors()
+            # Load the motion vectors of the last render of the job, to reuse its unchanged frames
+            self.renderCache = None
+            if renderCachePath is not None:
+                self.renderCache = RenderCache.loadRenderCache(renderCachePath, self.getRenderParameters())
+
+            # Continue an interrupted job if it left a checkpoint
+            checkpoint = None
+            if checkpointPath is not None:
+                checkpoint = Checkpoints.loadCheckpoint(checkpointPath, self.getJobParameters())
+
+            if checkpoint is not None:
+                print("Resuming from checkpoint...")
+                self.seed = checkpoint["seed"]
+                self.finalMotion = checkpoint["motion"]
+                self.baseMotion = checkpoint["baseMotion"]
+                resumeState = checkpoint["sinkState"]
+            else:
+                # Reuse the seed of the last render, so that the motion only changes where the parameters changed
+                if self.seed is None and self.renderCache is not None:
+                    self.seed = self.renderCache["seed"]
+
+                # Generate vectors
+                self.seedRandom()
+                self.generateMotionVectors()
+                resumeState = None
+
+                if checkpointPath is not None:
+                    Checkpoints.startCheckpoint(checkpointPath, self.getJobParameters(), self.seed, self.finalMotion,
+                                                self.baseMotion)
 
             # Generate frames
-            self.generateFrames(outPath)
+            self.generateFrames(outPath, resumeState)
+
+            if checkpointPath is not None:
+                Checkpoints.removeCheckpoint(checkpointPath)
 
             return "synthesisSuccessful"
         except Exception as exception:
             print(exception)
             return "synthesisFailed"
 
+    def getJobParameters(self):
+        """
+        Collects everything that determines the frames of a job, to check if a checkpoint belongs to the job
+        Returns: The parameters as a dictionary
+
+        """
+        return {
+            "style": str(self.style),
+            "pulseAudio": Checkpoints.hashArray(self.pulseAudio),
+            "songSections": list(self.songSections),
+            "fps": self.fps,
+            "loopVideo": self.loopVideo,
+            "visualizeSections": self.visualizeSections,
+            "sectionSimilarity": self.sectionSimilarity,
+            "pointAmount": self.randomPointAmount,
+            "interpolationType": self.interpolationType,
+            "pulseReact": self.pulseReact,
+            "videoSmoothness": self.videoSmoothness,
+            "motionRandomness": self.motionRandomness,
+            "truncation": self.truncation,
+            "videoPath": self.videoPath,
+            "tarPath": self.tarPath,
+            "frameFormat": self.frameFormat,
+            "dedupTolerance": self.dedupTolerance,
+            "keyframeStride": self.keyframeStride,
+            "keyframePulseJump": self.keyframePulseJump,
+            "keyframeMaxDistance": self.keyframeMaxDistance,
+            "previewResolution": self.previewResolution,
+            "previewUpscale": self.previewUpscale,
+            "reuseTolerance": self.reuseTolerance,
+            "coarseResolution": self.coarseResolution,
+            "coarseTolerance": self.coarseTolerance
+        }
+
+    def getRenderParameters(self):
+        """
+        Collects everything besides the motion vectors that changes the pixels of a frame,
+        to check if the frames of the last render can be reused.
+        Blended and deduplicated frames are not exact, so the keyframe and dedup settings count as well
+        Returns: The parameters as a dictionary
+
+        """
+        return {
+            "style": str(self.style),
+            "previewResolution": self.previewResolution,
+            "previewUpscale": self.previewUpscale,
+            "coarseResolution": self.coarseResolution,
+            "coarseTolerance": self.coarseTolerance,
+            "keyframeStride": self.keyframeStride,
+            "keyframePulseJump": self.keyframePulseJump,
+            "keyframeMaxDistance": self.keyframeMaxDistance,
+            "dedupTolerance": self.dedupTolerance
+        }
+
+    def seedRandom(self):
+        """
+        Seeds the random generators of the motion vectors, so that the motion of a job can be reproduced.
+        Every job gets its own generators, because jobs run in concurrent threads and would otherwise
+        interleave their draws from the global generators
+        Returns: -
+
+        """
+        # Draw a seed from the global generator, so that consecutive jobs still get different motions
+        if self.seed is None:
+            self.seed = int(np.random.randint(2 ** 31))
+
+        self.numpyRandom = np.random.RandomState(self.seed)
+        self.pythonRandom = random.Random(self.seed)
+
     def styleganInit(self):
         """
-        Initializes the stylegan weights by loading the .pkl file onto the cuda/cpu device
+        Initializes the stylegan weights by loading the .pkl file onto the cuda/cpu device.
+        Loaded styles are kept in the model cache of the process, so later jobs with the same style reuse them
         Returns: -
 
         """
@@ -206,15 +400,63 @@ class BloomyDreams:
         else:
             weightsFile = style
 
-        # Load generator
-        print(f'Loading weights from {weightsFile}...')
-
         # Set device to CUDA GPU or CPU
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-        # Open the weights and load them onto the set device
-        with dnnlib.util.open_url(weightsFile) as pkl_file:
-            self.Gs = legacy.load_network_pkl(pkl_file)['G_ema'].to(device)  # type: ignore
+        # Exported generators only contain the generator weights and are memory-mapped instead of unpickled,
+        # which skips the discriminator and the source code embedded in the pickle
+        generatorFile = os.path.splitext(weightsFile)[0] + GENERATOR_EXTENSION
+        modelFile = generatorFile if os.path.exists(generatorFile) else weightsFile
+
+        # Only load the style if it is not cached yet, concurrent jobs with the same style share the loaded model
+        model = ModelCache.getCachedModel(style, modelFile, device, lambda: self.loadModel(modelFile, device))
+
+        self.Gs = model["Gs"]
+        self.plan = model["plan"]
+        self.frameMemory = model["frameMemory"]
+
+    def loadModel(self, modelFile, device):
+        """
+        Loads the generator of a style and prepares its synthesis on the device
+        Args:
+            modelFile: The exported generator or the .pkl file of the style
+            device: The torch device the generator runs on
+
+        Returns: Dictionary with the generator, its synthesis plan and the memory per frame
+
+        """
+        if modelFile.endswith(GENERATOR_EXTENSION):
+            print(f'Loading generator from {modelFile}...')
+            Gs = legacy.load_generator(modelFile, device)
+        else:
+            # Load generator
+            print(f'Loading weights from {modelFile}...')
+
+            # Open the weights
+            with dnnlib.util.open_url(modelFile) as pkl_file:
+                pickledGs = legacy.load_network_pkl(pkl_file)['G_ema']  # type: ignore
+
+            # Rebuild the generator from the current network code, because the code embedded
+            # in the pickle does not support inference features like precomputed styles
+            # The generator is frozen, because it is only used for inference
+            Gs = networks.Generator(*pickledGs.init_args, **pickledGs.init_kwargs).eval().requires_grad_(False)
+            misc.copy_params_and_buffers(pickledGs, Gs, require_all=True)
+
+            # Load the weights onto the set device
+            Gs = Gs.to(device)
+
+        # Benchmark the synthesis on this hardware at first use, afterwards the stored plan is reused
+        plan = Autotuner.getPlan(Gs, device)
+
+        # Size the batches by the available memory with the memory per frame from the style catalog,
+        # it is only measured for styles that are not in the catalog yet
+        styleInfo = StyleCatalog.getStyleInfo(self.style)
+        if styleInfo is not None and styleInfo.get("frameMemory"):
+            frameMemory = styleInfo["frameMemory"]
+        else:
+            frameMemory = BatchSizer.measureFrameMemory(Gs, device, Autotuner.applyPlan(plan))
+
+        return {"Gs": Gs, "plan": plan, "frameMemory": frameMemory}
 
     def generateMotionVectors(self):
         """
@@ -244,7 +486,7 @@ class BloomyDreams:
         pulseFactor = np.array([self.pulseReact] * self.numDimensions)
 
         # Randomly initialise directions of the added motion vectors
-        self.pulseDirection = np.array([random.choice([1, -1]) for _ in range(self.numDimensions)])
+        self.pulseDirection = np.array([self.pythonRandom.choice([1, -1]) for _ in range(self.numDimensions)])
 
         # Initialize motion based on frame amount and dimension count
         finalMotion = np.empty([self.numFrames, self.numDimensions])
@@ -254,7 +496,7 @@ class BloomyDreams:
         print("Syncing base motion to audio...")
 
         for f in range(self.numFrames):
-            randomDirectionFactor = np.array([(random.uniform(-1, 1) * self.motionRandomness
+            randomDirectionFactor = np.array([(self.pythonRandom.uniform(-1, 1) * self.motionRandomness
                                                + 1 * (1 - self.motionRandomness))
                                               for _ in range(self.numDimensions)])
 
@@ -297,6 +539,7 @@ class BloomyDreams:
             finalMotion[f] = baseMotion[f] + addedMotion
 
         self.finalMotion = finalMotion
+        self.baseMotion = np.asarray(baseMotion)
 
         if self.showPlots:
             self.plotDimensions(savePlots=False, plotFullPath=True)
@@ -336,7 +579,7 @@ class BloomyDreams:
             # Only generate vectors for section if section has frames (is longer than 1 / fps seconds)
             if numFramesInSection > 0:
                 # Generate vectors for start and end of section
-                randomPointStart = self.truncation * truncnorm.rvs(-2, 2, size=(1, self.numDimensions)).astype(np.float32)[
+                randomPointStart = self.truncation * truncnorm.rvs(-2, 2, size=(1, self.numDimensions), random_state=self.numpyRandom).astype(np.float32)[
                     0]
 
                 if self.loopVideo:
@@ -350,7 +593,7 @@ class BloomyDreams:
                                            + randomPointStart * (1 - self.sectionSimilarity)
 
                 # Depending on section similarity, bring the end vector closer to the start vector
-                randomPointEnd = self.truncation * truncnorm.rvs(-2, 2, size=(1, self.numDimensions)).astype(np.float32)[0]
+                randomPointEnd = self.truncation * truncnorm.rvs(-2, 2, size=(1, self.numDimensions), random_state=self.numpyRandom).astype(np.float32)[0]
                 randomPointEnd = randomPointStart * self.sectionSimilarity \
                                  + randomPointEnd * (1 - self.sectionSimilarity)
 
@@ -380,7 +623,7 @@ class BloomyDreams:
 
         # Truncation limits the min/max values in the random vector
         # Initialise vectors
-        randomPoints = [self.truncation * truncnorm.rvs(-2, 2, size=(1, self.numDimensions)).astype(np.float32)[0]
+        randomPoints = [self.truncation * truncnorm.rvs(-2, 2, size=(1, self.numDimensions), random_state=self.numpyRandom).astype(np.float32)[0]
                         for _ in range(numRandomPoints)]
         # Use a gaussian distribution of the dimension values
         # randomPoints = [np.array([random.gauss(0, 0.5) for _ in range(self.input_shape)], dtype=float)
@@ -451,65 +694,598 @@ class BloomyDreams:
 
         plt.show()
 
-    def generateFrames(self, path):
+    def generateFrames(self, path, resumeState=None):
         """
         Generates GAN output for each frame of the video
         Feeds the vector motion to the network frame by frame
-        and saves the generated images
+        and saves the generated images or encodes them into the video
         Args:
             path: Path to the output folder of the frames
+            resumeState: Sink state of a checkpoint, the frames it contains are not generated again
 
         Returns: -
 
         """
         print("Hallucinating (Generating frames)...")
 
+        # Frames are encoded and written in the background while the next batches are synthesized
+        frameSink = self.createFrameSink(path, resumeState)
+
+        # Keep the frames for the next render of the job
+        # A resumed render does not have the frames of the interrupted one, so it can not fill the cache
+        cacheSink = None
+        if self.renderCachePath is not None and resumeState is None:
+            cacheSink = RenderCache.createCacheSink(self.renderCachePath)
+            frameSink = FrameSinks.TeeFrameSink([frameSink, cacheSink])
+
+        try:
+            self.renderFrames(frameSink)
+        except Exception:
+            frameSink.cancel()
+            if cacheSink is not None:
+                RenderCache.discardCacheSink(self.renderCachePath)
+            raise
+
+        # Wait until the last frames are written
+        frameSink.close()
+
+        if cacheSink is not None:
+            RenderCache.commitRenderCache(self.renderCachePath, self.getRenderParameters(), self.seed,
+                                          np.asarray(self.finalMotion, dtype=np.float32), cacheSink.frameShape)
+
+    def createFrameSink(self, path, resumeState=None):
+        """
+        Creates the sink that stores the frames, which is a video encoder if a video path is set,
+        a tar archive if a tar path is set and a folder of frame files otherwise
+        Args:
+            path: Path to the output folder of the frames
+            resumeState: Sink state of a checkpoint to continue from
+
+        Returns: The frame sink
+
+        """
+        if self.videoPath is not None:
+            print("Encoding frames to {}...".format(self.videoPath))
+
+            # Only use as much audio as there are frames
+            return FrameSinks.VideoFrameSink(self.videoPath, self.fps, audioPath=self.audioPath,
+                                             audioStart=self.audioStart, audioDuration=self.numFrames / self.fps,
+                                             resumeState=resumeState)
+
+        if self.tarPath is not None:
+            print("Packing frames into {}...".format(self.tarPath))
+
+            # The archive contains the frames in a folder named like the output folder
+            return FrameSinks.TarFrameSink(self.tarPath, os.path.basename(os.path.normpath(path)),
+                                           frameFormat=self.frameFormat, resumeState=resumeState)
+
+        return FrameSinks.createFrameSink(path, self.frameFormat, numFrames=len(self.finalMotion),
+                                          resumeState=resumeState)
+
+    def renderFrames(self, frameSink):
+        """
+        Generates all frames of the video and passes them on to the frame sink.
+        Frames whose motion vectors did not change since the last render of the job are taken from the render cache,
+        only the changed ranges are synthesized
+        Args:
+            frameSink: The sink that stores the finished frames
+
+        Returns: -
+
+        """
+        numFrames = len(self.finalMotion)
+
+        # Convert the motion vectors to float32 once
+        motion = np.ascontiguousarray(self.finalMotion, dtype=np.float32)
+        baseMotion = None
+        if self.coarseResolution is not None:
+            baseMotion = np.ascontiguousarray(self.baseMotion, dtype=np.float32)
+
+        # Compare the motion vectors with the last render
+        reusableFrames = RenderCache.findReusableFrames(self.renderCache, motion, self.reuseTolerance)
+        if reusableFrames.any():
+            print("Reusing {} of {} frames from the last render".format(int(reusableFrames.sum()), numFrames))
+
+        # Continue after the frames the sink already holds from an interrupted job
+        if frameSink.completedFrames > 0:
+            print("Skipping {} frames that were already generated".format(frameSink.completedFrames))
+
+        progressBar = tqdm(total=numFrames, initial=frameSink.completedFrames, position=0, leave=True)
+        self.lastCheckpoint = time.time()
+
+        # Split the video into ranges of reusable and changed frames
+        rangeBounds = [0] + (np.flatnonzero(np.diff(reusableFrames.astype(np.int8))) + 1).tolist() + [numFrames]
+
+        for rangeStart, rangeEnd in zip(rangeBounds[:-1], rangeBounds[1:]):
+            if rangeEnd <= frameSink.completedFrames:
+                continue
+
+            if reusableFrames[rangeStart]:
+                self.copyCachedFrames(frameSink, rangeStart, rangeEnd, progressBar)
+            else:
+                self.renderRange(frameSink, motion, baseMotion, rangeStart, rangeEnd, progressBar)
+
+        progressBar.close()
+
+    def copyCachedFrames(self, frameSink, rangeStart, rangeEnd, progressBar):
+        """
+        Passes a range of frames from the render cache on to the frame sink
+        Args:
+            frameSink: The sink that stores the finished frames
+            rangeStart: First frame of the range
+            rangeEnd: End of the range (exclusive)
+            progressBar: Progress bar of all frames
+
+        Returns: -
+
+        """
+        pieceSize = self.plan["batchSize"]
+
+        for pieceStart in range(max(rangeStart, frameSink.completedFrames), rangeEnd, pieceSize):
+            pieceEnd = min(pieceStart + pieceSize, rangeEnd)
+            frameSink.write(pieceStart, RenderCache.loadCachedFrames(self.renderCachePath, self.renderCache,
+                                                                     pieceStart, pieceEnd))
+
+            progressBar.update(pieceEnd - pieceStart)
+            self.recordProgress(frameSink)
+
+    def renderRange(self, frameSink, motion, baseMotion, rangeStart, rangeEnd, progressBar):
+        """
+        Synthesizes a range of frames batch by batch and passes them on to the frame sink
+        Only the frames selected by planFrames are synthesized, all other frames are copies or blends of them
+        Args:
+            frameSink: The sink that stores the finished frames
+            motion: The float32 motion vectors of all frames
+            baseMotion: The float32 base motion vectors of all frames, only used with a coarse resolution
+            rangeStart: First frame of the range
+            rangeEnd: End of the range (exclusive)
+            progressBar: Progress bar of all frames
+
+        Returns: -
+
+        """
         # Setting synthesis arguments for the generator
-        GsSynKWArgs = {'noise_mode': 'const'}  # random, const, None
+        # The tuned plan decides how the modulated convolutions and custom ops are executed
+        GsSynKWArgs = {'noise_mode': 'const', **Autotuner.applyPlan(self.plan)}  # noise_mode: random, const, None
+
+        # Previews skip the blocks above the preview resolution, styles of lower resolution are rendered fully
+        stopResolution = self.Gs.img_resolution
+        if self.previewResolution is not None:
+            stopResolution = min(self.previewResolution, self.Gs.img_resolution)
+            GsSynKWArgs.update(stop_resolution=stopResolution, upscale=self.previewUpscale)
 
         # Sets the device to generate on
         # If cuda kernels are available use gpu, otherwise use cpu
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-        # Define vector-batch size and amount of batches
-        batchSize = 14
-        numBatches = math.ceil(len(self.finalMotion)/batchSize)
+        # Define the largest vector-batch size, the batches can get smaller if memory runs low
+        maxBatchSize = self.plan["batchSize"]
+        numFrames = rangeEnd - rangeStart
+
+        # Decide which frames of the range are synthesized and how the other frames are made from them
+        # All indices below are relative to the start of the range
+        motion = motion[rangeStart:rangeEnd]
+        pulse = np.asarray(self.pulseAudio[rangeStart:rangeEnd], dtype=np.float32)
+        renderedFrames, sourceA, sourceB, blendWeights = self.planFrames(motion, pulse)
+        renderedMotion = motion[renderedFrames]
+        numRendered = len(renderedFrames)
+
+        if numRendered < numFrames:
+            print("Synthesizing {} of {} frames".format(numRendered, numFrames))
+
+        # The coarse layers of ws are mapped from the base motion, so the audio only changes the fine details
+        # The coarse blocks then only change with the slowly moving base motion and their outputs are
+        # synthesized once per run of frames with the same base motion vector
+        numCoarseWs = 0
+        coarseRuns = None
+        if baseMotion is not None:
+            coarseResolution = min(self.coarseResolution, self.Gs.img_resolution // 2)
+            numCoarseWs = self.Gs.synthesis.count_ws(coarseResolution)
+            renderedBaseMotion = baseMotion[rangeStart:rangeEnd][renderedFrames]
+
+            # Previews that stop at the coarse blocks have no fine blocks to run separately
+            # Only the 'skip' architecture passes a complete partial image on to the fine blocks
+            coarseBlock = getattr(self.Gs.synthesis, "b{}".format(coarseResolution))
+            if coarseResolution < stopResolution and coarseBlock.architecture == "skip":
+                coarseRuns = self.findCoarseRuns(renderedBaseMotion)
+                coarseKWArgs = {'noise_mode': 'const', **Autotuner.applyPlan(self.plan),
+                                'stop_resolution': coarseResolution}
+                GsSynKWArgs['start_resolution'] = coarseResolution * 2
+                print("Synthesizing the coarse blocks {} times for {} frames".format(
+                    int(coarseRuns[-1]) + 1, numRendered))
+
+        # Block outputs of the last coarse run of the previous batch
+        coarseCache = None
+
+        # Amount of frames whose layer styles are precomputed at once
+        # Computing the styles of many frames together replaces dozens of small matrix
+        # multiplications per batch with a few large ones
+        styleChunkSize = maxBatchSize * 16
+        wChunk = None
+        styleChunk = None
+        chunkStart = 0
+        chunkEnd = 0
+
+        # Reuse a single (pinned) host buffer for all chunks, so that no memory is allocated
+        # on the host while rendering and copies to the GPU run asynchronously
+        motionBuffer = torch.empty([styleChunkSize, motion.shape[1]], dtype=torch.float32,
+                                   pin_memory=(device.type == "cuda"))
+        baseMotionBuffer = None
+        if baseMotion is not None:
+            baseMotionBuffer = torch.empty([styleChunkSize, motion.shape[1]], dtype=torch.float32,
+                                           pin_memory=(device.type == "cuda"))
+
+        batchSize = maxBatchSize
+
+        # Continue after the frames the sink already holds from an interrupted job
+        nextFrame = max(frameSink.completedFrames - rangeStart, 0)
+
+        # Batches run over the synthesized frames, starting with the first one the next frame is made from
+        batchStart = int(sourceA[nextFrame]) if nextFrame < numFrames else numRendered
+
+        # Last synthesized frame of the previous batch, the first frames of a batch can be blended from it
+        previousFrame = None
 
         # Generate all frames
-        for i in tqdm(range(numBatches), position=0, leave=True):
-            # Obtain current motion vector batch
-            if i == numBatches - 1:
-                motionBatch = np.array(self.finalMotion[i * batchSize:len(self.finalMotion)])
+        while batchStart < numRendered:
+            # Map the next chunk of motion vectors onto the w-space and precompute its styles
+            # The inference entry points of the generator run without any gradient bookkeeping
+            if batchStart >= chunkEnd:
+                chunkStart = batchStart
+                chunkEnd = min(chunkStart + styleChunkSize, numRendered)
+
+                # Load motion chunk into the host buffer
+                motionChunk = motionBuffer[:chunkEnd - chunkStart]
+                motionChunk.copy_(torch.from_numpy(renderedMotion[chunkStart:chunkEnd]))
+
+                # Mapping the motion chunk onto the w-space
+                if baseMotionBuffer is not None:
+                    baseMotionChunk = baseMotionBuffer[:chunkEnd - chunkStart]
+                    baseMotionChunk.copy_(torch.from_numpy(renderedBaseMotion[chunkStart:chunkEnd]))
+                    wChunk, styleChunk = self.Gs.infer_styles(motionChunk, coarse_z=baseMotionChunk,
+                                                              num_coarse_ws=numCoarseWs)
+                else:
+                    wChunk, styleChunk = self.Gs.infer_styles(motionChunk)
+
+                # Size the batches by the memory that is currently available
+                batchSize = BatchSizer.getBatchSize(self.frameMemory, device, maxBatchSize)
+
+            # Obtain the w-vectors and styles of the current batch
+            batchEnd = min(batchStart + batchSize, chunkEnd)
+            wBatch = wChunk[batchStart - chunkStart:batchEnd - chunkStart]
+            styleBatch = self.sliceStyles(styleChunk, batchStart - chunkStart, batchEnd - chunkStart)
+
+            # Synthesize the coarse blocks once per coarse run, all frames of a run continue from their outputs
+            featureBatch = None
+            if coarseRuns is not None:
+                featureBatch, coarseCache = self.synthesizeCoarseFeatures(wBatch, styleBatch,
+                                                                          coarseRuns[batchStart:batchEnd],
+                                                                          coarseCache, coarseKWArgs)
+
+            # Start the synthesis
+            frameBatch, fittingBatchSize = self.synthesizeBatch(wBatch, styleBatch, GsSynKWArgs, device,
+                                                                featureBatch)
+
+            # Keep the following batches small enough if the device ran out of memory
+            if fittingBatchSize < len(wBatch):
+                maxBatchSize = fittingBatchSize
+                batchSize = fittingBatchSize
+
+            # All frames whose sources have been synthesized can be finished now
+            # A resumed job can start at a blended frame, whose second source is not in a batch of one frame yet,
+            # the frames before the next frame have already been written and must not be written again
+            emitEnd = max(int(np.searchsorted(sourceB, batchEnd, side="left")), nextFrame)
+
+            # Prepend the last frame of the previous batch if the first frames are blended from it
+            if nextFrame < emitEnd and sourceA[nextFrame] < batchStart:
+                sourceFrames = np.concatenate([previousFrame[np.newaxis], frameBatch])
+                sourceOffset = batchStart - 1
             else:
-                motionBatch = np.array(self.finalMotion[i * batchSize:(i + 1) * batchSize])
+                sourceFrames = frameBatch
+                sourceOffset = batchStart
+
+            # Hand the frames over to the sink, which stores them in the background
+            if emitEnd - nextFrame == len(frameBatch) and sourceFrames is frameBatch and \
+                    np.array_equal(sourceA[nextFrame:emitEnd], np.arange(batchStart, batchEnd)) and \
+                    not blendWeights[nextFrame:emitEnd].any():
+                frameSink.write(rangeStart + nextFrame, frameBatch)
+            else:
+                # Write the copied and blended frames in pieces, so that they never need much memory
+                for pieceStart in range(nextFrame, emitEnd, maxBatchSize):
+                    pieceEnd = min(pieceStart + maxBatchSize, emitEnd)
+                    frameSink.write(rangeStart + pieceStart,
+                                    self.composeFrames(sourceFrames,
+                                                       sourceA[pieceStart:pieceEnd] - sourceOffset,
+                                                       sourceB[pieceStart:pieceEnd] - sourceOffset,
+                                                       blendWeights[pieceStart:pieceEnd]))
+
+            progressBar.update(emitEnd - nextFrame)
+            nextFrame = emitEnd
+            previousFrame = frameBatch[-1]
+            batchStart = batchEnd
+
+            self.recordProgress(frameSink)
+
+            del sourceFrames
+            del frameBatch
+            del styleBatch
+            del featureBatch
+
+    def recordProgress(self, frameSink):
+        """
+        Records which frames are durably written, so that an interrupted job can continue from there
+        Checkpoints are only recorded if the last one is older than the checkpoint interval
+        Args:
+            frameSink: The sink that stores the finished frames
 
-            # Load motion batch to device
-            motionBatch = torch.from_numpy(motionBatch).to(device)
+        Returns: -
 
-            # Mapping the motion batch onto the w-space
-            wBatch = self.Gs.mapping(motionBatch, motionBatch)
+        """
+        if self.checkpointPath is None or time.time() - self.lastCheckpoint <= Checkpoints.CHECKPOINT_INTERVAL:
+            return
 
-            # Start the synthesis
-            # Disable gradient calculation for generation mode
-            # Because we are not in training mode for the GAN, this reduces memory consumption
-            with torch.no_grad():
-                imageBatch = self.Gs.synthesis(wBatch, **GsSynKWArgs, force_fp32=True).detach().cpu()
+        sinkState = frameSink.checkpoint()
+        if sinkState is not None:
+            Checkpoints.saveProgress(self.checkpointPath, sinkState)
+
+        self.lastCheckpoint = time.time()
+
+    def planFrames(self, motion, pulse):
+        """
+        Decides which frames are synthesized and how every frame of the video is made from them.
+        Keyframes are selected by selectKeyframes, the frames between two keyframes are blended from them.
+        Consecutive keyframes with the same motion vector within the dedup tolerance are only synthesized once,
+        so quiet parts of the song, which often keep the same motion vector for many frames, cost almost nothing.
+        Args:
+            motion: The motion vectors of all frames
+            pulse: The pulse of all frames
+
+        Returns: The indices of the synthesized frames and for every frame of the video
+                 the two synthesized frames it is blended from and the weight of the second one
+
+        """
+        numFrames = len(motion)
+        keyframes = self.selectKeyframes(motion, pulse)
+
+        # Each keyframe is synthesized unless it is a duplicate of the last synthesized keyframe
+        # Comparing with the first frame of a run keeps the difference within the tolerance, even if the motion drifts
+        renderedFrames = []
+        keyframeSources = np.empty(len(keyframes), dtype=np.int64)
+        for k, keyframe in enumerate(keyframes):
+            if not renderedFrames or self.dedupTolerance is None or \
+                    np.abs(motion[keyframe] - motion[renderedFrames[-1]]).max() > self.dedupTolerance:
+                renderedFrames.append(keyframe)
+
+            keyframeSources[k] = len(renderedFrames) - 1
+
+        # Find the keyframes before and after every frame
+        frames = np.arange(numFrames)
+        previousKeyframe = np.searchsorted(keyframes, frames, side="right") - 1
+        nextKeyframe = np.minimum(previousKeyframe + 1, len(keyframes) - 1)
+
+        sourceA = keyframeSources[previousKeyframe]
+        sourceB = keyframeSources[nextKeyframe]
+
+        # Keyframes themselves and frames between two copies of the same synthesized frame are not blended
+        keyframeGaps = np.maximum(keyframes[nextKeyframe] - keyframes[previousKeyframe], 1)
+        blendWeights = ((frames - keyframes[previousKeyframe]) / keyframeGaps).astype(np.float32)
+        blendWeights[sourceA == sourceB] = 0
+        sourceB[blendWeights == 0] = sourceA[blendWeights == 0]
+
+        return np.array(renderedFrames, dtype=np.int64), sourceA, sourceB, blendWeights
+
+    def selectKeyframes(self, motion, pulse):
+        """
+        Selects the frames that are synthesized if only every k-th frame is rendered, e.g. on a cpu.
+        Frames at large pulse jumps are always selected, so that beats are not blurred by the blending.
+        If the motion vectors of two keyframes are too far apart to be blended, additional keyframes are selected
+        between them until they are close enough
+        Args:
+            motion: The motion vectors of all frames
+            pulse: The pulse of all frames
+
+        Returns: The sorted indices of the keyframes
+
+        """
+        numFrames = len(motion)
+
+        if self.keyframeStride <= 1 or numFrames < 2:
+            return np.arange(numFrames)
+
+        # Every k-th frame and the last frame
+        keyframes = set(range(0, numFrames, self.keyframeStride))
+        keyframes.add(numFrames - 1)
+
+        # Both frames around a jump of the pulse
+        jumps = np.nonzero(np.abs(np.diff(pulse)) > self.keyframePulseJump)[0]
+        keyframes.update(jumps.tolist())
+        keyframes.update((jumps + 1).tolist())
+
+        keyframes = sorted(keyframes)
+
+        # Split the gaps between keyframes that are too far apart in the latent space
+        selectedKeyframes = [keyframes[0]]
+        for keyframe in keyframes[1:]:
+            self.splitKeyframeGap(motion, selectedKeyframes[-1], keyframe, selectedKeyframes)
+
+        return np.array(selectedKeyframes, dtype=np.int64)
+
+    def splitKeyframeGap(self, motion, start, end, keyframes):
+        """
+        Appends the end keyframe and, if the gap to the start keyframe is too far to be blended,
+        the keyframes in the middle of the gap, recursively
+        Args:
+            motion: The motion vectors of all frames
+            start: The keyframe before the gap, already selected
+            end: The keyframe after the gap
+            keyframes: The list of selected keyframes to append to
+
+        Returns: -
+
+        """
+        distance = np.sqrt(np.mean(np.square(motion[end] - motion[start])))
+
+        if end - start > 1 and distance > self.keyframeMaxDistance:
+            middle = (start + end) // 2
+            self.splitKeyframeGap(motion, start, middle, keyframes)
+            self.splitKeyframeGap(motion, middle, end, keyframes)
+        else:
+            keyframes.append(end)
+
+    def findCoarseRuns(self, baseMotion):
+        """
+        Groups consecutive frames whose base motion vectors are the same within the coarse tolerance.
+        The frames of a run share the outputs of the coarse blocks
+        Args:
+            baseMotion: The base motion vectors of the synthesized frames
+
+        Returns: The index of the run of every frame, counting up from 0
+
+        """
+        runs = np.empty(len(baseMotion), dtype=np.int64)
+        runStart = 0
+        run = 0
+
+        # Comparing with the first frame of a run keeps the difference within the tolerance, even if the motion drifts
+        for f in range(len(baseMotion)):
+            if np.abs(baseMotion[f] - baseMotion[runStart]).max() > self.coarseTolerance:
+                runStart = f
+                run += 1
 
-            # Save the image in the batch
-            for j, image in enumerate(imageBatch):
-                imageIndex = i * batchSize + j
+            runs[f] = run
 
-                # Clamping RGB Values
-                # TODO understand what happens here
-                image = (image.permute(1, 2, 0) * 127.5 + 128).clamp(0, 255).to(torch.uint8).squeeze(0)
-                array = np.array(image)
+        return runs
 
-                # Turning into image from RGB array
-                finalImage = Image.fromarray(array, 'RGB')
+    def synthesizeCoarseFeatures(self, wBatch, styleBatch, runs, coarseCache, coarseKWArgs):
+        """
+        Synthesizes the outputs of the coarse blocks once for every coarse run of a batch
+        Args:
+            wBatch: The w-vectors of the batch
+            styleBatch: The precomputed layer styles of the batch
+            runs: The coarse run of every frame of the batch
+            coarseCache: Run and block outputs of the last run of the previous batch, or None
+            coarseKWArgs: Keyword arguments for the synthesis network that stop after the coarse blocks
+
+        Returns: The block outputs (x, img) for every frame of the batch
+                 and the run and block outputs of the last run of the batch
+
+        """
+        # Runs are numbered in order, so the first frame of every run is found by a sorted unique
+        batchRuns, runStarts, frameRuns = np.unique(runs, return_index=True, return_inverse=True)
+
+        # The first run may continue the last run of the previous batch
+        cachedFeatures = []
+        if coarseCache is not None and batchRuns[0] == coarseCache[0]:
+            cachedFeatures = [coarseCache[1]]
+            runStarts = runStarts[1:]
+
+        newFeatures = []
+        if len(runStarts) > 0:
+            firstFrames = torch.as_tensor(runStarts, device=wBatch.device)
+            newFeatures = [self.Gs.infer_images(wBatch[firstFrames], styles=self.selectStyles(styleBatch, firstFrames),
+                                                return_features=True, force_fp32=True, **coarseKWArgs)]
+
+        x, img = [torch.cat(features) for features in zip(*(cachedFeatures + newFeatures))]
+
+        # Repeat the outputs of every run for its frames
+        frameRuns = torch.as_tensor(frameRuns, device=x.device)
+        featureBatch = (x[frameRuns], img[frameRuns])
+
+        return featureBatch, (int(batchRuns[-1]), (x[-1:], img[-1:]))
+
+    def composeFrames(self, sourceFrames, sourceA, sourceB, blendWeights):
+        """
+        Makes frames from synthesized frames, either as copy or as blend of two of them
+        Args:
+            sourceFrames: The synthesized uint8 RGB frames of shape [N, H, W, 3]
+            sourceA: Index of the first source frame of every frame
+            sourceB: Index of the second source frame of every frame
+            blendWeights: Weight of the second source frame of every frame
+
+        Returns: The uint8 RGB frames
+
+        """
+        frames = sourceFrames[sourceA]
+        blended = blendWeights > 0
+
+        if blended.any():
+            weights = blendWeights[blended].reshape(-1, 1, 1, 1)
+            mix = frames[blended] * (1 - weights) + sourceFrames[sourceB[blended]] * weights
+            frames[blended] = np.rint(mix).astype(np.uint8)
+
+        return frames
+
+    def synthesizeBatch(self, wBatch, styleBatch, synthesisKWArgs, device, featureBatch=None):
+        """
+        Synthesizes a batch of frames.
+        If the device runs out of memory, the batch is split in half and each half is synthesized on its own
+        Args:
+            wBatch: The w-vectors of the batch
+            styleBatch: The precomputed layer styles of the batch
+            synthesisKWArgs: Keyword arguments for the synthesis network
+            device: The torch device the synthesis runs on
+            featureBatch: Outputs (x, img) of the coarse blocks for every frame, if the synthesis starts after them
 
-                # Storing image with index
-                file_name = 'img' + str(imageIndex).zfill(4)
-                finalImage.save(os.path.join(path, file_name + '.png'))
+        Returns: The uint8 RGB frames of the batch as array of shape [N, H, W, 3]
+                 and the largest batch size that fit into memory
 
-            del imageBatch
-            del motionBatch
+        """
+        try:
+            if featureBatch is not None:
+                imageBatch = self.Gs.infer_images(wBatch, styles=styleBatch, x=featureBatch[0], img=featureBatch[1],
+                                                  **synthesisKWArgs, force_fp32=True)
+            else:
+                imageBatch = self.Gs.infer_images(wBatch, styles=styleBatch, **synthesisKWArgs, force_fp32=True)
+
+            # Map the [-1, 1] output range to RGB values for the whole batch at once,
+            # on the device so that only the uint8 frames are copied to the cpu
+            frameBatch = (imageBatch.permute(0, 2, 3, 1) * 127.5 + 128).clamp(0, 255).to(torch.uint8).cpu().numpy()
+            return frameBatch, len(wBatch)
+        except RuntimeError as exception:
+            if not Autotuner.isOutOfMemory(exception) or len(wBatch) == 1:
+                raise
+
+        # Release the memory of the failed attempt before retrying
+        if device.type == "cuda":
+            torch.cuda.empty_cache()
+
+        half = len(wBatch) // 2
+        print("Out of memory - Retrying with batch size {}".format(half))
+
+        firstFeatures = secondFeatures = None
+        if featureBatch is not None:
+            firstFeatures = tuple(features[:half] for features in featureBatch)
+            secondFeatures = tuple(features[half:] for features in featureBatch)
+
+        firstFrames, firstBatchSize = self.synthesizeBatch(wBatch[:half], self.sliceStyles(styleBatch, 0, half),
+                                                           synthesisKWArgs, device, firstFeatures)
+        secondFrames, secondBatchSize = self.synthesizeBatch(wBatch[half:],
+                                                             self.sliceStyles(styleBatch, half, len(wBatch)),
+                                                             synthesisKWArgs, device, secondFeatures)
+
+        return np.concatenate([firstFrames, secondFrames]), min(firstBatchSize, secondBatchSize)
+
+    def sliceStyles(self, styles, start, end):
+        """
+        Selects a range of frames from precomputed layer styles
+        Args:
+            styles: Layer styles as returned by compute_styles of the synthesis network
+            start: First frame of the range
+            end: End of the range (exclusive)
+
+        Returns: The layer styles of the range
+
+        """
+        return [[layerStyles[start:end] for layerStyles in blockStyles] for blockStyles in styles]
+
+    def selectStyles(self, styles, indices):
+        """
+        Selects single frames from precomputed layer styles
+        Args:
+            styles: Layer styles as returned by compute_styles of the synthesis network
+            indices: Index tensor of the frames
+
+        Returns: The layer styles of the frames
+
+        """
+        return [[layerStyles[indices] for layerStyles in blockStyles] for blockStyles in styles]
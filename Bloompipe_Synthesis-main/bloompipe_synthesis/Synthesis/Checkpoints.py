@@ -0,0 +1,174 @@
+# ===== Inits + Definitions =========================
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+from stylegan2 import dnnlib
+
+"""
+This module stores the progress of a synthesis job, so that an interrupted job can continue
+from its last durably written frames instead of starting over from the first frame.
+A checkpoint is a folder containing the motion vectors of the job and a progress file with the
+job parameters, the random seed and the state of the frame sink.
+A checkpoint is only used again if the parameters of the restarted job are identical.
+"""
+
+# ===== Global-Variables =========================
+
+# Files inside the checkpoint folder
+PROGRESS_FILENAME = "progress.json"
+MOTION_FILENAME = "motion.npy"
+BASE_MOTION_FILENAME = "baseMotion.npy"
+
+# Minimum time between two checkpoints in seconds
+CHECKPOINT_INTERVAL = 30.0
+
+
+# ===== Methods =========================
+
+def hashArray(values):
+    """
+    Hashes an array of values, e.g. the audio data of a job, to compare it without storing it
+    Args:
+        values: The values as array or list
+
+    Returns: The hex digest of the values
+
+    """
+    return hashlib.sha1(np.ascontiguousarray(values, dtype=np.float64).tobytes()).hexdigest()
+
+
+def startCheckpoint(checkpointPath, parameters, seed, motion, baseMotion=None):
+    """
+    Creates a new checkpoint for a job whose frames have not been rendered yet
+    Args:
+        checkpointPath: Folder of the checkpoint
+        parameters: The job parameters as JSON serializable dictionary
+        seed: The random seed of the motion vectors
+        motion: The motion vectors of all frames
+        baseMotion: The base motion vectors of all frames, without the audio motion
+
+    Returns: -
+
+    """
+    os.makedirs(checkpointPath, exist_ok=True)
+
+    writeArray(os.path.join(checkpointPath, MOTION_FILENAME), motion)
+
+    if baseMotion is not None:
+        writeArray(os.path.join(checkpointPath, BASE_MOTION_FILENAME), baseMotion)
+
+    writeProgress(checkpointPath, {"parameters": parameters, "seed": seed, "sinkState": None})
+
+
+def saveProgress(checkpointPath, sinkState):
+    """
+    Records which frames have been durably written
+    Args:
+        checkpointPath: Folder of the checkpoint
+        sinkState: The state returned by checkpoint() of the frame sink
+
+    Returns: -
+
+    """
+    progress = readProgress(checkpointPath)
+
+    if progress is None:
+        return
+
+    progress["sinkState"] = sinkState
+    writeProgress(checkpointPath, progress)
+
+
+def loadCheckpoint(checkpointPath, parameters):
+    """
+    Loads the checkpoint of a job if it belongs to the same parameters
+    Args:
+        checkpointPath: Folder of the checkpoint
+        parameters: The parameters of the current job
+
+    Returns: Dictionary with seed, motion, baseMotion and sinkState, or None if there is no matching checkpoint
+
+    """
+    progress = readProgress(checkpointPath)
+    motionPath = os.path.join(checkpointPath, MOTION_FILENAME)
+
+    if progress is None or not os.path.exists(motionPath):
+        return None
+
+    # Compare through JSON, so that tuples and lists are treated the same
+    if progress["parameters"] != json.loads(json.dumps(parameters)):
+        print("Checkpoint belongs to different parameters - Starting over")
+        return None
+
+    baseMotionPath = os.path.join(checkpointPath, BASE_MOTION_FILENAME)
+
+    return {
+        "seed": progress["seed"],
+        "motion": np.load(motionPath),
+        "baseMotion": np.load(baseMotionPath) if os.path.exists(baseMotionPath) else None,
+        "sinkState": progress["sinkState"]
+    }
+
+
+def removeCheckpoint(checkpointPath):
+    """
+    Removes the checkpoint once the job is done
+    Args:
+        checkpointPath: Folder of the checkpoint
+
+    Returns: -
+
+    """
+    shutil.rmtree(checkpointPath, ignore_errors=True)
+
+
+def readProgress(checkpointPath):
+    """
+    Reads the progress file of a checkpoint
+    Args:
+        checkpointPath: Folder of the checkpoint
+
+    Returns: The progress as dictionary or None if it does not exist
+
+    """
+    progressPath = os.path.join(checkpointPath, PROGRESS_FILENAME)
+
+    if not os.path.exists(progressPath):
+        return None
+
+    try:
+        with open(progressPath, "r") as file:
+            return json.load(file)
+    except ValueError:
+        return None
+
+
+def writeArray(path, values):
+    """
+    Writes an array durably, replacing the file atomically so that a crash never leaves a partial file
+    Args:
+        path: Path of the .npy file
+        values: The array
+
+    Returns: -
+
+    """
+    with dnnlib.util.atomic_write(path, "wb") as file:
+        np.save(file, values)
+
+
+def writeProgress(checkpointPath, progress):
+    """
+    Writes the progress file of a checkpoint, replacing it atomically so that a crash never leaves a partial file
+    Args:
+        checkpointPath: Folder of the checkpoint
+        progress: The progress as dictionary
+
+    Returns: -
+
+    """
+    with dnnlib.util.atomic_write(os.path.join(checkpointPath, PROGRESS_FILENAME)) as file:
+        json.dump(progress, file, indent=2)
@@ -0,0 +1,890 @@
+# ===== Inits + Definitions =========================
+import io
+import os
+import json
+import time
+import zlib
+import queue
+import shutil
+import tarfile
+import threading
+import subprocess
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+import FrameWriter
+from stylegan2 import dnnlib
+
+"""
+This module contains the frame sinks, which take the finished frames of the synthesis
+and store them while the generator keeps working on the next batches.
+Every sink provides write(startIndex, frames) for a batch of uint8 RGB frames of shape [N, H, W, 3]
+and close() once all frames have been written.
+The intermediate frames can be stored in different formats, the sinks record the format in a manifest
+next to the frames, so that the video step knows how to read them.
+Resumable sinks provide checkpoint(), which makes the completed frames durable and returns a state,
+from which a new sink continues after an interrupted job when it is passed as resumeState.
+"""
+
+# ===== Global-Variables =========================
+
+# Processes that encode and write frames in parallel to the synthesis
+NUM_WRITER_PROCESSES = max(1, min(8, (os.cpu_count() or 2) // 2))
+
+# Frames that may be queued for writing before the synthesis has to wait
+MAX_PENDING_FRAMES = NUM_WRITER_PROCESSES * 4
+
+# Batches that may be queued for the video encoder before the synthesis has to wait
+MAX_PENDING_BATCHES = 4
+
+# Video encoding settings
+FFMPEG_BINARY = "ffmpeg"
+VIDEO_CODEC_ARGS = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-pix_fmt", "yuv420p"]
+AUDIO_CODEC_ARGS = ["-c:a", "aac", "-b:a", "192k"]
+
+# Formats in which the intermediate frames can be stored
+# png: png files with the default compression of PIL
+# fastPng: png files with the fastest compression, larger but much cheaper to encode
+# zlib: raw RGB bytes compressed with the fastest zlib level, the frame size is given by the manifest
+# npy: all frames uncompressed in a single memory-mapped npy file of shape [N, H, W, 3]
+FRAME_FORMATS = {
+    "png": {"extension": ".png", "compressLevel": 6},
+    "fastPng": {"extension": ".png", "compressLevel": 1},
+    "zlib": {"extension": ".rgb.zz", "compressLevel": 1},
+    "npy": {"extension": ".npy"}
+}
+
+# Name of the manifest that describes the stored frames
+MANIFEST_FILENAME = "manifest.json"
+
+# Name of the npy file of the npy format
+NPY_FILENAME = "frames.npy"
+
+# The writer processes are shared by all jobs of this service
+writerPool = None
+writerPoolLock = threading.Lock()
+
+
+# ===== Methods =========================
+
+def getWriterPool():
+    """
+    Returns the process pool that encodes and writes frames, creating it at first use
+    Returns: The process pool
+
+    """
+    global writerPool
+
+    with writerPoolLock:
+        if writerPool is None:
+            # Spawned processes do not inherit locks held by other threads of the service,
+            # they only import FrameWriter, which is outside of the package and does not load torch
+            writerPool = ProcessPoolExecutor(max_workers=NUM_WRITER_PROCESSES,
+                                             mp_context=multiprocessing.get_context("spawn"))
+
+    return writerPool
+
+
+def getFrameName(frameIndex):
+    """
+    Returns the file name of a frame without extension
+    Args:
+        frameIndex: Index of the frame in the video
+
+    Returns: The frame name
+
+    """
+    return "img" + str(frameIndex).zfill(4)
+
+
+def getFrameFileName(frameIndex, frameFormat):
+    """
+    Returns the file name of a frame in the given format
+    Args:
+        frameIndex: Index of the frame in the video
+        frameFormat: One of the FRAME_FORMATS
+
+    Returns: The file name
+
+    """
+    return getFrameName(frameIndex) + FRAME_FORMATS[frameFormat]["extension"]
+
+
+def loadFrame(filePath, frameFormat, frameShape):
+    """
+    Reads and decodes a frame that was written by FrameWriter.saveFrame
+    Args:
+        filePath: Path of the frame file
+        frameFormat: One of the encoded FRAME_FORMATS (png, fastPng or zlib)
+        frameShape: Shape [H, W, 3] of the frame, needed for the zlib format
+
+    Returns: The uint8 RGB frame of shape [H, W, 3]
+
+    """
+    if frameFormat == "zlib":
+        with open(filePath, "rb") as file:
+            return np.frombuffer(zlib.decompress(file.read()), dtype=np.uint8).reshape(frameShape)
+
+    with Image.open(filePath) as image:
+        return np.asarray(image.convert("RGB"))
+
+
+def createManifest(frameFormat, numFrames, frameShape, fileName=None):
+    """
+    Creates the manifest that tells readers how the frames are stored
+    Args:
+        frameFormat: One of the FRAME_FORMATS
+        numFrames: Amount of stored frames
+        frameShape: Shape [H, W, 3] of a single frame
+        fileName: Name of the npy file, None if every frame has its own file
+
+    Returns: The manifest as a dictionary
+
+    """
+    manifest = {
+        "format": frameFormat,
+        "numFrames": numFrames,
+        "height": frameShape[0] if frameShape else None,
+        "width": frameShape[1] if frameShape else None,
+        "channels": "RGB",
+        "dtype": "uint8"
+    }
+
+    if fileName is not None:
+        manifest["file"] = fileName
+    else:
+        manifest["framePattern"] = "img{:04d}" + FRAME_FORMATS[frameFormat]["extension"]
+
+    return manifest
+
+
+def writeManifest(outPath, manifest):
+    """
+    Writes the manifest into a folder, replacing it atomically
+    Args:
+        outPath: Folder of the frames
+        manifest: The manifest as a dictionary
+
+    Returns: -
+
+    """
+    with dnnlib.util.atomic_write(os.path.join(outPath, MANIFEST_FILENAME)) as file:
+        json.dump(manifest, file, indent=2)
+
+
+def syncPath(path):
+    """
+    Makes the data of a file or the entries of a folder durable, without syncing anything else on the disk
+    Args:
+        path: Path of the file or folder
+
+    Returns: -
+
+    """
+    fileDescriptor = os.open(path, os.O_RDONLY)
+
+    try:
+        os.fsync(fileDescriptor)
+    finally:
+        os.close(fileDescriptor)
+
+
+def createFrameSink(outPath, frameFormat="png", numFrames=None, resumeState=None):
+    """
+    Creates the sink that writes the frames into a folder in the given format
+    Args:
+        outPath: Path to the output folder of the frames
+        frameFormat: One of the FRAME_FORMATS
+        numFrames: Amount of frames of the video, required for the npy format
+        resumeState: State of a checkpoint of an interrupted job to continue from
+
+    Returns: The frame sink
+
+    """
+    if frameFormat not in FRAME_FORMATS:
+        raise ValueError("Unknown frame format {}, must be one of {}".format(frameFormat, list(FRAME_FORMATS)))
+
+    if frameFormat == "npy":
+        return NpyFrameSink(outPath, numFrames, resumeState=resumeState)
+
+    return FileFrameSink(outPath, frameFormat, resumeState=resumeState)
+
+
+class FileFrameSink:
+    """
+    FileFrameSink writes each frame as file into a folder, e.g. as png image.
+    The encoding runs in a pool of writer processes, so that the synthesis does not wait for the compression.
+    Only a bounded amount of frames may be pending, if more frames arrive the synthesis waits for the oldest ones.
+    Frames complete in order, so completedFrames always describes a gapless range from the first frame.
+    Subclasses can store the frames differently by overriding submitFrame, storeFrame and storeManifest.
+    """
+
+    def __init__(self, outPath, frameFormat="png", resumeState=None):
+        """
+        The constructor of the FileFrameSink
+        Args:
+            outPath: Path to the output folder of the frames
+            frameFormat: One of the encoded FRAME_FORMATS (png, fastPng or zlib)
+            resumeState: State of a checkpoint of an interrupted job to continue from
+        """
+        if frameFormat not in FRAME_FORMATS or frameFormat == "npy":
+            raise ValueError("{} is not a format of single frame files".format(frameFormat))
+
+        self.outPath = outPath  # Folder the frames are written to
+        self.frameFormat = frameFormat  # Format of the frame files
+        self.frameShape = None  # Shape of a single frame, known after the first batch
+        self.pendingFrames = deque()  # Index and future of each frame that is still being written
+        self.completedFrames = 0  # Amount of frames from the start that have been written
+        self.syncedFrames = 0  # Amount of frames from the start that have been made durable
+
+        if resumeState is not None and self.canResume(resumeState):
+            self.completedFrames = resumeState["completedFrames"]
+            self.syncedFrames = self.completedFrames
+            self.frameShape = tuple(resumeState["frameShape"]) if resumeState["frameShape"] else None
+
+    def canResume(self, resumeState):
+        """
+        Checks if the frames of a checkpoint still exist, e.g. the folder is gone after the container was replaced
+        Args:
+            resumeState: State of a checkpoint of an interrupted job
+
+        Returns: True if the sink can continue after the frames of the checkpoint
+
+        """
+        lastFrame = resumeState["completedFrames"] - 1
+
+        return lastFrame < 0 or os.path.exists(os.path.join(self.outPath, getFrameFileName(lastFrame, self.frameFormat)))
+
+    def write(self, startIndex, frames):
+        """
+        Queues a batch of frames for writing
+        Args:
+            startIndex: Index of the first frame of the batch in the video
+            frames: uint8 RGB frames of shape [N, H, W, 3]
+
+        Returns: -
+
+        """
+        self.frameShape = frames.shape[1:]
+
+        for i, frame in enumerate(frames):
+            # Backpressure: wait for the oldest frames if too many are pending
+            while len(self.pendingFrames) >= MAX_PENDING_FRAMES:
+                self.completeOldestFrame()
+
+            self.pendingFrames.append((startIndex + i, self.submitFrame(startIndex + i, frame)))
+
+    def submitFrame(self, frameIndex, frame):
+        """
+        Hands a frame over to the writer processes
+        Args:
+            frameIndex: Index of the frame in the video
+            frame: The uint8 RGB frame of shape [H, W, 3]
+
+        Returns: The future of the writer process
+
+        """
+        filePath = os.path.join(self.outPath, getFrameFileName(frameIndex, self.frameFormat))
+
+        return getWriterPool().submit(FrameWriter.saveFrame, filePath, frame, self.frameFormat,
+                                      FRAME_FORMATS[self.frameFormat]["compressLevel"])
+
+    def storeFrame(self, frameIndex, result):
+        """
+        Stores the result of a writer process, the frame file has already been written by the process itself
+        Args:
+            frameIndex: Index of the frame in the video
+            result: The result of the writer process
+
+        Returns: -
+
+        """
+        pass
+
+    def completeOldestFrame(self):
+        """
+        Waits until the oldest pending frame has been written and raises its error if writing failed
+        Returns: -
+
+        """
+        frameIndex, future = self.pendingFrames.popleft()
+        self.storeFrame(frameIndex, future.result())
+        self.completedFrames = frameIndex + 1
+
+    def checkpoint(self):
+        """
+        Makes the completed frames durable, the pending frames are still being written
+        Returns: The state to continue from after an interrupted job
+
+        """
+        # Only the frame files completed since the last checkpoint are synced, followed by the folder entries
+        for frameIndex in range(self.syncedFrames, self.completedFrames):
+            syncPath(os.path.join(self.outPath, getFrameFileName(frameIndex, self.frameFormat)))
+
+        syncPath(self.outPath)
+        self.syncedFrames = self.completedFrames
+
+        return {"completedFrames": self.completedFrames, "frameShape": self.frameShape}
+
+    def storeManifest(self, manifest):
+        """
+        Stores the manifest next to the frames
+        Args:
+            manifest: The manifest as a dictionary
+
+        Returns: -
+
+        """
+        writeManifest(self.outPath, manifest)
+
+    def close(self):
+        """
+        Waits until all pending frames have been written and stores the manifest
+        Returns: -
+
+        """
+        while self.pendingFrames:
+            self.completeOldestFrame()
+
+        self.storeManifest(createManifest(self.frameFormat, self.completedFrames, self.frameShape))
+
+    def cancel(self):
+        """
+        Drops all frames that have not been written yet, e.g. after the synthesis failed
+        Returns: -
+
+        """
+        for _, future in self.pendingFrames:
+            future.cancel()
+
+        self.pendingFrames.clear()
+
+
+class TarFrameSink(FileFrameSink):
+    """
+    TarFrameSink appends each frame as file to a tar archive while the synthesis is running,
+    so that no separate packaging pass over the frames is needed afterwards.
+    The encoding runs in the writer processes and the frames are appended in order as they complete.
+    The archive is written to a temporary file and only renamed to its final path once it is complete.
+    """
+
+    def __init__(self, tarPath, folderName, frameFormat="png", resumeState=None):
+        """
+        The constructor of the TarFrameSink
+        Args:
+            tarPath: Path of the tar archive to create
+            folderName: Folder inside the archive that contains the frames
+            frameFormat: One of the encoded FRAME_FORMATS (png, fastPng or zlib)
+            resumeState: State of a checkpoint of an interrupted job to continue from
+        """
+        self.tarPath = tarPath  # Final path of the archive
+        self.tempPath = tarPath + ".part"  # Path the archive is written to
+        self.folderName = folderName  # Folder of the frames inside the archive
+        self.archive = None  # The archive that is being written
+        self.checkpointed = False  # If the incomplete archive is referenced by a checkpoint
+
+        super().__init__(outPath=None, frameFormat=frameFormat, resumeState=resumeState)
+
+        if self.completedFrames > 0:
+            # Cut off everything that was appended after the checkpoint and mark the end of the archive,
+            # tarfile only appends to archives that end with an empty block
+            with open(self.tempPath, "r+b") as file:
+                file.truncate(resumeState["tarOffset"])
+                file.seek(resumeState["tarOffset"])
+                file.write(tarfile.NUL * tarfile.BLOCKSIZE * 2)
+
+            self.archive = tarfile.open(self.tempPath, "a")
+            self.checkpointed = True
+            return
+
+        self.archive = tarfile.open(self.tempPath, "w")
+
+        # Add the folder first, like tar does when packing a folder
+        folderInfo = tarfile.TarInfo(folderName)
+        folderInfo.type = tarfile.DIRTYPE
+        folderInfo.mode = 0o755
+        folderInfo.mtime = time.time()
+        self.archive.addfile(folderInfo)
+
+    def canResume(self, resumeState):
+        """
+        Checks if the incomplete archive of a checkpoint still exists
+        Args:
+            resumeState: State of a checkpoint of an interrupted job
+
+        Returns: True if the sink can continue after the frames of the checkpoint
+
+        """
+        return os.path.exists(self.tempPath) and os.path.getsize(self.tempPath) >= resumeState["tarOffset"]
+
+    def checkpoint(self):
+        """
+        Makes the frames that have been appended to the archive durable
+        Returns: The state to continue from after an interrupted job
+
+        """
+        self.archive.fileobj.flush()
+        os.fsync(self.archive.fileobj.fileno())
+        self.checkpointed = True
+
+        return {"completedFrames": self.completedFrames, "frameShape": self.frameShape,
+                "tarOffset": self.archive.offset}
+
+    def submitFrame(self, frameIndex, frame):
+        """
+        Hands a frame over to the writer processes, which only encode it
+        Args:
+            frameIndex: Index of the frame in the video
+            frame: The uint8 RGB frame of shape [H, W, 3]
+
+        Returns: The future of the writer process
+
+        """
+        return getWriterPool().submit(FrameWriter.encodeFrame, frame, self.frameFormat,
+                                      FRAME_FORMATS[self.frameFormat]["compressLevel"])
+
+    def storeFrame(self, frameIndex, result):
+        """
+        Appends an encoded frame to the archive
+        Args:
+            frameIndex: Index of the frame in the video
+            result: The encoded frame as bytes
+
+        Returns: -
+
+        """
+        self.addFile(getFrameFileName(frameIndex, self.frameFormat), result)
+
+    def storeManifest(self, manifest):
+        """
+        Appends the manifest to the frames in the archive
+        Args:
+            manifest: The manifest as a dictionary
+
+        Returns: -
+
+        """
+        self.addFile(MANIFEST_FILENAME, json.dumps(manifest, indent=2).encode())
+
+    def addFile(self, fileName, content):
+        """
+        Appends a file to the frame folder of the archive
+        Args:
+            fileName: Name of the file inside the frame folder
+            content: The file content as bytes
+
+        Returns: -
+
+        """
+        fileInfo = tarfile.TarInfo(self.folderName + "/" + fileName)
+        fileInfo.size = len(content)
+        fileInfo.mode = 0o644
+        fileInfo.mtime = time.time()
+        self.archive.addfile(fileInfo, io.BytesIO(content))
+
+    def close(self):
+        """
+        Waits until all pending frames have been appended and moves the archive to its final path
+        Returns: -
+
+        """
+        super().close()
+        self.archive.close()
+
+        os.replace(self.tempPath, self.tarPath)
+
+    def cancel(self):
+        """
+        Drops all pending frames and removes the incomplete archive, e.g. after the synthesis failed.
+        The archive is kept if a checkpoint refers to it, so that the job can continue later
+        Returns: -
+
+        """
+        super().cancel()
+        self.archive.close()
+
+        if not self.checkpointed and os.path.exists(self.tempPath):
+            os.remove(self.tempPath)
+
+
+class NpyFrameSink:
+    """
+    NpyFrameSink stores all frames uncompressed in a single memory-mapped npy file.
+    Writing a batch is a plain memory copy, the operating system flushes the pages to the disk in the background,
+    which makes it the cheapest format if the storage is fast enough for the uncompressed frames.
+    """
+
+    def __init__(self, outPath, numFrames, resumeState=None):
+        """
+        The constructor of the NpyFrameSink
+        Args:
+            outPath: Path to the output folder of the npy file
+            numFrames: Amount of frames of the video
+            resumeState: State of a checkpoint of an interrupted job to continue from
+        """
+        if numFrames is None:
+            raise ValueError("The npy format needs the amount of frames in advance")
+
+        self.outPath = outPath  # Folder the npy file is written to
+        self.numFrames = numFrames  # Amount of frames of the video
+        self.frames = None  # The memory-mapped frames, created with the first batch
+        self.completedFrames = 0  # Amount of frames from the start that have been written
+
+        npyPath = os.path.join(outPath, NPY_FILENAME)
+        if resumeState is not None and resumeState["completedFrames"] > 0 and os.path.exists(npyPath):
+            frames = np.lib.format.open_memmap(npyPath, mode="r+")
+
+            if len(frames) == numFrames:
+                self.frames = frames
+                self.completedFrames = resumeState["completedFrames"]
+
+    def write(self, startIndex, frames):
+        """
+        Copies a batch of frames into the memory-mapped file
+        Args:
+            startIndex: Index of the first frame of the batch in the video
+            frames: uint8 RGB frames of shape [N, H, W, 3]
+
+        Returns: -
+
+        """
+        # The file can only be created once the frame size is known
+        if self.frames is None:
+            self.frames = np.lib.format.open_memmap(os.path.join(self.outPath, NPY_FILENAME), mode="w+",
+                                                    dtype=np.uint8, shape=(self.numFrames,) + frames.shape[1:])
+
+        self.frames[startIndex:startIndex + len(frames)] = frames
+        self.completedFrames = startIndex + len(frames)
+
+    def checkpoint(self):
+        """
+        Flushes the written frames to the disk
+        Returns: The state to continue from after an interrupted job
+
+        """
+        if self.frames is not None:
+            self.frames.flush()
+
+        return {"completedFrames": self.completedFrames}
+
+    def close(self):
+        """
+        Flushes the frames to the disk and stores the manifest
+        Returns: -
+
+        """
+        frameShape = None
+
+        if self.frames is not None:
+            self.frames.flush()
+            frameShape = self.frames.shape[1:]
+            self.frames = None
+
+        writeManifest(self.outPath, createManifest("npy", self.completedFrames, frameShape, fileName=NPY_FILENAME))
+
+    def cancel(self):
+        """
+        Closes the memory-mapped file without a manifest, e.g. after the synthesis failed
+        Returns: -
+
+        """
+        self.frames = None
+
+
+class TeeFrameSink:
+    """
+    TeeFrameSink passes the frames on to several sinks, e.g. to the output of the job and to the render cache.
+    The first sink is the primary one, only its state is recorded in checkpoints.
+    """
+
+    def __init__(self, sinks):
+        """
+        The constructor of the TeeFrameSink
+        Args:
+            sinks: The sinks that receive the frames, starting with the primary sink
+        """
+        self.sinks = sinks  # The sinks that receive the frames
+
+    @property
+    def completedFrames(self):
+        """
+        Returns: The amount of frames from the start that have been written by all sinks
+
+        """
+        return min(sink.completedFrames for sink in self.sinks)
+
+    def write(self, startIndex, frames):
+        """
+        Passes a batch of frames on to all sinks
+        Args:
+            startIndex: Index of the first frame of the batch in the video
+            frames: uint8 RGB frames of shape [N, H, W, 3]
+
+        Returns: -
+
+        """
+        for sink in self.sinks:
+            sink.write(startIndex, frames)
+
+    def checkpoint(self):
+        """
+        Returns: The state of the primary sink to continue from after an interrupted job
+
+        """
+        return self.sinks[0].checkpoint()
+
+    def close(self):
+        """
+        Waits until all sinks have written their frames
+        Returns: -
+
+        """
+        for sink in self.sinks:
+            sink.close()
+
+    def cancel(self):
+        """
+        Cancels all sinks, e.g. after the synthesis failed
+        Returns: -
+
+        """
+        for sink in self.sinks:
+            sink.cancel()
+
+
+class VideoFrameSink:
+    """
+    VideoFrameSink pipes the raw RGB frames straight into an ffmpeg encoder and muxes the job audio,
+    so that the video exists as soon as the last batch is synthesized and no frame files are needed.
+    A writer thread feeds the encoder, so that the synthesis only waits if the encoder falls behind.
+    The frames are encoded into segments, every checkpoint finishes the current segment, so that an interrupted job
+    continues with a new segment after the last checkpoint. Once all frames are written, the segments are joined
+    without encoding them again and the audio is muxed. The video is only moved to its final path once it is complete.
+    """
+
+    def __init__(self, videoPath, fps, audioPath=None, audioStart=0.0, audioDuration=None, resumeState=None):
+        """
+        The constructor of the VideoFrameSink
+        Args:
+            videoPath: Path of the mp4 file to create
+            fps: Frames per second of the video
+            audioPath: Path of the audio file to mux into the video, None for a silent video
+            audioStart: Second of the audio file at which the video starts
+            audioDuration: Seconds of audio to use, None to use the audio until the video ends
+            resumeState: State of a checkpoint of an interrupted job to continue from
+        """
+        self.videoPath = videoPath  # Final path of the video
+        self.tempPath = videoPath + ".part"  # Path the joined video is written to
+        self.segmentPath = videoPath + ".segments"  # Folder of the encoded segments
+        self.fps = fps  # Frames per second of the video
+        self.audioPath = audioPath  # Audio that is muxed into the video
+        self.audioStart = audioStart  # Start of the video in the audio in seconds
+        self.audioDuration = audioDuration  # Length of the used audio in seconds
+        self.encoder = None  # The ffmpeg process of the current segment
+        self.writerThread = None  # Thread that feeds the frames to the encoder
+        self.pendingBatches = queue.Queue(maxsize=MAX_PENDING_BATCHES)  # Batches waiting for the encoder
+        self.segments = []  # File names of the finished segments in the segment folder
+        self.frameShape = None  # Shape of a single frame, known after the first batch
+        self.completedFrames = 0  # Amount of frames that have been passed to the encoder
+        self.segmentFrames = 0  # Amount of frames from the start that are contained in the finished segments
+        self.checkpointed = False  # If the segments are referenced by a checkpoint
+        self.error = None  # Error that stopped the writer thread
+
+        if resumeState is not None and self.canResume(resumeState):
+            self.segments = list(resumeState["segments"])
+            self.frameShape = tuple(resumeState["frameShape"]) if resumeState["frameShape"] else None
+            self.completedFrames = resumeState["completedFrames"]
+            self.segmentFrames = self.completedFrames
+            self.checkpointed = True
+        else:
+            os.makedirs(self.segmentPath, exist_ok=True)
+
+    def canResume(self, resumeState):
+        """
+        Checks if the segments of a checkpoint still exist
+        Args:
+            resumeState: State of a checkpoint of an interrupted job
+
+        Returns: True if the sink can continue after the frames of the checkpoint
+
+        """
+        return all(os.path.exists(os.path.join(self.segmentPath, segment)) for segment in resumeState["segments"])
+
+    def checkpoint(self):
+        """
+        Finishes the current segment and makes it durable, the next batch starts a new segment
+        Returns: The state to continue from after an interrupted job
+
+        """
+        if self.encoder is not None:
+            self.finishSegment()
+
+        self.checkpointed = True
+
+        return {"completedFrames": self.segmentFrames, "frameShape": self.frameShape, "segments": list(self.segments)}
+
+    def write(self, startIndex, frames):
+        """
+        Queues a batch of frames for the encoder, the frames must arrive in order
+        Args:
+            startIndex: Index of the first frame of the batch in the video
+            frames: uint8 RGB frames of shape [N, H, W, 3]
+
+        Returns: -
+
+        """
+        if self.error is not None:
+            raise self.error
+
+        # The encoder can only be started once the frame size is known
+        if self.encoder is None:
+            self.frameShape = frames.shape[1:]
+            self.startEncoder(height=frames.shape[1], width=frames.shape[2])
+
+        self.pendingBatches.put((startIndex, frames))
+
+    def getSegmentName(self, segmentIndex):
+        """
+        Returns the file name of a segment
+        Args:
+            segmentIndex: Index of the segment in the video
+
+        Returns: The segment name
+
+        """
+        return "segment" + str(segmentIndex).zfill(4) + ".mp4"
+
+    def startEncoder(self, height, width):
+        """
+        Starts the ffmpeg process that encodes the raw frames from its stdin into the next segment
+        and the writer thread
+        Args:
+            height: Height of the frames in pixels
+            width: Width of the frames in pixels
+
+        Returns: -
+
+        """
+        segmentFile = os.path.join(self.segmentPath, self.getSegmentName(len(self.segments)))
+
+        command = [FFMPEG_BINARY, "-y", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "{}x{}".format(width, height),
+                   "-r", str(self.fps), "-i", "-"] + VIDEO_CODEC_ARGS + ["-f", "mp4", segmentFile]
+
+        self.encoder = subprocess.Popen(command, stdin=subprocess.PIPE)
+        self.writerThread = threading.Thread(target=self.feedEncoder, daemon=True)
+        self.writerThread.start()
+
+    def feedEncoder(self):
+        """
+        Writes the queued batches to the encoder until the end of the segment is queued, runs in the writer thread
+        Returns: -
+
+        """
+        while True:
+            batch = self.pendingBatches.get()
+
+            if batch is None:
+                break
+
+            # Keep draining the queue after an error, so that the synthesis never blocks on it
+            if self.error is not None:
+                continue
+
+            startIndex, frames = batch
+            try:
+                if startIndex != self.completedFrames:
+                    raise RuntimeError("Frame {} arrived before frame {}".format(startIndex, self.completedFrames))
+
+                self.encoder.stdin.write(frames.tobytes())
+                self.completedFrames = startIndex + len(frames)
+            except Exception as exception:
+                self.error = exception
+
+    def finishSegment(self):
+        """
+        Waits until the encoder has written the queued frames and makes the finished segment durable
+        Returns: -
+
+        """
+        self.pendingBatches.put(None)
+        self.writerThread.join()
+        self.encoder.stdin.close()
+        returnCode = self.encoder.wait()
+        self.encoder = None
+
+        if self.error is not None:
+            raise self.error
+        if returnCode != 0:
+            raise RuntimeError("ffmpeg failed with exit code {}".format(returnCode))
+
+        segmentName = self.getSegmentName(len(self.segments))
+        syncPath(os.path.join(self.segmentPath, segmentName))
+        syncPath(self.segmentPath)
+
+        self.segments.append(segmentName)
+        self.segmentFrames = self.completedFrames
+
+    def joinSegments(self):
+        """
+        Joins the segments into the video without encoding them again and muxes the audio
+        Returns: -
+
+        """
+        listPath = os.path.join(self.segmentPath, "segments.txt")
+        with open(listPath, "w") as file:
+            file.writelines("file '{}'\n".format(segment) for segment in self.segments)
+
+        command = [FFMPEG_BINARY, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", listPath]
+
+        if self.audioPath is not None:
+            command += ["-ss", str(self.audioStart)]
+            if self.audioDuration is not None:
+                command += ["-t", str(self.audioDuration)]
+            command += ["-i", self.audioPath, "-map", "0:v:0", "-map", "1:a:0"] + AUDIO_CODEC_ARGS + ["-shortest"]
+
+        command += ["-c:v", "copy", "-f", "mp4", self.tempPath]
+
+        returnCode = subprocess.call(command)
+        if returnCode != 0:
+            raise RuntimeError("ffmpeg failed with exit code {}".format(returnCode))
+
+    def close(self):
+        """
+        Finishes the encoding, joins the segments and moves the video to its final path
+        Returns: -
+
+        """
+        if self.encoder is not None:
+            self.finishSegment()
+
+        if not self.segments:
+            raise RuntimeError("No frames were written to " + self.videoPath)
+
+        self.joinSegments()
+
+        os.replace(self.tempPath, self.videoPath)
+        shutil.rmtree(self.segmentPath, ignore_errors=True)
+
+    def cancel(self):
+        """
+        Stops the encoder and removes the incomplete video, e.g. after the synthesis failed.
+        The segments are kept if a checkpoint refers to them, so that the job can continue later
+        Returns: -
+
+        """
+        if self.encoder is not None:
+            self.error = self.error or RuntimeError("Encoding was cancelled")
+            self.pendingBatches.put(None)
+            self.writerThread.join()
+            self.encoder.kill()
+            self.encoder.wait()
+            self.encoder = None
+
+        if os.path.exists(self.tempPath):
+            os.remove(self.tempPath)
+
+        if not self.checkpointed:
+            shutil.rmtree(self.segmentPath, ignore_errors=True)
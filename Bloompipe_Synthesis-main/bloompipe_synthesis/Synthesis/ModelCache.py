@@ -0,0 +1,185 @@
+# ===== Inits + Definitions =========================
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import torch
+
+"""
+This module keeps loaded generators in memory across the synthesis jobs of the process,
+so that a job with a style that was used before starts rendering right away.
+Generators are cached by style, content hash of the style file and device and the least recently used
+generators are evicted once the cache holds too many of them or too much memory.
+Jobs that request the same style at the same time wait for a single load and share the loaded generator.
+"""
+
+# ===== Global-Variables =========================
+
+# Most generators that are kept loaded at the same time
+MAX_CACHED_MODELS = 4
+
+# Most memory the weights of the kept generators may use in bytes
+MAX_CACHED_BYTES = 4 * 2 ** 30
+
+# Size of the chunks in which style files are read for hashing
+HASH_CHUNK_SIZE = 2 ** 20
+
+# Loaded models by key, the least recently used one first
+cachedModels = OrderedDict()
+
+# Locks that let a single job load a model while the other jobs wait for it
+loadingLocks = {}
+
+# Content hashes of the style files by path, size and modification time
+fileHashes = {}
+
+# Lock of the cache state
+cacheLock = threading.Lock()
+
+# Counters of the cache
+cacheStats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+# ===== Methods =========================
+
+def getCachedModel(style, modelFile, device, loadModel):
+    """
+    Returns the loaded model of a style, loading it only if it is not cached yet
+    Args:
+        style: Name of the style
+        modelFile: File the model is loaded from, its content hash is part of the cache key
+        device: The torch device the model is loaded onto
+        loadModel: Function without arguments that loads the model and returns it as dictionary,
+                   which contains the generator as "Gs"
+
+    Returns: The model as returned by loadModel
+
+    """
+    key = (str(style), hashFile(modelFile), str(device))
+
+    with cacheLock:
+        if key in cachedModels:
+            return useCachedModel(key)
+
+        loadingLock = loadingLocks.setdefault(key, threading.Lock())
+
+    with loadingLock:
+        # Another job might have loaded the model while this one was waiting
+        with cacheLock:
+            if key in cachedModels:
+                return useCachedModel(key)
+
+            cacheStats["misses"] += 1
+
+        model = loadModel()
+        modelBytes = getModelBytes(model["Gs"])
+
+        with cacheLock:
+            cachedModels[key] = {"model": model, "bytes": modelBytes}
+            loadingLocks.pop(key, None)
+            evictModels()
+
+    return model
+
+
+def useCachedModel(key):
+    """
+    Marks a cached model as most recently used, the cache lock must be held
+    Args:
+        key: Key of the model
+
+    Returns: The cached model
+
+    """
+    cacheStats["hits"] += 1
+    cachedModels.move_to_end(key)
+
+    return cachedModels[key]["model"]
+
+
+def evictModels():
+    """
+    Removes the least recently used models until the cache is within its limits, the cache lock must be held.
+    The most recently used model is always kept, even if it exceeds the limits on its own.
+    Jobs that still use an evicted model keep it until they are done
+    Returns: -
+
+    """
+    evicted = False
+
+    while len(cachedModels) > 1 and (len(cachedModels) > MAX_CACHED_MODELS or
+                                     sum(entry["bytes"] for entry in cachedModels.values()) > MAX_CACHED_BYTES):
+        key, _ = cachedModels.popitem(last=False)
+        cacheStats["evictions"] += 1
+        evicted = True
+        print("Evicted style {} from the model cache".format(key[0]))
+
+    # Hand the memory of evicted models back to the device
+    if evicted and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def getModelCacheStats():
+    """
+    Returns the counters and the content of the model cache
+    Returns: Dictionary with hits, misses, evictions, the cached styles and the bytes they use
+
+    """
+    with cacheLock:
+        return dict(cacheStats,
+                    styles=[key[0] for key in cachedModels],
+                    bytes=sum(entry["bytes"] for entry in cachedModels.values()))
+
+
+def clearModelCache():
+    """
+    Removes all models from the cache
+    Returns: -
+
+    """
+    with cacheLock:
+        cachedModels.clear()
+
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def getModelBytes(Gs):
+    """
+    Returns the memory used by the weights of a generator
+    Args:
+        Gs: The generator
+
+    Returns: The bytes of all parameters and buffers
+
+    """
+    tensors = list(Gs.parameters()) + list(Gs.buffers())
+
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+def hashFile(path):
+    """
+    Hashes the content of a style file, the hash is only computed again if the file changed
+    Args:
+        path: Path to the file
+
+    Returns: The hex digest of the file, or the path itself if it is not a local file
+
+    """
+    if not os.path.isfile(path):
+        return str(path)
+
+    fileStat = os.stat(path)
+    fileKey = (os.path.abspath(path), fileStat.st_size, fileStat.st_mtime_ns)
+
+    if fileKey not in fileHashes:
+        fileHash = hashlib.sha1()
+
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+                fileHash.update(chunk)
+
+        fileHashes[fileKey] = fileHash.hexdigest()
+
+    return fileHashes[fileKey]
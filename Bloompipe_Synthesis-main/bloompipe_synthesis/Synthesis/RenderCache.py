@@ -0,0 +1,149 @@
+# ===== Inits + Definitions =========================
+import os
+import json
+import shutil
+import numpy as np
+
+from . import FrameSinks
+
+"""
+This module keeps the frames and motion vectors of the last render of a job,
+so that a job that is submitted again with slightly changed parameters only re-synthesizes the frames
+whose motion vectors changed and reuses all other frames from the cache.
+A new cache is written next to the old one while rendering and only replaces it once the render succeeded.
+"""
+
+# ===== Global-Variables =========================
+
+# Files inside the cache folder, the frames are stored like the frames of a FileFrameSink
+PARAMETERS_FILENAME = "parameters.json"
+MOTION_FILENAME = "motion.npy"
+
+# Format of the cached frames, fast to encode and much smaller than raw frames
+CACHE_FRAME_FORMAT = "fastPng"
+
+
+# ===== Methods =========================
+
+def loadRenderCache(cachePath, renderParameters):
+    """
+    Loads the cache of the previous render if it was rendered with the same render parameters
+    Args:
+        cachePath: Folder of the cache
+        renderParameters: Parameters that change the pixels of a frame with the same motion vector, e.g. the style
+
+    Returns: Dictionary with seed, motion and frameShape of the previous render, or None if there is no usable cache
+
+    """
+    parametersPath = os.path.join(cachePath, PARAMETERS_FILENAME)
+    motionPath = os.path.join(cachePath, MOTION_FILENAME)
+
+    if not os.path.exists(parametersPath) or not os.path.exists(motionPath):
+        return None
+
+    try:
+        with open(parametersPath, "r") as file:
+            cache = json.load(file)
+    except ValueError:
+        return None
+
+    # Compare through JSON, so that tuples and lists are treated the same
+    if cache["renderParameters"] != json.loads(json.dumps(renderParameters)):
+        print("Render cache belongs to different render parameters - Rendering all frames")
+        return None
+
+    return {
+        "seed": cache["seed"],
+        "motion": np.load(motionPath),
+        "frameShape": tuple(cache["frameShape"])
+    }
+
+
+def findReusableFrames(cache, motion, tolerance):
+    """
+    Compares the motion vectors with the ones of the cached render
+    Args:
+        cache: The cache as returned by loadRenderCache, or None
+        motion: The motion vectors of all frames of the current render
+        tolerance: Largest difference in any dimension at which a cached frame is reused
+
+    Returns: Boolean array that is True for every frame that can be taken from the cache
+
+    """
+    if cache is None or tolerance is None or cache["motion"].shape != motion.shape:
+        return np.zeros(len(motion), dtype=bool)
+
+    return np.abs(cache["motion"] - motion).max(axis=1) <= tolerance
+
+
+def loadCachedFrames(cachePath, cache, start, end):
+    """
+    Reads a range of frames from the cache
+    Args:
+        cachePath: Folder of the cache
+        cache: The cache as returned by loadRenderCache
+        start: First frame of the range
+        end: End of the range (exclusive)
+
+    Returns: The uint8 RGB frames of shape [N, H, W, 3]
+
+    """
+    return np.stack([
+        FrameSinks.loadFrame(os.path.join(cachePath, FrameSinks.getFrameFileName(f, CACHE_FRAME_FORMAT)),
+                             CACHE_FRAME_FORMAT, cache["frameShape"])
+        for f in range(start, end)
+    ])
+
+
+def createCacheSink(cachePath):
+    """
+    Creates the sink that writes the frames of the current render into a new cache next to the old one
+    Args:
+        cachePath: Folder of the cache
+
+    Returns: The frame sink
+
+    """
+    newCachePath = cachePath + ".part"
+
+    shutil.rmtree(newCachePath, ignore_errors=True)
+    os.makedirs(newCachePath)
+
+    return FrameSinks.FileFrameSink(newCachePath, CACHE_FRAME_FORMAT)
+
+
+def commitRenderCache(cachePath, renderParameters, seed, motion, frameShape):
+    """
+    Completes the new cache and replaces the cache of the previous render with it
+    Args:
+        cachePath: Folder of the cache
+        renderParameters: Parameters that change the pixels of a frame with the same motion vector
+        seed: The random seed of the motion vectors
+        motion: The motion vectors of all frames
+        frameShape: Shape [H, W, 3] of a single frame
+
+    Returns: -
+
+    """
+    newCachePath = cachePath + ".part"
+
+    np.save(os.path.join(newCachePath, MOTION_FILENAME), motion)
+
+    with open(os.path.join(newCachePath, PARAMETERS_FILENAME), "w") as file:
+        json.dump({"renderParameters": renderParameters, "seed": seed, "frameShape": list(frameShape)}, file, indent=2)
+
+    # The old cache is removed first, because folders can not be replaced atomically
+    shutil.rmtree(cachePath, ignore_errors=True)
+    os.replace(newCachePath, cachePath)
+
+
+def discardCacheSink(cachePath):
+    """
+    Removes a new cache that could not be completed
+    Args:
+        cachePath: Folder of the cache
+
+    Returns: -
+
+    """
+    shutil.rmtree(cachePath + ".part", ignore_errors=True)
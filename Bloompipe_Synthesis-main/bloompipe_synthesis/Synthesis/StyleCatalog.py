@@ -0,0 +1,232 @@
+# ===== Inits + Definitions =========================
+import os
+import json
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from stylegan2 import dnnlib, legacy
+from . import BatchSizer, ModelCache, StyleStore
+
+"""
+This module keeps a catalog of the styles in the style folder, so that the resolution, the architecture,
+the average latent or the memory of a style can be looked up without loading the style.
+The catalog is a small JSON file in the style folder. It is updated incrementally, only styles that are new
+or whose files changed are loaded once to describe them.
+"""
+
+# ===== Global-Variables =========================
+
+# Name of the catalog file in the style folder
+CATALOG_FILENAME = "catalog.json"
+
+# Version of the catalog entries, entries of other versions are described again
+CATALOG_VERSION = 1
+
+# Name of the lock file in the style folder, which lets only one node update the catalog at a time
+CATALOG_LOCK_FILENAME = CATALOG_FILENAME + ".lock"
+
+# Lock that lets only one update of the catalog run in this process, the lock file only locks between processes
+catalogLock = threading.Lock()
+
+
+# ===== Methods =========================
+
+def updateCatalog(styleDirectory=StyleStore.SOURCE_DIRECTORY):
+    """
+    Describes all styles of the style folder that are not in the catalog yet or whose files changed
+    and removes the styles that no longer exist
+    Args:
+        styleDirectory: Folder of the styles
+
+    Returns: The catalog as dictionary of style entries by style name
+
+    """
+    if not os.path.isdir(styleDirectory):
+        return {}
+
+    with catalogLock, lockCatalog(styleDirectory):
+        # Read the catalog only once the lock is held, another node might have just updated it
+        catalog = readCatalog(styleDirectory)
+        changed = False
+
+        styleNames = sorted(fileName[:-len(StyleStore.STYLE_EXTENSION)] for fileName in os.listdir(styleDirectory)
+                            if fileName.endswith(StyleStore.STYLE_EXTENSION))
+
+        for styleName in styleNames:
+            fileState = getFileState(styleDirectory, styleName)
+            entry = catalog.get(styleName)
+
+            if entry is not None and entry["version"] == CATALOG_VERSION and entry["files"] == fileState:
+                continue
+
+            print("Adding style {} to the catalog...".format(styleName))
+
+            try:
+                catalog[styleName] = describeStyle(styleDirectory, styleName, fileState)
+                changed = True
+            except Exception as exception:
+                print("Describing style {} failed: {}".format(styleName, exception))
+
+        for styleName in [styleName for styleName in catalog if styleName not in styleNames]:
+            del catalog[styleName]
+            changed = True
+
+        if changed:
+            writeCatalog(styleDirectory, catalog)
+
+    return catalog
+
+
+@contextmanager
+def lockCatalog(styleDirectory):
+    """
+    Locks the catalog of a style folder against all other processes, including those of other nodes sharing the folder
+    Args:
+        styleDirectory: Folder of the styles
+
+    Returns: Context manager that yields once the lock is held
+
+    """
+    with open(os.path.join(styleDirectory, CATALOG_LOCK_FILENAME), "w") as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def describeStyle(styleDirectory, styleName, fileState):
+    """
+    Loads a style once and describes it.
+    The exported generator is used if there is one, because it is loaded without unpickling
+    Args:
+        styleDirectory: Folder of the styles
+        styleName: Name of the style
+        fileState: Size and modification time of the style files
+
+    Returns: The catalog entry of the style
+
+    """
+    generatorPath = os.path.join(styleDirectory, styleName + StyleStore.GENERATOR_EXTENSION)
+    stylePath = os.path.join(styleDirectory, styleName + StyleStore.STYLE_EXTENSION)
+
+    if os.path.exists(generatorPath):
+        Gs = legacy.load_generator(generatorPath)
+    else:
+        with dnnlib.util.open_url(stylePath) as pkl_file:
+            Gs = legacy.load_network_pkl(pkl_file)['G_ema']  # type: ignore
+
+    entry = describeGenerator(Gs)
+    entry.update(version=CATALOG_VERSION, files=fileState)
+
+    return entry
+
+
+def describeGenerator(Gs):
+    """
+    Describes the architecture and the weights of a generator
+    Args:
+        Gs: The generator
+
+    Returns: Dictionary with the architecture, the average latent, the tensor checksums and the memory of the generator
+
+    """
+    initKwargs = json.loads(json.dumps(Gs.init_kwargs, default=str))
+    synthesisKwargs = initKwargs.get("synthesis_kwargs", {})
+
+    tensorChecksums = {}
+    for name, tensor in list(Gs.named_parameters()) + list(Gs.named_buffers()):
+        tensorChecksums[name] = hashlib.sha1(tensor.detach().cpu().contiguous().numpy().tobytes()).hexdigest()
+
+    return {
+        "initKwargs": initKwargs,
+        "resolution": Gs.img_resolution,
+        "numWs": Gs.num_ws,
+        "zDim": Gs.z_dim,
+        "wDim": Gs.w_dim,
+        "numFp16Res": synthesisKwargs.get("num_fp16_res", 0),
+        "convClamp": synthesisKwargs.get("conv_clamp"),
+        "wAvg": Gs.mapping.w_avg.detach().cpu().tolist(),
+        "tensorChecksums": tensorChecksums,
+        "modelBytes": ModelCache.getModelBytes(Gs),
+        "frameMemory": BatchSizer.estimateFrameMemory(Gs)
+    }
+
+
+def getStyleInfo(styleName, styleDirectory=StyleStore.SOURCE_DIRECTORY):
+    """
+    Looks up a style in the catalog
+    Args:
+        styleName: Name of the style
+        styleDirectory: Folder of the styles
+
+    Returns: The catalog entry of the style or None if it is not in the catalog or its files changed since
+
+    """
+    entry = readCatalog(styleDirectory).get(str(styleName))
+
+    if entry is None or entry["version"] != CATALOG_VERSION \
+            or entry["files"] != getFileState(styleDirectory, str(styleName)):
+        return None
+
+    return entry
+
+
+def getFileState(styleDirectory, styleName):
+    """
+    Describes the current version of the files of a style
+    Args:
+        styleDirectory: Folder of the styles
+        styleName: Name of the style
+
+    Returns: Dictionary with size and modification time of every existing file of the style
+
+    """
+    fileState = {}
+
+    for extension in [StyleStore.STYLE_EXTENSION, StyleStore.GENERATOR_EXTENSION]:
+        path = os.path.join(styleDirectory, styleName + extension)
+        if os.path.exists(path):
+            fileStat = os.stat(path)
+            fileState[extension] = {"size": fileStat.st_size, "mtime": fileStat.st_mtime_ns}
+
+    return fileState
+
+
+def readCatalog(styleDirectory):
+    """
+    Reads the catalog of a style folder
+    Args:
+        styleDirectory: Folder of the styles
+
+    Returns: The catalog as dictionary, empty if there is no catalog yet
+
+    """
+    catalogPath = os.path.join(styleDirectory, CATALOG_FILENAME)
+
+    if not os.path.exists(catalogPath):
+        return {}
+
+    try:
+        with open(catalogPath, "r") as file:
+            return json.load(file)
+    except ValueError:
+        return {}
+
+
+def writeCatalog(styleDirectory, catalog):
+    """
+    Writes the catalog of a style folder, replacing it atomically
+    Args:
+        styleDirectory: Folder of the styles
+        catalog: The catalog as dictionary
+
+    Returns: -
+
+    """
+    # The style folder is shared by all nodes, the temporary file of the write is unique across them
+    with dnnlib.util.atomic_write(os.path.join(styleDirectory, CATALOG_FILENAME)) as file:
+        json.dump(catalog, file, indent=2, sort_keys=True)
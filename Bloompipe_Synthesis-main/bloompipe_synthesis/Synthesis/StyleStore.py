@@ -0,0 +1,473 @@
+# ===== Inits + Definitions =========================
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager, ExitStack
+
+from stylegan2 import dnnlib
+
+"""
+This module places the style files of the shared style folder into the working directory, where they are loaded from.
+A style file is written next to its final place and only renamed once its checksum has been verified,
+so a crashed job never leaves a partial file behind that later jobs would use.
+Files are hardlinked or reflinked instead of copied if the file system allows it.
+Each placed file has a metadata file with its checksum and usage, which is used to detect changed or damaged files
+and to evict the least recently used styles once the store grows too big.
+Jobs of all processes that request the same file wait for each other through a file lock.
+Jobs hold a shared lease on the files of their style until the model is loaded, leased files are never evicted.
+"""
+
+# ===== Global-Variables =========================
+
+# Folder that holds the styles of all nodes
+SOURCE_DIRECTORY = "./meta/pkls/"
+
+# Folder the styles are loaded from
+STORE_DIRECTORY = "./"
+
+# Folder of the metadata and lock files of the placed styles
+METADATA_DIRECTORY = "./.styleStore/"
+
+# Extension of the lock files that are held while a file is placed or evicted
+LOCK_EXTENSION = ".lock"
+
+# Extension of the lease files that jobs lock shared while they load a file and eviction locks exclusively
+LEASE_EXTENSION = ".lease"
+
+# Extension of the style pickles, which every style has
+STYLE_EXTENSION = ".pkl"
+
+# Extension of styles exported by stylegan2/export_generator.py, which only some styles have
+GENERATOR_EXTENSION = ".gen"
+
+# Extension of the optional checksum file next to a source file, containing its sha1 hex digest
+CHECKSUM_EXTENSION = ".sha1"
+
+# Largest size of all placed styles in bytes, the least recently used styles are evicted above it
+MAX_STORE_BYTES = 64 * 2 ** 30
+
+# Amount of the most used styles that are placed when the service starts
+NUM_PREFETCH_POPULAR = 3
+
+# Size of the chunks in which style files are copied and hashed
+CHUNK_SIZE = 2 ** 20
+
+# ioctl request that clones a file on file systems with copy-on-write support (linux FICLONE)
+FICLONE = 0x40049409
+
+# State of the placed files whose checksum this process has verified, so that they are only hashed again after a change
+verifiedFiles = {}
+
+
+# ===== Methods =========================
+
+def getStyle(styleName):
+    """
+    Makes sure the files of a style are placed in the store and intact
+    Args:
+        styleName: Name of the style
+
+    Returns: -
+
+    """
+    with leaseStyle(styleName):
+        pass
+
+
+@contextmanager
+def leaseStyle(styleName):
+    """
+    Places the files of a style like getStyle and holds a shared lease on them until the context exits,
+    so that no job of another process or thread evicts them before the model has been loaded
+    Args:
+        styleName: Name of the style
+
+    Returns: Context manager in which the files of the style are placed
+
+    """
+    styleName = str(styleName)
+    fileNames = [styleName + STYLE_EXTENSION, styleName + GENERATOR_EXTENSION]
+
+    with ExitStack() as leases:
+        # The leases are taken before placing, so that an eviction in between can not remove the placed files
+        for fileName in fileNames:
+            leases.enter_context(lockFile(fileName, shared=True, extension=LEASE_EXTENSION))
+
+        placeFile(fileNames[0], required=True)
+        placeFile(fileNames[1], required=False)
+
+        evictFiles(keepFiles=fileNames)
+
+        yield
+
+
+def placeFile(fileName, required):
+    """
+    Places a file of the source folder in the store, unless an intact copy of its current version is already there
+    Args:
+        fileName: Name of the file
+        required: If a missing file is an error
+
+    Returns: -
+
+    """
+    sourcePath = SOURCE_DIRECTORY + fileName
+    storePath = STORE_DIRECTORY + fileName
+
+    with lockFile(fileName):
+        metadata = readMetadata(fileName)
+        sourceState = getSourceState(sourcePath)
+
+        if sourceState is None:
+            # Without a source, an intact copy that was placed before can still be used
+            if not isIntact(storePath, metadata):
+                if required:
+                    raise FileNotFoundError("Style file {} not found".format(sourcePath))
+                return
+        elif not isIntact(storePath, metadata) or metadata["source"] != sourceState:
+            print("Placing style file " + fileName)
+
+            checksum = copyFile(sourcePath, storePath, sourceState["checksum"])
+            storeStat = os.stat(storePath)
+            metadata = {
+                "checksum": checksum,
+                "size": storeStat.st_size,
+                "mtime": storeStat.st_mtime_ns,
+                "source": sourceState,
+                "uses": metadata["uses"] if metadata is not None else 0
+            }
+
+            # The checksum was just computed from the placed data, so the next job does not hash it again
+            verifiedFiles[storePath] = getVerifiedState(storeStat, checksum)
+
+        metadata["uses"] += 1
+        metadata["lastUsed"] = time.time()
+        writeMetadata(fileName, metadata)
+
+
+def copyFile(sourcePath, storePath, expectedChecksum):
+    """
+    Places a file by hardlink, reflink or copy and verifies its checksum before moving it to its final place
+    Args:
+        sourcePath: Path of the source file
+        storePath: Final path of the placed file
+        expectedChecksum: The sha1 hex digest the file must have, or None if the source has no checksum file
+
+    Returns: The sha1 hex digest of the placed file
+
+    """
+    partPath = "{}.part.{}.{}".format(storePath, os.getpid(), threading.get_ident())
+
+    if os.path.exists(partPath):
+        os.remove(partPath)
+
+    try:
+        checksum = None
+
+        # Hardlinks and reflinks are only possible on the same file system
+        try:
+            os.link(sourcePath, partPath)
+        except OSError:
+            if not reflinkFile(sourcePath, partPath):
+                checksum = copyAndHashFile(sourcePath, partPath)
+
+        if checksum is None:
+            checksum = hashFile(partPath)
+
+        if expectedChecksum is not None and checksum != expectedChecksum:
+            raise ValueError("Checksum mismatch of {}: expected {}, got {}".format(sourcePath, expectedChecksum,
+                                                                                 checksum))
+
+        os.replace(partPath, storePath)
+    finally:
+        if os.path.exists(partPath):
+            os.remove(partPath)
+
+    return checksum
+
+
+def reflinkFile(sourcePath, partPath):
+    """
+    Clones a file without copying its data, on file systems with copy-on-write support like btrfs or xfs
+    Args:
+        sourcePath: Path of the source file
+        partPath: Path of the clone
+
+    Returns: If the file could be cloned
+
+    """
+    try:
+        with open(sourcePath, "rb") as source, open(partPath, "wb") as part:
+            fcntl.ioctl(part.fileno(), FICLONE, source.fileno())
+        return True
+    except OSError:
+        if os.path.exists(partPath):
+            os.remove(partPath)
+        return False
+
+
+def copyAndHashFile(sourcePath, partPath):
+    """
+    Copies a file durably and hashes the copied data on the way
+    Args:
+        sourcePath: Path of the source file
+        partPath: Path of the copy
+
+    Returns: The sha1 hex digest of the copied data
+
+    """
+    fileHash = hashlib.sha1()
+
+    with open(sourcePath, "rb") as source, open(partPath, "wb") as part:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+            fileHash.update(chunk)
+            part.write(chunk)
+
+        part.flush()
+        os.fsync(part.fileno())
+
+    shutil.copystat(sourcePath, partPath)
+
+    return fileHash.hexdigest()
+
+
+def hashFile(path):
+    """
+    Hashes the content of a file
+    Args:
+        path: Path of the file
+
+    Returns: The sha1 hex digest of the file
+
+    """
+    fileHash = hashlib.sha1()
+
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            fileHash.update(chunk)
+
+    return fileHash.hexdigest()
+
+
+def getSourceState(sourcePath):
+    """
+    Describes the current version of a source file
+    Args:
+        sourcePath: Path of the source file
+
+    Returns: Dictionary with size, modification time and checksum of the source, or None if it does not exist
+
+    """
+    if not os.path.isfile(sourcePath):
+        return None
+
+    sourceStat = os.stat(sourcePath)
+
+    checksum = None
+    if os.path.exists(sourcePath + CHECKSUM_EXTENSION):
+        with open(sourcePath + CHECKSUM_EXTENSION, "r") as file:
+            checksum = file.read().split()[0].lower()
+
+    return {"size": sourceStat.st_size, "mtime": sourceStat.st_mtime_ns, "checksum": checksum}
+
+
+def isIntact(storePath, metadata):
+    """
+    Checks if a placed file is complete and unchanged since it was verified
+    Args:
+        storePath: Path of the placed file
+        metadata: Metadata of the placed file, or None
+
+    Returns: If the file can be used
+
+    """
+    if metadata is None or not os.path.isfile(storePath):
+        return False
+
+    storeStat = os.stat(storePath)
+
+    if storeStat.st_size != metadata["size"] or storeStat.st_mtime_ns != metadata["mtime"]:
+        return False
+
+    if metadata.get("checksum") is None:
+        return True
+
+    # Size and modification time can stay the same although the content changed,
+    # the change time can not be set back, so the file is hashed again after every change
+    if verifiedFiles.get(storePath) == getVerifiedState(storeStat, metadata["checksum"]):
+        return True
+
+    if hashFile(storePath) != metadata["checksum"]:
+        return False
+
+    verifiedFiles[storePath] = getVerifiedState(storeStat, metadata["checksum"])
+
+    return True
+
+
+def getVerifiedState(storeStat, checksum):
+    """
+    Describes a placed file whose content has been verified against its checksum
+    Args:
+        storeStat: Result of os.stat of the placed file
+        checksum: The sha1 hex digest the content was verified against
+
+    Returns: Tuple that changes with every change of the file
+
+    """
+    return storeStat.st_ino, storeStat.st_size, storeStat.st_mtime_ns, storeStat.st_ctime_ns, checksum
+
+
+def evictFiles(keepFiles=()):
+    """
+    Removes the least recently used files until the store is within its size limit
+    Files that are currently placed or leased by another job are skipped
+    Args:
+        keepFiles: Names of files that must not be evicted, e.g. the files of the current job
+
+    Returns: -
+
+    """
+    if not os.path.isdir(METADATA_DIRECTORY):
+        return
+
+    entries = []
+    for metadataFile in os.listdir(METADATA_DIRECTORY):
+        if metadataFile.endswith(".json"):
+            fileName = metadataFile[:-len(".json")]
+            metadata = readMetadata(fileName)
+            if metadata is not None:
+                entries.append((metadata.get("lastUsed", 0), fileName, metadata["size"]))
+
+    storeBytes = sum(size for _, _, size in entries)
+
+    for _, fileName, size in sorted(entries):
+        if storeBytes <= MAX_STORE_BYTES:
+            break
+
+        if fileName in keepFiles:
+            continue
+
+        with lockFile(fileName, blocking=False) as locked, \
+                lockFile(fileName, blocking=False, extension=LEASE_EXTENSION) as unleased:
+            if not locked or not unleased:
+                continue
+
+            print("Evicting style file " + fileName)
+
+            if os.path.exists(STORE_DIRECTORY + fileName):
+                os.remove(STORE_DIRECTORY + fileName)
+            os.remove(getMetadataPath(fileName))
+
+        storeBytes -= size
+
+
+def prefetchStyles(styles=()):
+    """
+    Places the configured styles and the most used styles of this node, so that their first jobs start right away.
+    Meant to run in the background when the service starts
+    Args:
+        styles: The configured styles, placed before the most used styles
+
+    Returns: -
+
+    """
+    styleUses = {}
+
+    if os.path.isdir(METADATA_DIRECTORY):
+        for metadataFile in os.listdir(METADATA_DIRECTORY):
+            if metadataFile.endswith(STYLE_EXTENSION + ".json"):
+                metadata = readMetadata(metadataFile[:-len(".json")])
+                if metadata is not None:
+                    styleUses[metadataFile[:-len(STYLE_EXTENSION + ".json")]] = metadata["uses"]
+
+    popularStyles = sorted(styleUses, key=styleUses.get, reverse=True)[:NUM_PREFETCH_POPULAR]
+
+    for styleName in list(styles) + [style for style in popularStyles if style not in styles]:
+        try:
+            getStyle(styleName)
+        except (OSError, ValueError) as exception:
+            print("Prefetching style {} failed: {}".format(styleName, exception))
+
+
+@contextmanager
+def lockFile(fileName, blocking=True, shared=False, extension=LOCK_EXTENSION):
+    """
+    Locks a file of the store against all other jobs and processes
+    Args:
+        fileName: Name of the file
+        blocking: If the lock is waited for, otherwise the context yields False if the file is locked
+        shared: If other shared locks may be held at the same time, e.g. the leases of several jobs
+        extension: Extension of the lock file, LOCK_EXTENSION or LEASE_EXTENSION
+
+    Returns: Context manager that yields if the lock is held
+
+    """
+    os.makedirs(METADATA_DIRECTORY, exist_ok=True)
+
+    operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+    if not blocking:
+        operation |= fcntl.LOCK_NB
+
+    with open(os.path.join(METADATA_DIRECTORY, fileName + extension), "w") as lock:
+        try:
+            fcntl.flock(lock.fileno(), operation)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def getMetadataPath(fileName):
+    """
+    Returns the path of the metadata file of a placed file
+    Args:
+        fileName: Name of the placed file
+
+    Returns: The path
+
+    """
+    return os.path.join(METADATA_DIRECTORY, fileName + ".json")
+
+
+def readMetadata(fileName):
+    """
+    Reads the metadata of a placed file
+    Args:
+        fileName: Name of the placed file
+
+    Returns: The metadata as dictionary or None if it does not exist
+
+    """
+    metadataPath = getMetadataPath(fileName)
+
+    if not os.path.exists(metadataPath):
+        return None
+
+    try:
+        with open(metadataPath, "r") as file:
+            return json.load(file)
+    except ValueError:
+        return None
+
+
+def writeMetadata(fileName, metadata):
+    """
+    Writes the metadata of a placed file, replacing it atomically
+    Args:
+        fileName: Name of the placed file
+        metadata: The metadata as dictionary
+
+    Returns: -
+
+    """
+    with dnnlib.util.atomic_write(getMetadataPath(fileName)) as file:
+        json.dump(metadata, file, indent=2)
@@ -1,6 +1,6 @@
 # ===== Inits + Definitions =========================
 import requests
-from Synthesis import PklCopier, BloomyDreams
+from Synthesis import StyleStore, BloomyDreams
 import json
 import jwt
 import datetime
@@ -8,11 +8,48 @@ import os
 import shutil
 from distutils.dir_util import copy_tree
 
+# ===== Global-Variables =========================
+
+# Encode the frames directly into the job video instead of storing them as png images
+RENDER_VIDEO = True
+
+# Format of the intermediate frames if no video is rendered, one of FrameSinks.FRAME_FORMATS
+# The cheapest format depends on the storage and the network, e.g. fastPng or zlib for network storage
+FRAME_FORMAT = "png"
+
+# Name of the rendered video in the job directory
+VIDEO_FILENAME = "video.mp4"
+
+# Name of the preview video in the job directory
+PREVIEW_FILENAME = "preview.mp4"
+
+# Consecutive frames whose motion vectors differ by at most this value are only synthesized once
+DEDUP_TOLERANCE = 1e-3
+
+# Folder in the job directory in which the progress of the synthesis is recorded
+CHECKPOINT_FOLDERNAME = "synthesisCheckpoint"
+
+# Folder in the job directory in which the frames of the last render are kept,
+# so that a resubmitted job only synthesizes the frames whose motion vectors changed.
+# The cache is only written for jobs that request it, because it costs an extra encode of every frame
+RENDER_CACHE_FOLDERNAME = "renderCache"
+
+# Frames whose motion vectors differ from the last render by at most this value are reused
+REUSE_TOLERANCE = 1e-3
+
+# Blocks up to this resolution only follow the base motion and are synthesized once per base motion vector,
+# so the audio only moves the fine details, None lets the audio move all layers
+COARSE_RESOLUTION = None
+
+# Consecutive frames whose base motion vectors differ by at most this value share the coarse blocks
+COARSE_TOLERANCE = 1e-3
+
+
 # ===== Methods =========================
 
 
 # Start the Main Logic
-def start(jobId, apiUrl, SECRET_KEY):
+def start(jobId, apiUrl, SECRET_KEY, keyframeStride=1, previewResolution=None, keepRenderCache=False):
     appPath = "/app/"
     jobPath = "/app/meta/jobs/" + jobId
 
@@ -56,6 +93,7 @@ def start(jobId, apiUrl, SECRET_KEY):
     pulseData = list(map(float, jobParameters["pulseData"].split(",")))
     songSections = list(map(float, jobParameters["songSections"].split(",")))
     fps = int(jobParameters["fps"])
+    videoStart = float(jobParameters["videoStart"])
     loopVideo = eval(jobParameters["loopVideo"].capitalize())
     visualizeSections = eval(jobParameters["visualizeSections"].capitalize())
     showPlots = eval("False")
@@ -67,9 +105,6 @@ def start(jobId, apiUrl, SECRET_KEY):
     motionRandomness = float(jobParameters["motionRandomness"])
     truncation = float(jobParameters["truncation"])
 
-    # Downloading PKL file
-    PklCopier.getStyle(style)
-
     # Create the generator object
     bloomyDreams = BloomyDreams(
         style=style,
@@ -79,6 +114,24 @@ def start(jobId, apiUrl, SECRET_KEY):
         fps=fps
     )
 
+    # The video is encoded into the job directory right away, together with the job audio
+    videoPath = jobPath + "/" + VIDEO_FILENAME if RENDER_VIDEO else None
+    audioPath = jobPath + "/audio/audio.mp3" if RENDER_VIDEO else None
+
+    # Otherwise the frames are packed into the tar archive in the job directory while they are rendered
+    tarPath = None if RENDER_VIDEO else jobPath + "/" + jobTempFoldername + ".tar"
+    checkpointPath = jobPath + "/" + CHECKPOINT_FOLDERNAME
+    renderCachePath = jobPath + "/" + RENDER_CACHE_FOLDERNAME if keepRenderCache else None
+
+    # Previews are always encoded as video, so that the parameters can be approved right away
+    # They are short to render, so no checkpoint is recorded and the render cache of the job is kept
+    if previewResolution is not None:
+        videoPath = jobPath + "/" + PREVIEW_FILENAME
+        audioPath = jobPath + "/audio/audio.mp3"
+        tarPath = None
+        checkpointPath = None
+        renderCachePath = None
+
     # Start the image generation
     synthesisStatus = bloomyDreams.hallucinate(
         outPath=jobTempPath,
@@ -91,15 +144,40 @@ def start(jobId, apiUrl, SECRET_KEY):
         videoSmoothness=videoSmoothness,
         motionRandomness=motionRandomness,
         truncation=truncation,
+        videoPath=videoPath,
+        audioPath=audioPath,
+        audioStart=videoStart,
+        tarPath=tarPath,
+        frameFormat=FRAME_FORMAT,
+        checkpointPath=checkpointPath,
+        dedupTolerance=DEDUP_TOLERANCE,
+        keyframeStride=keyframeStride,
+        previewResolution=previewResolution,
+        renderCachePath=renderCachePath,
+        reuseTolerance=REUSE_TOLERANCE,
+        coarseResolution=COARSE_RESOLUTION,
+        coarseTolerance=COARSE_TOLERANCE,
+        # Placing the verified style files in the working directory
+        # They stay leased until the model is loaded, so that no other job evicts them before
+        styleLease=StyleStore.leaseStyle(style)
     )
 
-    # Copy cached files from job temp directory to the server
-    print("Copying cached images to storage.bloompipe.de ...")
-    jobTempTar = jobTempFoldername + ".tar"
+    # Previews are finished once the preview video exists
+    if previewResolution is not None:
+        print("Preview " + ("Successful" if synthesisStatus == "synthesisSuccessful" else "Failed"))
+
+        requests.post(
+            apiUrl + "/api/database/setJobAttr",
+            headers={
+                "access-token": jwt.encode({"user": "bloompipe"}, SECRET_KEY, algorithm="HS256")
+            },
+            json={
+                "jobId": jobId,
+                "values": {"status": "previewFinished" if synthesisStatus == "synthesisSuccessful" else "previewFailed"}
+            }
+        )
 
-    os.system("tar -cf " + jobTempTar + " -C " + appPath + " " + jobTempFoldername)
-    os.system("cp " + jobTempTar + " " + jobPath)
-    os.system("rm -f " + jobTempTar)
+        return
 
     # Starting video file creation
     if synthesisStatus == "synthesisSuccessful":
@@ -122,7 +200,9 @@ def start(jobId, apiUrl, SECRET_KEY):
                 "access-token": jwt.encode({"user": "bloompipe"}, SECRET_KEY, algorithm="HS256")
             },
             json={
-                "jobId": jobId
+                "jobId": jobId,
+                # Tells the postpro service that the video has already been encoded
+                "videoFile": VIDEO_FILENAME if RENDER_VIDEO else None
             }
         )
 
@@ -0,0 +1,107 @@
+# ===== Inits + Definitions =========================
+import time
+import threading
+import torch
+
+from stylegan2.torch_utils.ops import bias_act, upfirdn2d
+from .BloomyDreams import BloomyDreams
+from . import Autotuner, StyleStore
+
+"""
+This module warms up the synthesis service when it starts, so that the first jobs are as fast as all later ones.
+It loads the prebuilt custom ops, loads the configured styles into the model cache and runs a dummy batch
+through the mapping and the synthesis network of each style at the production batch size,
+which lets cudnn pick its algorithms and the memory allocator grow to its working size.
+The service reports itself ready once the warm-up is done.
+"""
+
+# ===== Global-Variables =========================
+
+# State of the warm-up
+warmState = {"ready": False, "warmStyles": [], "failedStyles": [], "seconds": None}
+
+# Lock of the warm-up state
+warmLock = threading.Lock()
+
+
+# ===== Methods =========================
+
+def warmUp(styles=()):
+    """
+    Loads the custom ops and loads and runs each style once, meant to run in the background when the service starts
+    Args:
+        styles: The styles to load into the model cache
+
+    Returns: -
+
+    """
+    startTime = time.time()
+
+    # The plugins are prebuilt into the image, loading them here keeps it off the path of the first job
+    if torch.cuda.is_available():
+        print("Loading custom ops...")
+        bias_act._init()
+        upfirdn2d._init()
+    else:
+        print("Loading custom cpu ops...")
+        bias_act._init_cpu()
+        upfirdn2d._init_cpu()
+
+    for style in styles:
+        try:
+            warmStyle(style)
+
+            with warmLock:
+                warmState["warmStyles"].append(style)
+        except Exception as exception:
+            print("Warming up style {} failed: {}".format(style, exception))
+
+            with warmLock:
+                warmState["failedStyles"].append(style)
+
+    with warmLock:
+        warmState["ready"] = True
+        warmState["seconds"] = time.time() - startTime
+
+    print("Synthesis service is ready after {:.1f} seconds".format(warmState["seconds"]))
+
+
+def warmStyle(style):
+    """
+    Loads a style into the model cache and synthesizes a dummy batch at the batch size of its plan
+    Args:
+        style: Name of the style
+
+    Returns: -
+
+    """
+    print("Warming up style {}...".format(style))
+
+    # Loading goes through the model cache, so the jobs of this style reuse the loaded model
+    # The style files are leased until the model is loaded, so that no other job evicts them before
+    with StyleStore.leaseStyle(style):
+        bloomyDreams = BloomyDreams(pulseAudio=[0.0], songSections=[0.0], style=style)
+        bloomyDreams.styleganInit()
+
+    Gs = bloomyDreams.Gs
+    device = Gs.synthesis.b4.const.device
+    synthesisKWArgs = {'noise_mode': 'const', **Autotuner.applyPlan(bloomyDreams.plan)}
+
+    z = torch.randn([bloomyDreams.plan["batchSize"], Gs.z_dim], device=device)
+    ws, styles = Gs.infer_styles(z)
+    Gs.infer_images(ws, styles=styles, force_fp32=True, **synthesisKWArgs)
+
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+    del z, ws, styles
+
+
+def getWarmState():
+    """
+    Returns the state of the warm-up
+    Returns: Dictionary with the readiness, the warmed and failed styles and the duration of the warm-up
+
+    """
+    with warmLock:
+        return {key: list(value) if isinstance(value, list) else value for key, value in warmState.items()}
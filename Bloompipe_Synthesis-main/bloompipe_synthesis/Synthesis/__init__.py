@@ -1,4 +1,12 @@
 from .BloomyDreams import *
+from .Autotuner import *
+from .BatchSizer import *
+from .FrameSinks import *
+from .Checkpoints import *
+from .RenderCache import *
+from .ModelCache import *
 from .Synthesis import *
-from .PklCopier import *
+from .StyleStore import *
+from .StyleCatalog import *
+from .WarmPool import *
 from .ArrayInterpolations import *
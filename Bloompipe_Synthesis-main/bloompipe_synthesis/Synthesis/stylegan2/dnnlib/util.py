@@ -8,6 +8,7 @@
 
 """Miscellaneous utility classes and functions."""
 
+import contextlib
 import ctypes
 import fnmatch
 import importlib
@@ -358,6 +359,27 @@ def copy_files_and_create_dirs(files: List[Tuple[str, str]]) -> None:
         shutil.copyfile(file[0], file[1])
 
 
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = "w") -> Any:
+    """Opens a temporary file next to the given path and moves it into place once the block completes.
+    The temporary name comes from tempfile.mkstemp, so concurrent writers in other threads, processes
+    or nodes never share it. The data is fsynced before the rename, so readers and a crash only ever
+    leave the old or the complete new file. The temporary file is removed if the block fails."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".", suffix=".part")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+
+        # mkstemp creates the file readable by its owner only, the replaced file was readable by everyone
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
 # URL helpers
 # ------------------------------------------------------------------------------------------
 
@@ -0,0 +1,54 @@
+# Copyright (c) 2021, NVIDIA CORPORATION.  All rights reserved.
+#
+# NVIDIA CORPORATION and its licensors retain all intellectual property
+# and proprietary rights in and to this software, related documentation
+# and any modifications thereto.  Any use, reproduction, disclosure or
+# distribution of this software and related documentation without an express
+# license agreement from NVIDIA CORPORATION is strictly prohibited.
+
+"""Export the generator of a network pickle into the memory-mappable generator format."""
+
+import os
+
+import click
+import dnnlib
+
+import legacy
+
+#----------------------------------------------------------------------------
+
+@click.command()
+@click.option('--network', 'network_pkl', help='Network pickle filename', required=True)
+@click.option('--dest', help='Output generator file (default: network pickle with .gen extension)', metavar='PATH')
+def export_generator(
+    network_pkl: str,
+    dest: str
+):
+    """Export G_ema of a network pickle into a generator file that is loaded without unpickling.
+
+    The generator file only holds the init arguments and tensors of G_ema. It is
+    loaded by legacy.load_generator, which maps the tensors of the file into memory.
+
+    Examples:
+
+    \b
+    python export_generator.py --network=obama.pkl --dest=obama.gen
+    """
+
+    if dest is None:
+        dest = os.path.splitext(network_pkl)[0] + '.gen'
+
+    print('Loading networks from "%s"...' % network_pkl)
+    with dnnlib.util.open_url(network_pkl) as f:
+        G = legacy.load_network_pkl(f)['G_ema'] # type: ignore
+
+    print(f'Saving "{dest}"...')
+    legacy.save_generator(G, dest)
+    print('Done.')
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    export_generator() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
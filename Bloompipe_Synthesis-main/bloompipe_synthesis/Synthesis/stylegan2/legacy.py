@@ -11,6 +11,8 @@ import click
 import pickle
 import re
 import copy
+import json
+import struct
 import numpy as np
 import torch
 import sys
@@ -324,6 +326,83 @@ def convert_tf_discriminator(tf_D):
     return D
 
 
+# ----------------------------------------------------------------------------
+# Generator-only format that is loaded without unpickling.
+# The file starts with a magic number and a JSON header holding the init arguments
+# of the generator and the layout of its tensors. The raw tensor data follows,
+# every tensor aligned to GENERATOR_ALIGNMENT bytes, so that it can be memory-mapped.
+
+GENERATOR_MAGIC = b'BLOOMGEN'
+GENERATOR_VERSION = 1
+GENERATOR_ALIGNMENT = 64
+
+
+def _align(offset):
+    return (offset + GENERATOR_ALIGNMENT - 1) // GENERATOR_ALIGNMENT * GENERATOR_ALIGNMENT
+
+
+def save_generator(G, path):
+    tensors = []
+    arrays = []
+    offset = 0
+    for name, tensor in misc.named_params_and_buffers(G):
+        array = np.ascontiguousarray(tensor.detach().cpu().numpy())
+        offset = _align(offset)
+        tensors.append(dict(name=name, dtype=array.dtype.str, shape=list(array.shape), offset=offset))
+        arrays.append(array)
+        offset += array.nbytes
+
+    header = json.dumps(dict(version=GENERATOR_VERSION, init_args=list(G.init_args), init_kwargs=G.init_kwargs,
+                             tensors=tensors)).encode('utf-8')
+    data_start = _align(len(GENERATOR_MAGIC) + 8 + len(header))
+
+    # Write next to the destination and rename, so that a crash never leaves a partial file.
+    with dnnlib.util.atomic_write(path, 'wb') as f:
+        f.write(GENERATOR_MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for spec, array in zip(tensors, arrays):
+            f.write(b'\0' * (data_start + spec['offset'] - f.tell()))
+            f.write(array.tobytes())
+
+
+def load_generator(path, device=torch.device('cpu')):
+    from stylegan2.training import networks
+    with open(path, 'rb') as f:
+        if f.read(len(GENERATOR_MAGIC)) != GENERATOR_MAGIC:
+            raise ValueError(f'"{path}" is not a generator file')
+        header_size, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_size).decode('utf-8'))
+    if header['version'] != GENERATOR_VERSION:
+        raise ValueError(f'Unsupported generator file version {header["version"]}')
+    data_start = _align(len(GENERATOR_MAGIC) + 8 + header_size)
+
+    # Copy-on-write mapping: the tensors share the pages of the page cache until they are written.
+    data = np.memmap(path, dtype=np.uint8, mode='c')
+    tensors = {}
+    for spec in header['tensors']:
+        dtype = np.dtype(spec['dtype'])
+        start = data_start + spec['offset']
+        size = int(np.prod(spec['shape'], dtype=np.int64)) * dtype.itemsize
+        tensors[spec['name']] = torch.from_numpy(data[start:start + size].view(dtype).reshape(spec['shape']))
+
+    # Replace the freshly initialized tensors by zero-copy views of the file.
+    G = networks.Generator(*header['init_args'], **dnnlib.EasyDict(header['init_kwargs']))
+    for module_name, module in G.named_modules():
+        prefix = module_name + '.' if module_name else ''
+        for name, param in list(module._parameters.items()):
+            if param is not None:
+                tensor = tensors[prefix + name]
+                assert tensor.shape == param.shape, prefix + name
+                module._parameters[name] = torch.nn.Parameter(tensor, requires_grad=False)
+        for name, buffer in list(module._buffers.items()):
+            if buffer is not None:
+                tensor = tensors[prefix + name]
+                assert tensor.shape == buffer.shape, prefix + name
+                module._buffers[name] = tensor
+    return G.eval().requires_grad_(False).to(device)
+
+
 # ----------------------------------------------------------------------------
 
 @click.command()
@@ -0,0 +1,79 @@
+# Copyright (c) 2021, NVIDIA CORPORATION.  All rights reserved.
+#
+# NVIDIA CORPORATION and its licensors retain all intellectual property
+# and proprietary rights in and to this software, related documentation
+# and any modifications thereto.  Any use, reproduction, disclosure or
+# distribution of this software and related documentation without an express
+# license agreement from NVIDIA CORPORATION is strictly prohibited.
+
+"""Build the custom ops ahead of time into the persistent plugin cache."""
+
+import os
+import sys
+
+import click
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from stylegan2.torch_utils import custom_ops
+from stylegan2.torch_utils.ops import bias_act, upfirdn2d
+
+#----------------------------------------------------------------------------
+# Plugins by variant, as (name, init function) pairs.
+
+CUDA_PLUGINS = [
+    ('bias_act', bias_act._init),
+    ('upfirdn2d', upfirdn2d._init),
+]
+
+CPU_PLUGINS = [
+    ('bias_act_cpu', bias_act._init_cpu),
+    ('upfirdn2d_cpu', upfirdn2d._init_cpu),
+]
+
+#----------------------------------------------------------------------------
+
+@click.command()
+@click.option('--cpu-only', help='Only build the CPU variants', is_flag=True)
+@click.option('--with-cuda', help='Build the CUDA variants even if no GPU is visible', is_flag=True)
+@click.option('--verbose', help='Print the full build output', is_flag=True)
+def prebuild_ops(
+    cpu_only: bool,
+    with_cuda: bool,
+    verbose: bool
+):
+    """Build the custom ops ahead of time, so that workers load them in milliseconds instead of compiling them.
+
+    The plugins are stored in a build cache keyed by their sources, the torch version and the compilers,
+    under $TORCH_EXTENSIONS_DIR if set and under the dnnlib cache directory otherwise.
+    The CUDA variants are built if CUDA is available and --cpu-only is not given, or if --with-cuda is given,
+    e.g. while building an image without a GPU. Set TORCH_CUDA_ARCH_LIST to the architectures of the
+    target GPUs in that case, the build then no longer depends on the visible devices.
+
+    Examples:
+
+    \b
+    python Synthesis/stylegan2/prebuild_ops.py
+    python Synthesis/stylegan2/prebuild_ops.py --cpu-only
+    TORCH_CUDA_ARCH_LIST="7.5;8.6" python Synthesis/stylegan2/prebuild_ops.py --with-cuda
+    """
+
+    custom_ops.verbosity = 'full' if verbose else 'brief'
+    custom_ops.allow_build = True
+
+    plugins = list(CPU_PLUGINS)
+    if with_cuda or (not cpu_only and torch.cuda.is_available()):
+        plugins += CUDA_PLUGINS
+
+    failed = [name for name, init in plugins if not init()]
+    if failed:
+        print(f'Failed to build: {", ".join(failed)}')
+        sys.exit(1)
+    print(f'Built {len(plugins)} plugins.')
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    prebuild_ops() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
@@ -7,13 +7,17 @@
 # license agreement from NVIDIA CORPORATION is strictly prohibited.
 
 import os
+import sys
 import glob
+import time
 import torch
 import torch.utils.cpp_extension
 import importlib
+import importlib.util
 import hashlib
 import shutil
-from pathlib import Path
+import subprocess
+import stylegan2.dnnlib as dnnlib
 
 from torch.utils.file_baton import FileBaton
 
@@ -21,6 +25,7 @@ from torch.utils.file_baton import FileBaton
 # Global options.
 
 verbosity = 'brief' # Verbosity level: 'none', 'brief', 'full'
+allow_build = True  # Compile plugins that have not been prebuilt. Workers that must never compile on the job path can disable this.
 
 #----------------------------------------------------------------------------
 # Internal helper funcs.
@@ -38,6 +43,51 @@ def _find_compiler_bindir():
             return matches[-1]
     return None
 
+_compiler_versions = dict()
+
+def _get_compiler_version(command):
+    # First line of `<compiler> --version`, which identifies the compiler and its version.
+    if command not in _compiler_versions:
+        try:
+            output = subprocess.run([command, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=30).stdout
+            _compiler_versions[command] = output.decode('utf-8', 'replace').strip().splitlines()[0]
+        except (OSError, IndexError, subprocess.SubprocessError):
+            _compiler_versions[command] = 'unknown'
+    return _compiler_versions[command]
+
+def _get_build_key(module_name, source_files, build_kwargs, with_cuda):
+    # Digest of everything that affects the binary: the sources including headers,
+    # the build arguments, the torch version and the compilers.
+    key = hashlib.sha256()
+    for src in source_files:
+        key.update(os.path.basename(src).encode())
+        with open(src, 'rb') as f:
+            key.update(hashlib.sha256(f.read()).digest())
+    key.update(repr(sorted(build_kwargs.items())).encode())
+    key.update(torch.__version__.encode())
+    key.update(_get_compiler_version(os.environ.get('CXX', 'c++')).encode())
+    if with_cuda:
+        key.update(str(torch.version.cuda).encode())
+        key.update(os.environ.get('TORCH_CUDA_ARCH_LIST', '').encode())
+        # Without an explicit arch list, the build targets the visible devices.
+        if not os.environ.get('TORCH_CUDA_ARCH_LIST') and torch.cuda.is_available():
+            key.update(str(sorted(set(torch.cuda.get_device_capability(i) for i in range(torch.cuda.device_count())))).encode())
+        if torch.utils.cpp_extension.CUDA_HOME is not None:
+            key.update(_get_compiler_version(os.path.join(torch.utils.cpp_extension.CUDA_HOME, 'bin', 'nvcc')).encode())
+    return key.hexdigest()
+
+def _get_build_root():
+    if 'TORCH_EXTENSIONS_DIR' in os.environ:
+        return os.environ['TORCH_EXTENSIONS_DIR']
+    return dnnlib.make_cache_dir_path('torch_extensions')
+
+def _import_prebuilt(module_name, module_path):
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[module_name] = module
+    return module
+
 #----------------------------------------------------------------------------
 # Main entry point for compiling and loading C++/CUDA plugins.
 
@@ -55,6 +105,8 @@ def get_plugin(module_name, sources, **build_kwargs):
         print(f'Setting up PyTorch plugin "{module_name}"...')
     elif verbosity == 'brief':
         print(f'Setting up PyTorch plugin "{module_name}"... ', end='', flush=True)
+    start_time = time.time()
+    prebuilt = False
 
     try: # pylint: disable=too-many-nested-blocks
         # Make sure we can find the necessary compiler binaries.
@@ -67,48 +119,47 @@ def get_plugin(module_name, sources, **build_kwargs):
         # Compile and load.
         verbose_build = (verbosity == 'full')
 
-        # Incremental build md5sum trickery.  Copies all the input source files
-        # into a cached build directory under a combined md5 digest of the input
-        # source files.  Copying is done only if the combined digest has changed.
-        # This keeps input file timestamps and filenames the same as in previous
-        # extension builds, allowing for fast incremental rebuilds.
-        #
-        # This optimization is done only in case all the source files reside in
-        # a single directory (just for simplicity) and if the TORCH_EXTENSIONS_DIR
-        # environment variable is set (we take this as a signal that the user
-        # actually cares about this.)
-        source_dirs_set = set(os.path.dirname(source) for source in sources)
-        if len(source_dirs_set) == 1 and ('TORCH_EXTENSIONS_DIR' in os.environ):
-            all_source_files = sorted(list(x for x in Path(list(source_dirs_set)[0]).iterdir() if x.is_file()))
-
-            # Compute a combined hash digest for all source files in the same
-            # custom op directory (usually .cu, .cpp, .py and .h files).
-            hash_md5 = hashlib.md5()
-            for src in all_source_files:
-                with open(src, 'rb') as f:
-                    hash_md5.update(f.read())
-            build_dir = torch.utils.cpp_extension._get_build_directory(module_name, verbose=verbose_build) # pylint: disable=protected-access
-            digest_build_dir = os.path.join(build_dir, hash_md5.hexdigest())
-
-            if not os.path.isdir(digest_build_dir):
-                os.makedirs(digest_build_dir, exist_ok=True)
-                baton = FileBaton(os.path.join(digest_build_dir, 'lock'))
-                if baton.try_acquire():
-                    try:
-                        for src in all_source_files:
-                            shutil.copyfile(src, os.path.join(digest_build_dir, os.path.basename(src)))
-                    finally:
-                        baton.release()
-                else:
-                    # Someone else is copying source files under the digest dir,
-                    # wait until done and continue.
-                    baton.wait()
-            digest_sources = [os.path.join(digest_build_dir, os.path.basename(x)) for x in sources]
-            torch.utils.cpp_extension.load(name=module_name, build_directory=build_dir,
-                verbose=verbose_build, sources=digest_sources, **build_kwargs)
+        # Persistent build cache. Every build lives in its own directory, named by a
+        # digest of the sources (including the headers next to them), the build
+        # arguments, the torch version and the compilers, so that builds for
+        # different configurations never overwrite each other. A plugin that has been
+        # built before, e.g. by prebuild_ops.py, is imported directly from its
+        # directory without invoking the compiler or ninja. Sources that consist of
+        # C++ files only are built as CPU-only variant.
+        with_cuda = any(os.path.splitext(src)[1] in ['.cu', '.cuh'] for src in sources)
+        headers = sorted(set(header for src in sources for pattern in ['*.h', '*.cuh'] for header in glob.glob(os.path.join(os.path.dirname(src), pattern))))
+        build_key = _get_build_key(module_name, list(sources) + headers, build_kwargs, with_cuda)
+        build_dir = os.path.join(_get_build_root(), f'{module_name}-{build_key[:16]}')
+        module_path = os.path.join(build_dir, module_name + ('.pyd' if os.name == 'nt' else '.so'))
+
+        # The lock file of torch.utils.cpp_extension exists while a build is running.
+        if os.path.isfile(module_path) and not os.path.exists(os.path.join(build_dir, 'lock')):
+            module = _import_prebuilt(module_name, module_path)
+            prebuilt = True
         else:
-            torch.utils.cpp_extension.load(name=module_name, verbose=verbose_build, sources=sources, **build_kwargs)
-        module = importlib.import_module(module_name)
+            if not allow_build:
+                raise RuntimeError(f'Plugin "{module_name}" has not been prebuilt for this configuration and building is disabled.')
+
+            # Build from copies of the sources in the build directory, which keeps
+            # their timestamps and names the same for incremental rebuilds.
+            os.makedirs(build_dir, exist_ok=True)
+            baton = FileBaton(os.path.join(build_dir, 'copy_lock'))
+            if baton.try_acquire():
+                try:
+                    for src in list(sources) + headers:
+                        dst = os.path.join(build_dir, os.path.basename(src))
+                        if not os.path.isfile(dst):
+                            shutil.copyfile(src, dst)
+                finally:
+                    baton.release()
+            else:
+                # Someone else is copying source files into the build dir,
+                # wait until done and continue.
+                baton.wait()
+            build_sources = [os.path.join(build_dir, os.path.basename(src)) for src in sources]
+            torch.utils.cpp_extension.load(name=module_name, build_directory=build_dir,
+                verbose=verbose_build, sources=build_sources, with_cuda=with_cuda, **build_kwargs)
+            module = importlib.import_module(module_name)
 
     except:
         if verbosity == 'brief':
@@ -116,10 +167,11 @@ def get_plugin(module_name, sources, **build_kwargs):
         raise
 
     # Print status and add to cache.
+    status = 'Loaded prebuilt' if prebuilt else 'Built'
     if verbosity == 'full':
-        print(f'Done setting up PyTorch plugin "{module_name}".')
+        print(f'Done setting up PyTorch plugin "{module_name}". {status} in {time.time() - start_time:.2f} s.')
     elif verbosity == 'brief':
-        print('Done.')
+        print(f'Done. {status} in {time.time() - start_time:.2f} s.')
     _cached_plugins[module_name] = module
     return module
 
@@ -65,6 +65,14 @@ try:
 except AttributeError:
     symbolic_assert = torch.Assert # 1.7.0
 
+#----------------------------------------------------------------------------
+# Context manager that disables autograd bookkeeping entirely for inference.
+
+try:
+    inference_mode = torch.inference_mode # 1.9.0
+except AttributeError:
+    inference_mode = torch.no_grad # 1.7.0
+
 #----------------------------------------------------------------------------
 # Context manager to suppress known warnings in torch.jit.trace().
 
@@ -50,16 +50,33 @@ def _init():
             warnings.warn('Failed to build CUDA kernels for bias_act. Falling back to slow reference implementation. Details:\n\n' + traceback.format_exc())
     return _plugin is not None
 
+_cpu_activations = ['linear', 'relu', 'lrelu'] # Activation functions supported by the CPU kernel.
+_cpu_inited = False
+_cpu_plugin = None
+
+def _init_cpu():
+    global _cpu_inited, _cpu_plugin
+    if not _cpu_inited:
+        _cpu_inited = True
+        sources = [os.path.join(os.path.dirname(__file__), 'bias_act_cpu.cpp')]
+        flags = ['/O2', '/openmp'] if os.name == 'nt' else ['-O3', '-fopenmp']
+        try:
+            _cpu_plugin = custom_ops.get_plugin('bias_act_cpu_plugin', sources=sources, extra_cflags=flags, extra_ldflags=flags[1:])
+        except:
+            warnings.warn('Failed to build CPU kernels for bias_act. Falling back to slow reference implementation. Details:\n\n' + traceback.format_exc())
+    return _cpu_plugin is not None
+
 #----------------------------------------------------------------------------
 
-def bias_act(x, b=None, dim=1, act='linear', alpha=None, gain=None, clamp=None, impl='cuda'):
+def bias_act(x, b=None, dim=1, act='linear', alpha=None, gain=None, clamp=None, impl='cuda', inplace=False):
     r"""Fused bias and activation function.
 
     Adds bias `b` to activation tensor `x`, evaluates activation function `act`,
     and scales the result by `gain`. Each of the steps is optional. In most cases,
     the fused op is considerably more efficient than performing the same calculation
     using standard PyTorch ops. It supports first and second order gradients,
-    but not third order gradients.
+    but not third order gradients. On CPU, the fused op handles float32 and float64
+    inputs with the activation functions `"linear"`, `"relu"`, and `"lrelu"`.
 
     Args:
         x:      Input activation tensor. Can be of any shape.
@@ -78,6 +95,10 @@ def bias_act(x, b=None, dim=1, act='linear', alpha=None, gain=None, clamp=None,
         clamp:  Clamp the output values to `[-clamp, +clamp]`, or `None` to disable
                 the clamping (default).
         impl:   Name of the implementation to use. Can be `"ref"` or `"cuda"` (default).
+                `"cuda"` selects the fused op on both CUDA and CPU.
+        inplace: Overwrite `x` with the result, which saves allocating a tensor of the
+                size of `x`. Only done by the fused CPU op and only if autograd does not
+                track `x` and `b`. Callers must not use `x` afterwards (default: False).
 
     Returns:
         Tensor of the same shape and datatype as `x`.
@@ -85,7 +106,11 @@ def bias_act(x, b=None, dim=1, act='linear', alpha=None, gain=None, clamp=None,
     assert isinstance(x, torch.Tensor)
     assert impl in ['ref', 'cuda']
     if impl == 'cuda' and x.device.type == 'cuda' and _init():
-        return _bias_act_cuda(dim=dim, act=act, alpha=alpha, gain=gain, clamp=clamp).apply(x, b)
+        return _bias_act_custom(dim=dim, act=act, alpha=alpha, gain=gain, clamp=clamp).apply(x, b)
+    if impl == 'cuda' and x.device.type == 'cpu' and act in _cpu_activations and x.dtype in [torch.float32, torch.float64] and _init_cpu():
+        if inplace and not (torch.is_grad_enabled() and (x.requires_grad or (b is not None and b.requires_grad))):
+            return _bias_act_cpu_inplace(x, b, dim=dim, act=act, alpha=alpha, gain=gain, clamp=clamp)
+        return _bias_act_custom(dim=dim, act=act, alpha=alpha, gain=gain, clamp=clamp).apply(x, b)
     return _bias_act_ref(x=x, b=b, dim=dim, act=act, alpha=alpha, gain=gain, clamp=clamp)
 
 #----------------------------------------------------------------------------
@@ -124,10 +149,28 @@ def _bias_act_ref(x, b=None, dim=1, act='linear', alpha=None, gain=None, clamp=N
 
 #----------------------------------------------------------------------------
 
-_bias_act_cuda_cache = dict()
+def _bias_act_cpu_inplace(x, b=None, dim=1, act='linear', alpha=None, gain=None, clamp=None):
+    """Fast CPU implementation of `bias_act()` that overwrites `x` with the result.
+    """
+    assert clamp is None or clamp >= 0
+    spec = activation_funcs[act]
+    alpha = float(alpha if alpha is not None else spec.def_alpha)
+    gain = float(gain if gain is not None else spec.def_gain)
+    clamp = float(clamp if clamp is not None else -1)
+
+    memory_format = torch.channels_last if x.ndim > 2 and x.stride()[1] == 1 else torch.contiguous_format
+    x = x.contiguous(memory_format=memory_format)
+    b = b.contiguous() if b is not None else _null_tensor
+    if act != 'linear' or gain != 1 or clamp >= 0 or b is not _null_tensor:
+        x = _cpu_plugin.bias_act_(x, b, dim, spec.cuda_idx, alpha, gain, clamp)
+    return x
+
+#----------------------------------------------------------------------------
+
+_bias_act_custom_cache = dict()
 
-def _bias_act_cuda(dim=1, act='linear', alpha=None, gain=None, clamp=None):
-    """Fast CUDA implementation of `bias_act()` using custom ops.
+def _bias_act_custom(dim=1, act='linear', alpha=None, gain=None, clamp=None):
+    """Fast CUDA and CPU implementation of `bias_act()` using custom ops.
     """
     # Parse arguments.
     assert clamp is None or clamp >= 0
@@ -138,19 +181,20 @@ def _bias_act_cuda(dim=1, act='linear', alpha=None, gain=None, clamp=None):
 
     # Lookup from cache.
     key = (dim, act, alpha, gain, clamp)
-    if key in _bias_act_cuda_cache:
-        return _bias_act_cuda_cache[key]
+    if key in _bias_act_custom_cache:
+        return _bias_act_custom_cache[key]
 
     # Forward op.
-    class BiasActCuda(torch.autograd.Function):
+    class BiasActCustom(torch.autograd.Function):
         @staticmethod
         def forward(ctx, x, b): # pylint: disable=arguments-differ
             ctx.memory_format = torch.channels_last if x.ndim > 2 and x.stride()[1] == 1 else torch.contiguous_format
             x = x.contiguous(memory_format=ctx.memory_format)
             b = b.contiguous() if b is not None else _null_tensor
+            plugin = _plugin if x.device.type == 'cuda' else _cpu_plugin
             y = x
             if act != 'linear' or gain != 1 or clamp >= 0 or b is not _null_tensor:
-                y = _plugin.bias_act(x, b, _null_tensor, _null_tensor, _null_tensor, 0, dim, spec.cuda_idx, alpha, gain, clamp)
+                y = plugin.bias_act(x, b, _null_tensor, _null_tensor, _null_tensor, 0, dim, spec.cuda_idx, alpha, gain, clamp)
             ctx.save_for_backward(
                 x if 'x' in spec.ref or spec.has_2nd_grad else _null_tensor,
                 b if 'x' in spec.ref or spec.has_2nd_grad else _null_tensor,
@@ -167,7 +211,7 @@ def _bias_act_cuda(dim=1, act='linear', alpha=None, gain=None, clamp=None):
             if ctx.needs_input_grad[0] or ctx.needs_input_grad[1]:
                 dx = dy
                 if act != 'linear' or gain != 1 or clamp >= 0:
-                    dx = BiasActCudaGrad.apply(dy, x, b, y)
+                    dx = BiasActCustomGrad.apply(dy, x, b, y)
 
             if ctx.needs_input_grad[1]:
                 db = dx.sum([i for i in range(dx.ndim) if i != dim])
@@ -175,11 +219,12 @@ def _bias_act_cuda(dim=1, act='linear', alpha=None, gain=None, clamp=None):
             return dx, db
 
     # Backward op.
-    class BiasActCudaGrad(torch.autograd.Function):
+    class BiasActCustomGrad(torch.autograd.Function):
         @staticmethod
         def forward(ctx, dy, x, b, y): # pylint: disable=arguments-differ
             ctx.memory_format = torch.channels_last if dy.ndim > 2 and dy.stride()[1] == 1 else torch.contiguous_format
-            dx = _plugin.bias_act(dy, b, x, y, _null_tensor, 1, dim, spec.cuda_idx, alpha, gain, clamp)
+            plugin = _plugin if dy.device.type == 'cuda' else _cpu_plugin
+            dx = plugin.bias_act(dy, b, x, y, _null_tensor, 1, dim, spec.cuda_idx, alpha, gain, clamp)
             ctx.save_for_backward(
                 dy if spec.has_2nd_grad else _null_tensor,
                 x, b, y)
@@ -195,7 +240,7 @@ def _bias_act_cuda(dim=1, act='linear', alpha=None, gain=None, clamp=None):
             d_y = None
 
             if ctx.needs_input_grad[0]:
-                d_dy = BiasActCudaGrad.apply(d_dx, x, b, y)
+                d_dy = BiasActCustomGrad.apply(d_dx, x, b, y)
 
             if spec.has_2nd_grad and (ctx.needs_input_grad[1] or ctx.needs_input_grad[2]):
                 d_x = _plugin.bias_act(d_dx, b, x, y, dy, 2, dim, spec.cuda_idx, alpha, gain, clamp)
@@ -206,7 +251,7 @@ def _bias_act_cuda(dim=1, act='linear', alpha=None, gain=None, clamp=None):
             return d_dy, d_x, d_b, d_y
 
     # Add to cache.
-    _bias_act_cuda_cache[key] = BiasActCuda
-    return BiasActCuda
+    _bias_act_custom_cache[key] = BiasActCustom
+    return BiasActCustom
 
 #----------------------------------------------------------------------------
@@ -0,0 +1,183 @@
+// Copyright (c) 2021, NVIDIA CORPORATION.  All rights reserved.
+//
+// NVIDIA CORPORATION and its licensors retain all intellectual property
+// and proprietary rights in and to this software, related documentation
+// and any modifications thereto.  Any use, reproduction, disclosure or
+// distribution of this software and related documentation without an express
+// license agreement from NVIDIA CORPORATION is strictly prohibited.
+
+#include <torch/extension.h>
+#include <ATen/Parallel.h>
+#include <algorithm>
+
+//------------------------------------------------------------------------
+// Helpers.
+
+template <class T> struct InternalType;
+template <> struct InternalType<double> { typedef double scalar_t; };
+template <> struct InternalType<float>  { typedef float  scalar_t; };
+
+static bool has_same_layout(torch::Tensor x, torch::Tensor y)
+{
+    if (x.dim() != y.dim())
+        return false;
+    for (int64_t i = 0; i < x.dim(); i++)
+    {
+        if (x.size(i) != y.size(i))
+            return false;
+        if (x.size(i) >= 2 && x.stride(i) != y.stride(i))
+            return false;
+    }
+    return true;
+}
+
+//------------------------------------------------------------------------
+// CPU kernel parameters.
+
+struct bias_act_cpu_kernel_params
+{
+    const void* x;      // [sizeX]
+    const void* b;      // [sizeB] or NULL
+    const void* yref;   // [sizeX] or NULL
+    void*       y;      // [sizeX], may be the same as x
+
+    float       alpha;
+    float       gain;
+    float       clamp;
+
+    int64_t     sizeX;
+    int64_t     sizeB;
+    int64_t     stepB;
+};
+
+//------------------------------------------------------------------------
+// CPU kernel.
+//
+// Supports the activations of the generator: linear (A = 1), relu (A = 2)
+// and lrelu (A = 3), for the forward pass (G = 0) and the first order
+// gradient (G = 1), with the same semantics as the CUDA kernel. The tensor
+// is processed in runs of elements that share the same bias, so that the
+// inner loop is free of index arithmetic and can be vectorized.
+
+template <class T, int A, int G, bool C> static void bias_act_cpu_kernel(const bias_act_cpu_kernel_params& p)
+{
+    typedef typename InternalType<T>::scalar_t scalar_t;
+    const scalar_t alpha = (scalar_t)p.alpha;
+    const scalar_t gain  = (scalar_t)p.gain;
+    const scalar_t clamp = (scalar_t)p.clamp;
+    const T* x    = (const T*)p.x;
+    const T* b    = (const T*)p.b;
+    const T* yref = (const T*)p.yref;
+    T* y          = (T*)p.y;
+
+    at::parallel_for(0, p.sizeX, at::internal::GRAIN_SIZE, [&](int64_t begin, int64_t end)
+    {
+        for (int64_t start = begin; start < end;)
+        {
+            int64_t stop = std::min(end, (start / p.stepB + 1) * p.stepB);
+            scalar_t bias = (b && G == 0) ? (scalar_t)b[(start / p.stepB) % p.sizeB] : 0;
+
+            for (int64_t xi = start; xi < stop; xi++)
+            {
+                scalar_t v = (scalar_t)x[xi] + bias;
+
+                if (G == 0)
+                {
+                    if (A == 2) v = (v > 0) ? v : 0;
+                    if (A == 3) v = (v > 0) ? v : v * alpha;
+                    v *= gain;
+                    if (C) v = std::min(std::max(v, -clamp), clamp);
+                }
+                else
+                {
+                    scalar_t r = (yref) ? (scalar_t)yref[xi] : 0;
+                    scalar_t yy = (gain != 0) ? r / gain : 0;
+                    if (A == 2) v = (yy > 0) ? v : 0;
+                    if (A == 3) v = (yy > 0) ? v : v * alpha;
+                    v *= gain;
+                    if (C) v = (r > -clamp && r < clamp) ? v : 0;
+                }
+
+                y[xi] = (T)v;
+            }
+            start = stop;
+        }
+    });
+}
+
+//------------------------------------------------------------------------
+
+static void bias_act_cpu(torch::Tensor x, torch::Tensor b, torch::Tensor yref, torch::Tensor y, int grad, int dim, int act, float alpha, float gain, float clamp)
+{
+    // Validate arguments.
+    TORCH_CHECK(x.device().is_cpu(), "x must reside on CPU");
+    TORCH_CHECK(x.dtype() == torch::kFloat || x.dtype() == torch::kDouble, "x must be float32 or float64");
+    TORCH_CHECK(b.numel() == 0 || (b.dtype() == x.dtype() && b.device() == x.device()), "b must have the same dtype and device as x");
+    TORCH_CHECK(yref.numel() == 0 || (yref.sizes() == x.sizes() && yref.dtype() == x.dtype() && yref.device() == x.device()), "yref must have the same shape, dtype, and device as x");
+    TORCH_CHECK(b.dim() == 1, "b must have rank 1");
+    TORCH_CHECK(b.numel() == 0 || (dim >= 0 && dim < x.dim()), "dim is out of bounds");
+    TORCH_CHECK(b.numel() == 0 || b.numel() == x.size(dim), "b has wrong number of elements");
+    TORCH_CHECK(grad == 0 || grad == 1, "grad must be 0 or 1");
+    TORCH_CHECK(act >= 1 && act <= 3, "act must be linear, relu, or lrelu");
+
+    // Validate layout.
+    TORCH_CHECK(x.is_non_overlapping_and_dense(), "x must be non-overlapping and dense");
+    TORCH_CHECK(b.is_contiguous(), "b must be contiguous");
+    TORCH_CHECK(yref.numel() == 0 || has_same_layout(yref, x), "yref must have the same layout as x");
+    TORCH_CHECK(has_same_layout(y, x), "y must have the same layout as x");
+
+    // Initialize CPU kernel parameters.
+    bias_act_cpu_kernel_params p;
+    p.x     = x.data_ptr();
+    p.b     = (b.numel()) ? b.data_ptr() : NULL;
+    p.yref  = (yref.numel()) ? yref.data_ptr() : NULL;
+    p.y     = y.data_ptr();
+    p.alpha = alpha;
+    p.gain  = gain;
+    p.clamp = clamp;
+    p.sizeX = x.numel();
+    p.sizeB = b.numel();
+    p.stepB = (b.numel()) ? x.stride(dim) : std::max<int64_t>(x.numel(), 1);
+
+    // Choose and run CPU kernel.
+    AT_DISPATCH_FLOATING_TYPES(x.scalar_type(), "bias_act_cpu", [&]
+    {
+        #define BIAS_ACT_CPU_KERNEL(A) \
+            if      (grad == 0 && clamp <  0) bias_act_cpu_kernel<scalar_t, A, 0, false>(p); \
+            else if (grad == 0 && clamp >= 0) bias_act_cpu_kernel<scalar_t, A, 0, true>(p);  \
+            else if (grad == 1 && clamp <  0) bias_act_cpu_kernel<scalar_t, A, 1, false>(p); \
+            else                              bias_act_cpu_kernel<scalar_t, A, 1, true>(p);
+        if (act == 1) { BIAS_ACT_CPU_KERNEL(1) }
+        if (act == 2) { BIAS_ACT_CPU_KERNEL(2) }
+        if (act == 3) { BIAS_ACT_CPU_KERNEL(3) }
+        #undef BIAS_ACT_CPU_KERNEL
+    });
+}
+
+//------------------------------------------------------------------------
+
+static torch::Tensor bias_act(torch::Tensor x, torch::Tensor b, torch::Tensor xref, torch::Tensor yref, torch::Tensor dy, int grad, int dim, int act, float alpha, float gain, float clamp)
+{
+    // Same interface as the CUDA plugin. The supported activations need neither xref nor dy.
+    TORCH_CHECK(dy.numel() == 0, "dy is not supported by the CPU kernel");
+    torch::Tensor y = torch::empty_like(x);
+    bias_act_cpu(x, b, yref, y, grad, dim, act, alpha, gain, clamp);
+    return y;
+}
+
+static torch::Tensor bias_act_(torch::Tensor x, torch::Tensor b, int dim, int act, float alpha, float gain, float clamp)
+{
+    // Forward pass that overwrites x with the result.
+    bias_act_cpu(x, b, torch::empty({0}, x.options()), x, 0, dim, act, alpha, gain, clamp);
+    return x;
+}
+
+//------------------------------------------------------------------------
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m)
+{
+    m.def("bias_act", &bias_act);
+    m.def("bias_act_", &bias_act_);
+}
+
+//------------------------------------------------------------------------
@@ -18,6 +18,10 @@ from .upfirdn2d import _get_filter_size
 
 #----------------------------------------------------------------------------
 
+polyphase_cpu = True # Replace transposed convolutions by stride-1 convolutions on CPU.
+
+#----------------------------------------------------------------------------
+
 def _get_weight_shape(w):
     with misc.suppress_tracer_warnings(): # this value will be treated as a constant
         shape = [int(sz) for sz in w.shape]
@@ -55,8 +59,58 @@ def _conv2d_wrapper(x, w, stride=1, padding=0, groups=1, transpose=False, flip_w
 
 #----------------------------------------------------------------------------
 
+def _get_polyphase(in_size, kernel_size, up, padding):
+    """Splits a transposed strided convolution along one dimension into `up` output phases.
+    Returns the output size and, per phase, the first tap of the correlation kernel,
+    the first input pixel, the number of outputs, and the number of taps.
+    """
+    out_size = (in_size - 1) * up + kernel_size - 2 * padding
+    offset = kernel_size - 1 - padding
+    phases = []
+    for r in range(up):
+        k0 = (offset - r) % up
+        c = (r + k0 - offset) // up
+        phases.append((k0, c, max((out_size - r + up - 1) // up, 0), max((kernel_size - k0 + up - 1) // up, 0)))
+    return out_size, phases
+
+def _conv_transpose2d_polyphase(x, w, up, padding, groups, flip_weight):
+    """Transposed strided convolution executed as `up * up` stride-1 convolutions,
+    one per output phase, each using only the taps of `w` that meet input pixels.
+    Matches `_conv2d_wrapper(transpose=True)`, but expects `w` in the layout of `conv2d()`.
+    """
+    out_channels, _, kh, kw = _get_weight_shape(w)
+    pyt, pxt = padding
+    if not flip_weight: # The equivalent stride-1 convolution correlates with the flipped weight.
+        w = w.flip([2, 3])
+    with misc.suppress_tracer_warnings(): # this value will be treated as a constant
+        in_h, in_w = int(x.shape[2]), int(x.shape[3])
+    out_h, phases_y = _get_polyphase(in_h, kh, up, pyt)
+    out_w, phases_x = _get_polyphase(in_w, kw, up, pxt)
+
+    # Pad the input once for all phases.
+    y0 = min([c for _, c, q, j in phases_y if q and j] + [0])
+    y1 = max([c + q + j - 1 for _, c, q, j in phases_y if q and j] + [in_h])
+    x0 = min([c for _, c, q, j in phases_x if q and j] + [0])
+    x1 = max([c + q + j - 1 for _, c, q, j in phases_x if q and j] + [in_w])
+    x = torch.nn.functional.pad(x, [-x0, x1 - in_w, -y0, y1 - in_h])
+
+    # Convolve each phase and interleave the results.
+    y = x.new_empty([x.shape[0], out_channels, out_h, out_w])
+    for ry, (ky, cy, qy, jy) in enumerate(phases_y):
+        for rx, (kx, cx, qx, jx) in enumerate(phases_x):
+            if qy == 0 or qx == 0:
+                continue
+            if jy == 0 or jx == 0:
+                y[:, :, ry::up, rx::up] = 0
+                continue
+            xs = x[:, :, cy - y0 : cy - y0 + qy + jy - 1, cx - x0 : cx - x0 + qx + jx - 1]
+            y[:, :, ry::up, rx::up] = conv2d_gradfix.conv2d(xs, w[:, :, ky::up, kx::up], groups=groups)
+    return y
+
+#----------------------------------------------------------------------------
+
 @misc.profiled_function
-def conv2d_resample(x, w, f=None, up=1, down=1, padding=0, groups=1, flip_weight=True, flip_filter=False):
+def conv2d_resample(x, w, f=None, up=1, down=1, padding=0, groups=1, flip_weight=True, flip_filter=False, impl='cuda'):
     r"""2D convolution with optional up/downsampling.
 
     Padding is performed only once at the beginning, not between the operations.
@@ -76,6 +130,8 @@ def conv2d_resample(x, w, f=None, up=1, down=1, padding=0, groups=1, flip_weight
         groups:         Split input channels into N groups (default: 1).
         flip_weight:    False = convolution, True = correlation (default: True).
         flip_filter:    False = convolution, True = correlation (default: False).
+        impl:           Implementation of the resampling filters. Can be `'ref'` or
+                        `'cuda'` (default: `'cuda'`).
 
     Returns:
         Tensor of the shape `[batch_size, num_channels, out_height, out_width]`.
@@ -105,40 +161,44 @@ def conv2d_resample(x, w, f=None, up=1, down=1, padding=0, groups=1, flip_weight
 
     # Fast path: 1x1 convolution with downsampling only => downsample first, then convolve.
     if kw == 1 and kh == 1 and (down > 1 and up == 1):
-        x = upfirdn2d.upfirdn2d(x=x, f=f, down=down, padding=[px0,px1,py0,py1], flip_filter=flip_filter)
+        x = upfirdn2d.upfirdn2d(x=x, f=f, down=down, padding=[px0,px1,py0,py1], flip_filter=flip_filter, impl=impl)
         x = _conv2d_wrapper(x=x, w=w, groups=groups, flip_weight=flip_weight)
         return x
 
     # Fast path: 1x1 convolution with upsampling only => convolve first, then upsample.
     if kw == 1 and kh == 1 and (up > 1 and down == 1):
         x = _conv2d_wrapper(x=x, w=w, groups=groups, flip_weight=flip_weight)
-        x = upfirdn2d.upfirdn2d(x=x, f=f, up=up, padding=[px0,px1,py0,py1], gain=up**2, flip_filter=flip_filter)
+        x = upfirdn2d.upfirdn2d(x=x, f=f, up=up, padding=[px0,px1,py0,py1], gain=up**2, flip_filter=flip_filter, impl=impl)
         return x
 
     # Fast path: downsampling only => use strided convolution.
     if down > 1 and up == 1:
-        x = upfirdn2d.upfirdn2d(x=x, f=f, padding=[px0,px1,py0,py1], flip_filter=flip_filter)
+        x = upfirdn2d.upfirdn2d(x=x, f=f, padding=[px0,px1,py0,py1], flip_filter=flip_filter, impl=impl)
         x = _conv2d_wrapper(x=x, w=w, stride=down, groups=groups, flip_weight=flip_weight)
         return x
 
     # Fast path: upsampling with optional downsampling => use transpose strided convolution.
+    # On CPU, the transposed convolution is split into stride-1 convolutions per output phase.
     if up > 1:
-        if groups == 1:
-            w = w.transpose(0, 1)
-        else:
-            w = w.reshape(groups, out_channels // groups, in_channels_per_group, kh, kw)
-            w = w.transpose(1, 2)
-            w = w.reshape(groups * in_channels_per_group, out_channels // groups, kh, kw)
         px0 -= kw - 1
         px1 -= kw - up
         py0 -= kh - 1
         py1 -= kh - up
         pxt = max(min(-px0, -px1), 0)
         pyt = max(min(-py0, -py1), 0)
-        x = _conv2d_wrapper(x=x, w=w, stride=up, padding=[pyt,pxt], groups=groups, transpose=True, flip_weight=(not flip_weight))
-        x = upfirdn2d.upfirdn2d(x=x, f=f, padding=[px0+pxt,px1+pxt,py0+pyt,py1+pyt], gain=up**2, flip_filter=flip_filter)
+        if polyphase_cpu and x.device.type == 'cpu':
+            x = _conv_transpose2d_polyphase(x=x, w=w, up=up, padding=[pyt,pxt], groups=groups, flip_weight=flip_weight)
+        else:
+            if groups == 1:
+                w = w.transpose(0, 1)
+            else:
+                w = w.reshape(groups, out_channels // groups, in_channels_per_group, kh, kw)
+                w = w.transpose(1, 2)
+                w = w.reshape(groups * in_channels_per_group, out_channels // groups, kh, kw)
+            x = _conv2d_wrapper(x=x, w=w, stride=up, padding=[pyt,pxt], groups=groups, transpose=True, flip_weight=(not flip_weight))
+        x = upfirdn2d.upfirdn2d(x=x, f=f, padding=[px0+pxt,px1+pxt,py0+pyt,py1+pyt], gain=up**2, flip_filter=flip_filter, impl=impl)
         if down > 1:
-            x = upfirdn2d.upfirdn2d(x=x, f=f, down=down, flip_filter=flip_filter)
+            x = upfirdn2d.upfirdn2d(x=x, f=f, down=down, flip_filter=flip_filter, impl=impl)
         return x
 
     # Fast path: no up/downsampling, padding supported by the underlying implementation => use plain conv2d.
@@ -147,10 +207,10 @@ def conv2d_resample(x, w, f=None, up=1, down=1, padding=0, groups=1, flip_weight
             return _conv2d_wrapper(x=x, w=w, padding=[py0,px0], groups=groups, flip_weight=flip_weight)
 
     # Fallback: Generic reference implementation.
-    x = upfirdn2d.upfirdn2d(x=x, f=(f if up > 1 else None), up=up, padding=[px0,px1,py0,py1], gain=up**2, flip_filter=flip_filter)
+    x = upfirdn2d.upfirdn2d(x=x, f=(f if up > 1 else None), up=up, padding=[px0,px1,py0,py1], gain=up**2, flip_filter=flip_filter, impl=impl)
     x = _conv2d_wrapper(x=x, w=w, groups=groups, flip_weight=flip_weight)
     if down > 1:
-        x = upfirdn2d.upfirdn2d(x=x, f=f, down=down, flip_filter=flip_filter)
+        x = upfirdn2d.upfirdn2d(x=x, f=f, down=down, flip_filter=flip_filter, impl=impl)
     return x
 
 #----------------------------------------------------------------------------
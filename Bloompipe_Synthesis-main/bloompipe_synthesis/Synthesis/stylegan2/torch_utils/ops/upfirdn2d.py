@@ -26,6 +26,7 @@ _plugin = None
 def _init():
     global _inited, _plugin
     if not _inited:
+        _inited = True
         sources = ['upfirdn2d.cpp', 'upfirdn2d.cu']
         sources = [os.path.join(os.path.dirname(__file__), s) for s in sources]
         try:
@@ -34,6 +35,21 @@ def _init():
             warnings.warn('Failed to build CUDA kernels for upfirdn2d. Falling back to slow reference implementation. Details:\n\n' + traceback.format_exc())
     return _plugin is not None
 
+_cpu_inited = False
+_cpu_plugin = None
+
+def _init_cpu():
+    global _cpu_inited, _cpu_plugin
+    if not _cpu_inited:
+        _cpu_inited = True
+        sources = [os.path.join(os.path.dirname(__file__), 'upfirdn2d_cpu.cpp')]
+        flags = ['/O2', '/openmp'] if os.name == 'nt' else ['-O3', '-fopenmp']
+        try:
+            _cpu_plugin = custom_ops.get_plugin('upfirdn2d_cpu_plugin', sources=sources, extra_cflags=flags, extra_ldflags=flags[1:])
+        except:
+            warnings.warn('Failed to build CPU kernels for upfirdn2d. Falling back to slow reference implementation. Details:\n\n' + traceback.format_exc())
+    return _cpu_plugin is not None
+
 def _parse_scaling(scaling):
     if isinstance(scaling, int):
         scaling = [scaling, scaling]
@@ -134,7 +150,9 @@ def upfirdn2d(x, f, up=1, down=1, padding=0, flip_filter=False, gain=1, impl='cu
 
     This sequence of operations bears close resemblance to scipy.signal.upfirdn().
     The fused op is considerably more efficient than performing the same calculation
-    using standard PyTorch ops. It supports gradients of arbitrary order.
+    using standard PyTorch ops. It supports gradients of arbitrary order. On CPU,
+    the fused op handles float32 and float64 inputs and skips the inserted zeros
+    through polyphase decomposition.
 
     Args:
         x:           Float32/float64/float16 input tensor of the shape
@@ -153,6 +171,7 @@ def upfirdn2d(x, f, up=1, down=1, padding=0, flip_filter=False, gain=1, impl='cu
         flip_filter: False = convolution, True = correlation (default: False).
         gain:        Overall scaling factor for signal magnitude (default: 1).
         impl:        Implementation to use. Can be `'ref'` or `'cuda'` (default: `'cuda'`).
+                     `'cuda'` selects the fused op on both CUDA and CPU.
 
     Returns:
         Tensor of the shape `[batch_size, num_channels, out_height, out_width]`.
@@ -160,7 +179,9 @@ def upfirdn2d(x, f, up=1, down=1, padding=0, flip_filter=False, gain=1, impl='cu
     assert isinstance(x, torch.Tensor)
     assert impl in ['ref', 'cuda']
     if impl == 'cuda' and x.device.type == 'cuda' and _init():
-        return _upfirdn2d_cuda(up=up, down=down, padding=padding, flip_filter=flip_filter, gain=gain).apply(x, f)
+        return _upfirdn2d_custom(up=up, down=down, padding=padding, flip_filter=flip_filter, gain=gain).apply(x, f)
+    if impl == 'cuda' and x.device.type == 'cpu' and x.dtype in [torch.float32, torch.float64] and _init_cpu():
+        return _upfirdn2d_custom(up=up, down=down, padding=padding, flip_filter=flip_filter, gain=gain).apply(x, f)
     return _upfirdn2d_ref(x, f, up=up, down=down, padding=padding, flip_filter=flip_filter, gain=gain)
 
 #----------------------------------------------------------------------------
@@ -209,10 +230,10 @@ def _upfirdn2d_ref(x, f, up=1, down=1, padding=0, flip_filter=False, gain=1):
 
 #----------------------------------------------------------------------------
 
-_upfirdn2d_cuda_cache = dict()
+_upfirdn2d_custom_cache = dict()
 
-def _upfirdn2d_cuda(up=1, down=1, padding=0, flip_filter=False, gain=1):
-    """Fast CUDA implementation of `upfirdn2d()` using custom ops.
+def _upfirdn2d_custom(up=1, down=1, padding=0, flip_filter=False, gain=1):
+    """Fast CUDA and CPU implementation of `upfirdn2d()` using custom ops.
     """
     # Parse arguments.
     upx, upy = _parse_scaling(up)
@@ -221,23 +242,24 @@ def _upfirdn2d_cuda(up=1, down=1, padding=0, flip_filter=False, gain=1):
 
     # Lookup from cache.
     key = (upx, upy, downx, downy, padx0, padx1, pady0, pady1, flip_filter, gain)
-    if key in _upfirdn2d_cuda_cache:
-        return _upfirdn2d_cuda_cache[key]
+    if key in _upfirdn2d_custom_cache:
+        return _upfirdn2d_custom_cache[key]
 
     # Forward op.
-    class Upfirdn2dCuda(torch.autograd.Function):
+    class Upfirdn2dCustom(torch.autograd.Function):
         @staticmethod
         def forward(ctx, x, f): # pylint: disable=arguments-differ
             assert isinstance(x, torch.Tensor) and x.ndim == 4
             if f is None:
                 f = torch.ones([1, 1], dtype=torch.float32, device=x.device)
             assert isinstance(f, torch.Tensor) and f.ndim in [1, 2]
+            plugin = _plugin if x.device.type == 'cuda' else _cpu_plugin
             y = x
             if f.ndim == 2:
-                y = _plugin.upfirdn2d(y, f, upx, upy, downx, downy, padx0, padx1, pady0, pady1, flip_filter, gain)
+                y = plugin.upfirdn2d(y, f, upx, upy, downx, downy, padx0, padx1, pady0, pady1, flip_filter, gain)
             else:
-                y = _plugin.upfirdn2d(y, f.unsqueeze(0), upx, 1, downx, 1, padx0, padx1, 0, 0, flip_filter, np.sqrt(gain))
-                y = _plugin.upfirdn2d(y, f.unsqueeze(1), 1, upy, 1, downy, 0, 0, pady0, pady1, flip_filter, np.sqrt(gain))
+                y = plugin.upfirdn2d(y, f.unsqueeze(0), upx, 1, downx, 1, padx0, padx1, 0, 0, flip_filter, np.sqrt(gain))
+                y = plugin.upfirdn2d(y, f.unsqueeze(1), 1, upy, 1, downy, 0, 0, pady0, pady1, flip_filter, np.sqrt(gain))
             ctx.save_for_backward(f)
             ctx.x_shape = x.shape
             return y
@@ -258,14 +280,14 @@ def _upfirdn2d_cuda(up=1, down=1, padding=0, flip_filter=False, gain=1):
             df = None
 
             if ctx.needs_input_grad[0]:
-                dx = _upfirdn2d_cuda(up=down, down=up, padding=p, flip_filter=(not flip_filter), gain=gain).apply(dy, f)
+                dx = _upfirdn2d_custom(up=down, down=up, padding=p, flip_filter=(not flip_filter), gain=gain).apply(dy, f)
 
             assert not ctx.needs_input_grad[1]
             return dx, df
 
     # Add to cache.
-    _upfirdn2d_cuda_cache[key] = Upfirdn2dCuda
-    return Upfirdn2dCuda
+    _upfirdn2d_custom_cache[key] = Upfirdn2dCustom
+    return Upfirdn2dCustom
 
 #----------------------------------------------------------------------------
 
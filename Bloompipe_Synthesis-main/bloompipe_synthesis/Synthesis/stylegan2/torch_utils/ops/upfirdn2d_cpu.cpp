@@ -0,0 +1,185 @@
+// Copyright (c) 2021, NVIDIA CORPORATION.  All rights reserved.
+//
+// NVIDIA CORPORATION and its licensors retain all intellectual property
+// and proprietary rights in and to this software, related documentation
+// and any modifications thereto.  Any use, reproduction, disclosure or
+// distribution of this software and related documentation without an express
+// license agreement from NVIDIA CORPORATION is strictly prohibited.
+
+#include <torch/extension.h>
+#include <ATen/Parallel.h>
+#include <algorithm>
+#include <vector>
+
+//------------------------------------------------------------------------
+// Helpers.
+
+template <class T> struct InternalType;
+template <> struct InternalType<double> { typedef double scalar_t; };
+template <> struct InternalType<float>  { typedef float  scalar_t; };
+
+static inline int floor_mod(int a, int b)
+{
+    int r = a % b;
+    return (r < 0) ? r + b : r;
+}
+
+//------------------------------------------------------------------------
+// CPU kernel parameters.
+
+struct upfirdn2d_cpu_kernel_params
+{
+    const void*     x;
+    const float*    w;              // Filter with flip and gain applied, [filterH, filterW].
+    void*           y;
+
+    int             upx;
+    int             upy;
+    int             downx;
+    int             downy;
+    int             padx0;
+    int             pady0;
+
+    int             inW;
+    int             inH;
+    int             filterW;
+    int             filterH;
+    int             outW;
+    int             outH;
+    int64_t         planes;         // batch * channels
+};
+
+//------------------------------------------------------------------------
+// Polyphase CPU kernel.
+//
+// Output pixel o reads the upsampled and padded image at o * down - pad0 + t
+// for the filter taps t. Only every up-th of these positions holds an input
+// pixel, so the taps of an output pixel start at the phase (pad0 - o * down)
+// mod up and advance by up, which skips the inserted zeros instead of
+// multiplying them. The work is split into output rows of all images and
+// channels. Template arguments of 0 select the generic variant.
+
+template <class T, int up, int down, int filterSize> static void upfirdn2d_cpu_kernel(const upfirdn2d_cpu_kernel_params& p)
+{
+    typedef typename InternalType<T>::scalar_t scalar_t;
+    const int upx = (up) ? up : p.upx;
+    const int upy = (up) ? up : p.upy;
+    const int downx = (down) ? down : p.downx;
+    const int downy = (down) ? down : p.downy;
+    const int filterW = (filterSize) ? filterSize : p.filterW;
+    const int filterH = (filterSize) ? filterSize : p.filterH;
+
+    // First tap and first input column of every output column, the same for all rows.
+    std::vector<int> colTap(p.outW);
+    std::vector<int> colIn(p.outW);
+    for (int ox = 0; ox < p.outW; ox++)
+    {
+        int mx = ox * downx - p.padx0;
+        colTap[ox] = floor_mod(-mx, upx);
+        colIn[ox] = (mx + colTap[ox]) / upx;
+    }
+
+    const T* x = (const T*)p.x;
+    T* y = (T*)p.y;
+    int64_t rows = p.planes * p.outH;
+    int64_t grain = std::max<int64_t>(1, at::internal::GRAIN_SIZE / std::max(1, p.outW * filterW * filterH / (upx * upy)));
+
+    at::parallel_for(0, rows, grain, [&](int64_t begin, int64_t end)
+    {
+        for (int64_t row = begin; row < end; row++)
+        {
+            int64_t plane = row / p.outH;
+            int oy = (int)(row - plane * p.outH);
+            const T* xp = x + plane * p.inH * p.inW;
+            T* yp = y + row * p.outW;
+
+            int my = oy * downy - p.pady0;
+            int rowTap = floor_mod(-my, upy);
+            int rowIn = (my + rowTap) / upy;
+
+            for (int ox = 0; ox < p.outW; ox++)
+            {
+                scalar_t v = 0;
+                int iy = rowIn;
+                for (int ty = rowTap; ty < filterH; ty += upy, iy++)
+                {
+                    if (iy < 0 || iy >= p.inH)
+                        continue;
+                    const T* xr = xp + (int64_t)iy * p.inW;
+                    const float* wr = p.w + ty * filterW;
+                    int ix = colIn[ox];
+                    for (int tx = colTap[ox]; tx < filterW; tx += upx, ix++)
+                        if (ix >= 0 && ix < p.inW)
+                            v += (scalar_t)xr[ix] * (scalar_t)wr[tx];
+                }
+                yp[ox] = (T)v;
+            }
+        }
+    });
+}
+
+//------------------------------------------------------------------------
+
+static torch::Tensor upfirdn2d(torch::Tensor x, torch::Tensor f, int upx, int upy, int downx, int downy, int padx0, int padx1, int pady0, int pady1, bool flip, float gain)
+{
+    // Validate arguments.
+    TORCH_CHECK(x.device().is_cpu(), "x must reside on CPU");
+    TORCH_CHECK(f.device() == x.device(), "f must reside on the same device as x");
+    TORCH_CHECK(f.dtype() == torch::kFloat, "f must be float32");
+    TORCH_CHECK(x.dtype() == torch::kFloat || x.dtype() == torch::kDouble, "x must be float32 or float64");
+    TORCH_CHECK(x.numel() <= INT_MAX, "x is too large");
+    TORCH_CHECK(f.numel() <= INT_MAX, "f is too large");
+    TORCH_CHECK(x.dim() == 4, "x must be rank 4");
+    TORCH_CHECK(f.dim() == 2, "f must be rank 2");
+    TORCH_CHECK(f.size(0) >= 1 && f.size(1) >= 1, "f must be at least 1x1");
+    TORCH_CHECK(upx >= 1 && upy >= 1, "upsampling factor must be at least 1");
+    TORCH_CHECK(downx >= 1 && downy >= 1, "downsampling factor must be at least 1");
+
+    // Create output tensor. The kernel reads and writes contiguous planes.
+    x = x.contiguous();
+    torch::Tensor w = ((flip) ? f : f.flip({0, 1})).mul(gain).contiguous();
+    int outW = ((int)x.size(3) * upx + padx0 + padx1 - (int)f.size(1) + downx) / downx;
+    int outH = ((int)x.size(2) * upy + pady0 + pady1 - (int)f.size(0) + downy) / downy;
+    TORCH_CHECK(outW >= 1 && outH >= 1, "output must be at least 1x1");
+    torch::Tensor y = torch::empty({x.size(0), x.size(1), outH, outW}, x.options());
+    TORCH_CHECK(y.numel() <= INT_MAX, "output is too large");
+
+    // Initialize CPU kernel parameters.
+    upfirdn2d_cpu_kernel_params p;
+    p.x         = x.data_ptr();
+    p.w         = w.data_ptr<float>();
+    p.y         = y.data_ptr();
+    p.upx       = upx;
+    p.upy       = upy;
+    p.downx     = downx;
+    p.downy     = downy;
+    p.padx0     = padx0;
+    p.pady0     = pady0;
+    p.inW       = (int)x.size(3);
+    p.inH       = (int)x.size(2);
+    p.filterW   = (int)w.size(1);
+    p.filterH   = (int)w.size(0);
+    p.outW      = outW;
+    p.outH      = outH;
+    p.planes    = x.size(0) * x.size(1);
+
+    // Choose and run CPU kernel. The 4x4 filters of the generator get specialized variants.
+    AT_DISPATCH_FLOATING_TYPES(x.scalar_type(), "upfirdn2d_cpu", [&]
+    {
+        bool square = (p.filterW == 4 && p.filterH == 4 && upx == upy && downx == downy);
+        if      (square && upx == 1 && downx == 1) upfirdn2d_cpu_kernel<scalar_t, 1, 1, 4>(p);
+        else if (square && upx == 2 && downx == 1) upfirdn2d_cpu_kernel<scalar_t, 2, 1, 4>(p);
+        else if (square && upx == 1 && downx == 2) upfirdn2d_cpu_kernel<scalar_t, 1, 2, 4>(p);
+        else                                       upfirdn2d_cpu_kernel<scalar_t, 0, 0, 0>(p);
+    });
+    return y;
+}
+
+//------------------------------------------------------------------------
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m)
+{
+    m.def("upfirdn2d", &upfirdn2d);
+}
+
+//------------------------------------------------------------------------
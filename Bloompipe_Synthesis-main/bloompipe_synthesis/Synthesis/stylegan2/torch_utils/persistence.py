@@ -18,8 +18,10 @@ import pickle
 import io
 import inspect
 import copy
-import uuid
 import types
+import hashlib
+import collections
+import threading
 import stylegan2.dnnlib as dnnlib
 
 #----------------------------------------------------------------------------
@@ -28,7 +30,10 @@ _version            = 6         # internal version number
 _decorators         = set()     # {decorator_class, ...}
 _import_hooks       = []        # [hook_function, ...]
 _module_to_src_dict = dict()    # {module: src, ...}
-_src_to_module_dict = dict()    # {src: module, ...}
+_src_to_module_dict = collections.OrderedDict() # {src_hash: module, ...}, least recently used first
+_pinned_src_hashes  = set()     # {src_hash, ...} of modules that were imported normally
+_max_src_modules    = 16        # max number of reconstructed modules to keep
+_src_lock           = threading.RLock() # guards the module cache while pickles are loaded concurrently
 
 #----------------------------------------------------------------------------
 
@@ -203,28 +208,59 @@ def _reconstruct_persistent_obj(meta):
 
 #----------------------------------------------------------------------------
 
+def _src_hash(src):
+    return hashlib.sha256(src.encode('utf-8')).hexdigest()
+
 def _module_to_src(module):
     r"""Query the source code of a given Python module.
     """
     src = _module_to_src_dict.get(module, None)
     if src is None:
         src = inspect.getsource(module)
+        src_hash = _src_hash(src)
         _module_to_src_dict[module] = src
-        _src_to_module_dict[src] = module
+        _src_to_module_dict[src_hash] = module
+        _pinned_src_hashes.add(src_hash)
     return src
 
 def _src_to_module(src):
     r"""Get or create a Python module for the given source code.
+
+    The cache is keyed by the SHA-256 of the source code instead of the source
+    string itself, and the hash also names the module. It keeps at most
+    `_max_src_modules` reconstructed modules and drops the least recently used
+    ones, modules of normally imported code are pinned and never dropped.
+    Objects that were created from a dropped module remain fully functional.
+    `_src_lock` makes concurrent loads of the same source build one module.
     """
-    module = _src_to_module_dict.get(src, None)
-    if module is None:
-        module_name = "_imported_module_" + uuid.uuid4().hex
-        module = types.ModuleType(module_name)
-        sys.modules[module_name] = module
-        _module_to_src_dict[module] = src
-        _src_to_module_dict[src] = module
-        exec(src, module.__dict__) # pylint: disable=exec-used
-    return module
+    src_hash = _src_hash(src)
+    with _src_lock:
+        module = _src_to_module_dict.get(src_hash, None)
+        if module is None:
+            module_name = "_imported_module_" + src_hash[:32]
+            module = types.ModuleType(module_name)
+            sys.modules[module_name] = module
+            _module_to_src_dict[module] = src
+            _src_to_module_dict[src_hash] = module
+            try:
+                exec(compile(src, module_name, 'exec'), module.__dict__) # pylint: disable=exec-used
+            except:
+                del _src_to_module_dict[src_hash]
+                del _module_to_src_dict[module]
+                del sys.modules[module_name]
+                raise
+            _evict_src_modules()
+        _src_to_module_dict.move_to_end(src_hash)
+        return module
+
+def _evict_src_modules():
+    r"""Drop the least recently used reconstructed modules beyond `_max_src_modules`.
+    """
+    evictable = [src_hash for src_hash in _src_to_module_dict if src_hash not in _pinned_src_hashes]
+    for src_hash in evictable[:max(len(evictable) - _max_src_modules, 0)]:
+        module = _src_to_module_dict.pop(src_hash)
+        _module_to_src_dict.pop(module, None)
+        sys.modules.pop(module.__name__, None)
 
 #----------------------------------------------------------------------------
 
@@ -0,0 +1,165 @@
+# Copyright (c) 2021, NVIDIA CORPORATION.  All rights reserved.
+#
+# NVIDIA CORPORATION and its licensors retain all intellectual property
+# and proprietary rights in and to this software, related documentation
+# and any modifications thereto.  Any use, reproduction, disclosure or
+# distribution of this software and related documentation without an express
+# license agreement from NVIDIA CORPORATION is strictly prohibited.
+
+"""Check the CPU kernels of the custom ops against their reference implementations.
+
+Run with pytest or directly: python Synthesis/stylegan2/torch_utils/test_cpu_ops.py
+"""
+
+import itertools
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from stylegan2.torch_utils.ops import bias_act, conv2d_resample, upfirdn2d
+
+#----------------------------------------------------------------------------
+# Tolerances by dtype, as (rtol, atol).
+
+_tolerances = {
+    torch.float32: (1e-5, 1e-5),
+    torch.float64: (1e-10, 1e-10),
+}
+
+def _assert_close(actual, expected, dtype, what):
+    rtol, atol = _tolerances[dtype]
+    assert actual.shape == expected.shape, f'{what}: shape {list(actual.shape)} != {list(expected.shape)}'
+    assert actual.dtype == expected.dtype, f'{what}: dtype {actual.dtype} != {expected.dtype}'
+    max_error = (actual - expected).abs().max().item() if actual.numel() else 0
+    assert torch.allclose(actual, expected, rtol=rtol, atol=atol), f'{what}: max abs error {max_error}'
+
+#----------------------------------------------------------------------------
+
+def test_upfirdn2d_cpu():
+    assert upfirdn2d._init_cpu(), 'upfirdn2d CPU plugin is not available'
+    torch.manual_seed(0)
+
+    filters = {
+        '4x4': torch.randn([4, 4]),                         # Specialized kernels of the generator.
+        '3x3': torch.randn([3, 3]),                         # Generic kernel.
+        '2x5': torch.randn([2, 5]),                         # Non-square filter.
+        'separable4': upfirdn2d.setup_filter([1, 3, 3, 1]), # Separable filter, applied in two passes.
+    }
+    paddings = [0, [1, 2, 2, 1], [2, 1, 0, 3], [-1, 2, 1, -1]]
+
+    for dtype, (fname, f), up, down, padding, flip_filter, gain in itertools.product(
+            [torch.float32, torch.float64], filters.items(), [1, 2], [1, 2], paddings, [False, True], [1, 2.5]):
+        x = torch.randn([2, 3, 9, 7], dtype=dtype, requires_grad=True)
+        kwargs = dict(up=up, down=down, padding=padding, flip_filter=flip_filter, gain=gain)
+        what = f'upfirdn2d {dtype} f={fname} {kwargs}'
+
+        try:
+            expected = upfirdn2d._upfirdn2d_ref(x, f, **kwargs)
+        except RuntimeError:
+            expected = None
+        if expected is None or expected.numel() == 0:
+            continue # Output would be empty for this combination of sizes and padding.
+        actual = upfirdn2d.upfirdn2d(x, f, impl='cuda', **kwargs)
+        _assert_close(actual, expected, dtype, what)
+
+        # The gradient goes through the same kernel with transposed parameters.
+        dy = torch.randn_like(expected)
+        expected_dx, = torch.autograd.grad(expected, x, dy)
+        actual_dx, = torch.autograd.grad(actual, x, dy)
+        _assert_close(actual_dx, expected_dx, dtype, what + ' grad')
+
+#----------------------------------------------------------------------------
+
+def test_bias_act_cpu():
+    assert bias_act._init_cpu(), 'bias_act CPU plugin is not available'
+    torch.manual_seed(0)
+
+    for dtype, act, alpha, gain, clamp, dim, with_bias in itertools.product(
+            [torch.float32, torch.float64], bias_act._cpu_activations, [None, 0.3], [None, 1.7], [None, 0.5],
+            [1, 2, 3], [False, True]):
+        x = torch.randn([2, 5, 6, 3], dtype=dtype)
+        b = torch.randn([x.shape[dim]], dtype=dtype) if with_bias else None
+        kwargs = dict(dim=dim, act=act, alpha=alpha, gain=gain, clamp=clamp)
+        what = f'bias_act {dtype} bias={with_bias} {kwargs}'
+        expected = bias_act._bias_act_ref(x, b, **kwargs)
+
+        # Out of place.
+        _assert_close(bias_act.bias_act(x, b, impl='cuda', **kwargs), expected, dtype, what)
+
+        # In place, only taken if autograd does not track the inputs.
+        with torch.no_grad():
+            x_inplace = x.clone()
+            actual = bias_act.bias_act(x_inplace, b, impl='cuda', inplace=True, **kwargs)
+        assert actual.data_ptr() == x_inplace.data_ptr(), f'{what}: inplace did not reuse x'
+        _assert_close(actual, expected, dtype, what + ' inplace')
+
+        # With grad enabled and x tracked, the in-place path must not be taken.
+        x_grad = x.clone().requires_grad_(True)
+        actual = bias_act.bias_act(x_grad, b, impl='cuda', inplace=True, **kwargs)
+        assert actual.data_ptr() != x_grad.data_ptr(), f'{what}: inplace was taken while x requires grad'
+        assert torch.equal(x_grad.detach(), x), f'{what}: x was modified while it requires grad'
+        _assert_close(actual, expected, dtype, what + ' grad enabled')
+
+        dy = torch.randn_like(expected)
+        x_ref = x.clone().requires_grad_(True)
+        expected_dx, = torch.autograd.grad(bias_act._bias_act_ref(x_ref, b, **kwargs), x_ref, dy)
+        actual_dx, = torch.autograd.grad(actual, x_grad, dy)
+        _assert_close(actual_dx, expected_dx, dtype, what + ' grad')
+
+#----------------------------------------------------------------------------
+
+def _conv2d_resample(polyphase, x, w, **kwargs):
+    prev = conv2d_resample.polyphase_cpu
+    try:
+        conv2d_resample.polyphase_cpu = polyphase
+        return conv2d_resample.conv2d_resample(x, w, **kwargs)
+    finally:
+        conv2d_resample.polyphase_cpu = prev
+
+def test_conv2d_resample_polyphase_cpu():
+    torch.manual_seed(0)
+
+    # A 1x1 kernel upsampled by 2 without padding has an output phase that meets no tap (j == 0).
+    _, phases = conv2d_resample._get_polyphase(in_size=5, kernel_size=1, up=2, padding=0)
+    assert any(j == 0 for _, _, _, j in phases)
+
+    filters = {'none': None, 'separable4': upfirdn2d.setup_filter([1, 3, 3, 1])}
+
+    for dtype, kernel, down, groups, flip_weight, (fname, f), padding in itertools.product(
+            [torch.float32, torch.float64], [3, 1], [1, 2], [1, 2], [True, False], filters.items(), [0, 1, [1, 0, 2, 1]]):
+        if kernel == 1 and down == 1:
+            continue # Takes the 1x1 fast path, which does not use a transposed convolution.
+        x = torch.randn([2, 4, 7, 6], dtype=dtype, requires_grad=True)
+        w = torch.randn([6, 4 // groups, kernel, kernel], dtype=dtype)
+        kwargs = dict(f=f, up=2, down=down, padding=padding, groups=groups, flip_weight=flip_weight, impl='ref')
+        what = f'conv2d_resample {dtype} kernel={kernel} f={fname} {kwargs}'
+
+        expected = _conv2d_resample(False, x, w, **kwargs)
+        actual = _conv2d_resample(True, x, w, **kwargs)
+        _assert_close(actual, expected, dtype, what)
+
+        dy = torch.randn_like(expected)
+        expected_dx, = torch.autograd.grad(expected, x, dy)
+        actual_dx, = torch.autograd.grad(actual, x, dy)
+        _assert_close(actual_dx, expected_dx, dtype, what + ' grad')
+
+    # The phases with and without taps directly against the transposed convolution they replace.
+    for kernel, pad, flip_weight, groups in itertools.product([1, 2, 3, 4], [0, 1, 2], [True, False], [1, 2]):
+        x = torch.randn([1, 4, 5, 6], dtype=torch.float64)
+        w = torch.randn([6, 4 // groups, kernel, kernel], dtype=torch.float64)
+        wt = w.reshape(groups, 6 // groups, 4 // groups, kernel, kernel).transpose(1, 2).reshape(4, 6 // groups, kernel, kernel)
+        expected = conv2d_resample._conv2d_wrapper(x=x, w=wt, stride=2, padding=[pad, pad], groups=groups, transpose=True, flip_weight=(not flip_weight))
+        actual = conv2d_resample._conv_transpose2d_polyphase(x=x, w=w, up=2, padding=[pad, pad], groups=groups, flip_weight=flip_weight)
+        _assert_close(actual, expected, torch.float64, f'polyphase kernel={kernel} padding={pad} flip_weight={flip_weight} groups={groups}')
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f'{name}: ok')
+
+#----------------------------------------------------------------------------
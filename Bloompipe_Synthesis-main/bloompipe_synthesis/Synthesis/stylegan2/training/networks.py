@@ -6,6 +6,7 @@
 # distribution of this software and related documentation without an express
 # license agreement from NVIDIA CORPORATION is strictly prohibited.
 
+import weakref
 import numpy as np
 import torch
 from stylegan2.torch_utils import misc
@@ -21,6 +22,26 @@ from stylegan2.torch_utils.ops import fma
 def normalize_2nd_moment(x, dim=1, eps=1e-8):
     return x * (x.square().mean(dim=dim, keepdim=True) + eps).rsqrt()
 
+#----------------------------------------------------------------------------
+# Cached per-layer sums of squared weights for factorized demodulation.
+# Avoids recomputing them for every batch when the weights are frozen.
+
+# Keyed by id() rather than by the tensor itself, because tensors compare elementwise,
+# so they cannot be dictionary keys. A weakref drops the entry with the weight.
+
+_weight_sq_cache = dict() # {id(weight): (weakref(weight), version, weight_sq), ...}
+
+def weight_sq_sum(weight):
+    if torch.is_grad_enabled() and weight.requires_grad:
+        return weight.square().sum(dim=[2,3]) # [OI]
+    key = id(weight)
+    entry = _weight_sq_cache.get(key, None)
+    if entry is None or entry[0]() is not weight or entry[1] != weight._version or entry[2].device != weight.device or entry[2].dtype != weight.dtype:
+        ref = weakref.ref(weight, lambda _ref, key=key: _weight_sq_cache.pop(key, None) if _weight_sq_cache.get(key, (None,))[0] is _ref else None)
+        entry = (ref, weight._version, weight.detach().square().sum(dim=[2,3])) # [OI]
+        _weight_sq_cache[key] = entry
+    return entry[2]
+
 #----------------------------------------------------------------------------
 
 @misc.profiled_function
@@ -36,6 +57,8 @@ def modulated_conv2d(
     demodulate      = True,     # Apply weight demodulation?
     flip_weight     = True,     # False = convolution, True = correlation (matches torch.nn.functional.conv2d).
     fused_modconv   = True,     # Perform modulation, convolution, and demodulation as a single fused operation?
+    weight_sq       = None,     # Precomputed weight.square().sum([2,3]) of shape [out_channels, in_channels] for factorized demodulation, None = use per-sample weights.
+    impl            = 'cuda',   # Implementation of the resampling filters: 'ref' or 'cuda'.
 ):
     batch_size = x.shape[0]
     out_channels, in_channels, kh, kw = weight.shape
@@ -45,16 +68,25 @@ def modulated_conv2d(
 
     # Pre-normalize inputs to avoid FP16 overflow.
     if x.dtype == torch.float16 and demodulate:
-        weight = weight * (1 / np.sqrt(in_channels * kh * kw) / weight.norm(float('inf'), dim=[1,2,3], keepdim=True)) # max_Ikk
+        weight_gain = 1 / np.sqrt(in_channels * kh * kw) / weight.norm(float('inf'), dim=[1,2,3], keepdim=True) # max_Ikk
+        weight = weight * weight_gain
         styles = styles / styles.norm(float('inf'), dim=1, keepdim=True) # max_I
+        if weight_sq is not None:
+            weight_sq = weight_sq * weight_gain.reshape(-1, 1).square()
 
     # Calculate per-sample weights and demodulation coefficients.
+    # Factorized demodulation uses sum_Ikk((weight * styles)^2) == styles^2 @ sum_kk(weight^2)^T,
+    # so that the non-fused path never materializes the per-sample weights.
     w = None
     dcoefs = None
-    if demodulate or fused_modconv:
+    factorized = (weight_sq is not None and not fused_modconv)
+    if fused_modconv or (demodulate and not factorized):
         w = weight.unsqueeze(0) # [NOIkk]
         w = w * styles.reshape(batch_size, 1, -1, 1, 1) # [NOIkk]
-    if demodulate:
+    if demodulate and factorized:
+        misc.assert_shape(weight_sq, [out_channels, in_channels]) # [OI]
+        dcoefs = (styles.square() @ weight_sq.to(styles.dtype).t() + 1e-8).rsqrt() # [NO]
+    elif demodulate:
         dcoefs = (w.square().sum(dim=[2,3,4]) + 1e-8).rsqrt() # [NO]
     if demodulate and fused_modconv:
         w = w * dcoefs.reshape(batch_size, -1, 1, 1, 1) # [NOIkk]
@@ -62,7 +94,7 @@ def modulated_conv2d(
     # Execute by scaling the activations before and after the convolution.
     if not fused_modconv:
         x = x * styles.to(x.dtype).reshape(batch_size, -1, 1, 1)
-        x = conv2d_resample.conv2d_resample(x=x, w=weight.to(x.dtype), f=resample_filter, up=up, down=down, padding=padding, flip_weight=flip_weight)
+        x = conv2d_resample.conv2d_resample(x=x, w=weight.to(x.dtype), f=resample_filter, up=up, down=down, padding=padding, flip_weight=flip_weight, impl=impl)
         if demodulate and noise is not None:
             x = fma.fma(x, dcoefs.to(x.dtype).reshape(batch_size, -1, 1, 1), noise.to(x.dtype))
         elif demodulate:
@@ -77,7 +109,7 @@ def modulated_conv2d(
     misc.assert_shape(x, [batch_size, in_channels, None, None])
     x = x.reshape(1, -1, *x.shape[2:])
     w = w.reshape(-1, in_channels, kh, kw)
-    x = conv2d_resample.conv2d_resample(x=x, w=w.to(x.dtype), f=resample_filter, up=up, down=down, padding=padding, groups=batch_size, flip_weight=flip_weight)
+    x = conv2d_resample.conv2d_resample(x=x, w=w.to(x.dtype), f=resample_filter, up=up, down=down, padding=padding, groups=batch_size, flip_weight=flip_weight, impl=impl)
     x = x.reshape(batch_size, -1, *x.shape[2:])
     if noise is not None:
         x = x.add_(noise)
@@ -114,7 +146,7 @@ class FullyConnectedLayer(torch.nn.Module):
             x = torch.addmm(b.unsqueeze(0), x, w.t())
         else:
             x = x.matmul(w.t())
-            x = bias_act.bias_act(x, b, act=self.activation)
+            x = bias_act.bias_act(x, b, act=self.activation, inplace=True)
         return x
 
 #----------------------------------------------------------------------------
@@ -165,7 +197,7 @@ class Conv2dLayer(torch.nn.Module):
 
         act_gain = self.act_gain * gain
         act_clamp = self.conv_clamp * gain if self.conv_clamp is not None else None
-        x = bias_act.bias_act(x, b, act=self.activation, gain=act_gain, clamp=act_clamp)
+        x = bias_act.bias_act(x, b, act=self.activation, gain=act_gain, clamp=act_clamp, inplace=True)
         return x
 
 #----------------------------------------------------------------------------
@@ -283,11 +315,12 @@ class SynthesisLayer(torch.nn.Module):
             self.noise_strength = torch.nn.Parameter(torch.zeros([]))
         self.bias = torch.nn.Parameter(torch.zeros([out_channels]))
 
-    def forward(self, x, w, noise_mode='random', fused_modconv=True, gain=1):
+    def forward(self, x, w, noise_mode='random', fused_modconv=True, gain=1, styles=None, factorized_demod=False, bias_act_impl='cuda', upfirdn2d_impl='cuda'):
         assert noise_mode in ['random', 'const', 'none']
         in_resolution = self.resolution // self.up
         misc.assert_shape(x, [None, self.weight.shape[1], in_resolution, in_resolution])
-        styles = self.affine(w)
+        if styles is None:
+            styles = self.affine(w)
 
         noise = None
         if self.use_noise and noise_mode == 'random':
@@ -295,13 +328,20 @@ class SynthesisLayer(torch.nn.Module):
         if self.use_noise and noise_mode == 'const':
             noise = self.noise_const * self.noise_strength
 
+        # Factorized demodulation replaces the fused op with a plain shared-weight convolution.
+        weight_sq = None
+        if factorized_demod:
+            weight_sq = weight_sq_sum(self.weight)
+            fused_modconv = False
+
         flip_weight = (self.up == 1) # slightly faster
         x = modulated_conv2d(x=x, weight=self.weight, styles=styles, noise=noise, up=self.up,
-            padding=self.padding, resample_filter=self.resample_filter, flip_weight=flip_weight, fused_modconv=fused_modconv)
+            padding=self.padding, resample_filter=self.resample_filter, flip_weight=flip_weight, fused_modconv=fused_modconv,
+            weight_sq=weight_sq, impl=upfirdn2d_impl)
 
         act_gain = self.act_gain * gain
         act_clamp = self.conv_clamp * gain if self.conv_clamp is not None else None
-        x = bias_act.bias_act(x, self.bias.to(x.dtype), act=self.activation, gain=act_gain, clamp=act_clamp)
+        x = bias_act.bias_act(x, self.bias.to(x.dtype), act=self.activation, gain=act_gain, clamp=act_clamp, impl=bias_act_impl, inplace=True)
         return x
 
 #----------------------------------------------------------------------------
@@ -317,10 +357,12 @@ class ToRGBLayer(torch.nn.Module):
         self.bias = torch.nn.Parameter(torch.zeros([out_channels]))
         self.weight_gain = 1 / np.sqrt(in_channels * (kernel_size ** 2))
 
-    def forward(self, x, w, fused_modconv=True):
-        styles = self.affine(w) * self.weight_gain
+    def forward(self, x, w, fused_modconv=True, styles=None, bias_act_impl='cuda'):
+        if styles is None:
+            styles = self.affine(w)
+        styles = styles * self.weight_gain
         x = modulated_conv2d(x=x, weight=self.weight, styles=styles, demodulate=False, fused_modconv=fused_modconv)
-        x = bias_act.bias_act(x, self.bias.to(x.dtype), clamp=self.conv_clamp)
+        x = bias_act.bias_act(x, self.bias.to(x.dtype), clamp=self.conv_clamp, impl=bias_act_impl, inplace=True)
         return x
 
 #----------------------------------------------------------------------------
@@ -376,14 +418,24 @@ class SynthesisBlock(torch.nn.Module):
             self.skip = Conv2dLayer(in_channels, out_channels, kernel_size=1, bias=False, up=2,
                 resample_filter=resample_filter, channels_last=self.channels_last)
 
-    def forward(self, x, img, ws, force_fp32=False, fused_modconv=None, **layer_kwargs):
+    def style_layers(self):
+        # Layers consuming the entries of this block's ws, in order.
+        layers = [self.conv0] if self.in_channels != 0 else []
+        layers += [self.conv1]
+        if self.is_last or self.architecture == 'skip':
+            layers += [self.torgb]
+        return layers
+
+    def forward(self, x, img, ws, force_fp32=False, fused_modconv=None, styles=None, bias_act_impl='cuda', upfirdn2d_impl='cuda', **layer_kwargs):
         misc.assert_shape(ws, [None, self.num_conv + self.num_torgb, self.w_dim])
         w_iter = iter(ws.unbind(dim=1))
+        s_iter = iter(styles if styles is not None else [None] * (self.num_conv + self.num_torgb))
         dtype = torch.float16 if self.use_fp16 and not force_fp32 else torch.float32
         memory_format = torch.channels_last if self.channels_last and not force_fp32 else torch.contiguous_format
         if fused_modconv is None:
             with misc.suppress_tracer_warnings(): # this value will be treated as a constant
                 fused_modconv = (not self.training) and (dtype == torch.float32 or int(x.shape[0]) == 1)
+        layer_kwargs = dict(layer_kwargs, bias_act_impl=bias_act_impl, upfirdn2d_impl=upfirdn2d_impl)
 
         # Input.
         if self.in_channels == 0:
@@ -395,22 +447,22 @@ class SynthesisBlock(torch.nn.Module):
 
         # Main layers.
         if self.in_channels == 0:
-            x = self.conv1(x, next(w_iter), fused_modconv=fused_modconv, **layer_kwargs)
+            x = self.conv1(x, next(w_iter), fused_modconv=fused_modconv, styles=next(s_iter), **layer_kwargs)
         elif self.architecture == 'resnet':
             y = self.skip(x, gain=np.sqrt(0.5))
-            x = self.conv0(x, next(w_iter), fused_modconv=fused_modconv, **layer_kwargs)
-            x = self.conv1(x, next(w_iter), fused_modconv=fused_modconv, gain=np.sqrt(0.5), **layer_kwargs)
+            x = self.conv0(x, next(w_iter), fused_modconv=fused_modconv, styles=next(s_iter), **layer_kwargs)
+            x = self.conv1(x, next(w_iter), fused_modconv=fused_modconv, gain=np.sqrt(0.5), styles=next(s_iter), **layer_kwargs)
             x = y.add_(x)
         else:
-            x = self.conv0(x, next(w_iter), fused_modconv=fused_modconv, **layer_kwargs)
-            x = self.conv1(x, next(w_iter), fused_modconv=fused_modconv, **layer_kwargs)
+            x = self.conv0(x, next(w_iter), fused_modconv=fused_modconv, styles=next(s_iter), **layer_kwargs)
+            x = self.conv1(x, next(w_iter), fused_modconv=fused_modconv, styles=next(s_iter), **layer_kwargs)
 
         # ToRGB.
         if img is not None:
             misc.assert_shape(img, [None, self.img_channels, self.resolution // 2, self.resolution // 2])
-            img = upfirdn2d.upsample2d(img, self.resample_filter)
+            img = upfirdn2d.upsample2d(img, self.resample_filter, impl=upfirdn2d_impl)
         if self.is_last or self.architecture == 'skip':
-            y = self.torgb(x, next(w_iter), fused_modconv=fused_modconv)
+            y = self.torgb(x, next(w_iter), fused_modconv=fused_modconv, styles=next(s_iter), bias_act_impl=bias_act_impl)
             y = y.to(dtype=torch.float32, memory_format=torch.contiguous_format)
             img = img.add_(y) if img is not None else y
 
@@ -454,7 +506,85 @@ class SynthesisNetwork(torch.nn.Module):
                 self.num_ws += block.num_torgb
             setattr(self, f'b{res}', block)
 
-    def forward(self, ws, **block_kwargs):
+    @torch.no_grad()
+    def compute_styles(self, ws):
+        r"""Precompute the style vectors of every SynthesisLayer and ToRGBLayer.
+
+        Instead of evaluating each `affine` layer separately for every batch,
+        the affine layers are grouped by their number of output channels and
+        every group is evaluated as a single batched matmul over all of `ws`.
+        The result can be passed to `forward()` via `styles`, which is useful
+        when all latents are known up front, e.g. when rendering a video.
+        Slices along the batch dimension stay valid styles for the matching
+        slice of `ws`.
+
+        Returns a list with one entry per block, each holding the (unscaled)
+        styles of `block.style_layers()` as tensors of shape [batch_size, in_channels].
+        """
+        misc.assert_shape(ws, [None, self.num_ws, self.w_dim])
+        ws = ws.to(torch.float32)
+
+        # Collect layers and the index of the w they consume.
+        layers = []
+        w_idx = 0
+        for res in self.block_resolutions:
+            block = getattr(self, f'b{res}')
+            layers += [(layer, w_idx + idx) for idx, layer in enumerate(block.style_layers())]
+            w_idx += block.num_conv
+
+        # Evaluate affine layers with the same output shape as one batched matmul.
+        groups = dict()
+        for idx, (layer, _) in enumerate(layers):
+            groups.setdefault(layer.affine.weight.shape[0], []).append(idx)
+        styles = [None] * len(layers)
+        for group in groups.values():
+            affines = [layers[idx][0].affine for idx in group]
+            assert all(affine.activation == 'linear' and affine.bias is not None for affine in affines)
+            weight = torch.stack([affine.weight.to(ws.dtype) * affine.weight_gain for affine in affines]) # [LCW]
+            bias = torch.stack([affine.bias.to(ws.dtype) * affine.bias_gain for affine in affines]) # [LC]
+            x = ws[:, [layers[idx][1] for idx in group]].transpose(0, 1) # [LNW]
+            y = torch.baddbmm(bias.unsqueeze(1), x, weight.transpose(1, 2)) # [LNC]
+            for idx, cur_styles in zip(group, y.unbind(0)):
+                styles[idx] = cur_styles
+
+        # Split per block.
+        block_styles = []
+        for res in self.block_resolutions:
+            num_layers = len(getattr(self, f'b{res}').style_layers())
+            block_styles.append(styles[:num_layers])
+            styles = styles[num_layers:]
+        return block_styles
+
+    def count_ws(self, max_resolution):
+        r"""Number of leading entries of `ws` that are consumed by the blocks up to
+        `max_resolution`, including the ToRGB layer of the block at `max_resolution`."""
+        assert max_resolution in self.block_resolutions
+        num_ws = 0
+        for res in self.block_resolutions:
+            block = getattr(self, f'b{res}')
+            num_ws += block.num_conv
+            if res == max_resolution:
+                return num_ws + block.num_torgb
+
+    def forward(self, ws, styles=None, stop_resolution=None, upscale=False, start_resolution=None, x=None, img=None, return_features=False, **block_kwargs):
+        r"""Synthesize images from `ws`.
+
+        With `stop_resolution`, the blocks above that resolution are skipped and
+        the partial image of the block at `stop_resolution` is returned, which is
+        a cheap low-resolution preview of the final image. This requires the
+        'skip' architecture, whose blocks all carry a valid partial image.
+        With `upscale`, the preview is resized to `img_resolution`.
+
+        With `start_resolution`, the blocks below that resolution are skipped and
+        `x` and `img` must hold the features of the block below, as returned by a
+        previous call with `stop_resolution` and `return_features=True`. This allows
+        computing the low-resolution blocks once for several images.
+        """
+        if start_resolution is not None:
+            assert start_resolution in self.block_resolutions and start_resolution > 4 and x is not None
+        if stop_resolution is not None:
+            assert stop_resolution in self.block_resolutions
+            assert stop_resolution == self.img_resolution or getattr(self, f'b{stop_resolution}').architecture == 'skip'
         block_ws = []
         with torch.autograd.profiler.record_function('split_ws'):
             misc.assert_shape(ws, [None, self.num_ws, self.w_dim])
@@ -464,11 +594,22 @@ class SynthesisNetwork(torch.nn.Module):
                 block = getattr(self, f'b{res}')
                 block_ws.append(ws.narrow(1, w_idx, block.num_conv + block.num_torgb))
                 w_idx += block.num_conv
+            if styles is None:
+                styles = [None] * len(self.block_resolutions)
+            assert len(styles) == len(self.block_resolutions)
 
-        x = img = None
-        for res, cur_ws in zip(self.block_resolutions, block_ws):
+        for res, cur_ws, cur_styles in zip(self.block_resolutions, block_ws, styles):
+            if start_resolution is not None and res < start_resolution:
+                continue
             block = getattr(self, f'b{res}')
-            x, img = block(x, img, cur_ws, **block_kwargs)
+            x, img = block(x, img, cur_ws, styles=cur_styles, **block_kwargs)
+            if res == stop_resolution:
+                break
+
+        if return_features:
+            return x, img
+        if upscale and img.shape[-1] != self.img_resolution:
+            img = torch.nn.functional.interpolate(img, size=[self.img_resolution, self.img_resolution], mode='bilinear', align_corners=False)
         return img
 
 #----------------------------------------------------------------------------
@@ -499,6 +640,36 @@ class Generator(torch.nn.Module):
         img = self.synthesis(ws, **synthesis_kwargs)
         return img
 
+    # Inference entry points. They freeze the generator and run without any autograd
+    # bookkeeping. Inputs may live in (pinned) host memory and are copied asynchronously.
+
+    def _freeze(self):
+        if self.training or any(param.requires_grad for param in self.parameters()):
+            self.eval().requires_grad_(False)
+
+    def _to_device(self, x):
+        device = self.synthesis.b4.const.device
+        return x.to(device, torch.float32, non_blocking=True) if x is not None else None
+
+    @misc.inference_mode()
+    def infer_styles(self, z, c=None, truncation_psi=1, truncation_cutoff=None, coarse_z=None, num_coarse_ws=0):
+        # With coarse_z, the first num_coarse_ws entries of ws are mapped from coarse_z instead (style mixing).
+        self._freeze()
+        ws = self.mapping(self._to_device(z), self._to_device(c), truncation_psi=truncation_psi, truncation_cutoff=truncation_cutoff)
+        if coarse_z is not None and num_coarse_ws > 0:
+            coarse_ws = self.mapping(self._to_device(coarse_z), self._to_device(c), truncation_psi=truncation_psi, truncation_cutoff=truncation_cutoff)
+            ws = torch.cat([coarse_ws[:, :num_coarse_ws], ws[:, num_coarse_ws:]], dim=1)
+        return ws, self.synthesis.compute_styles(ws)
+
+    @misc.inference_mode()
+    def infer_images(self, ws, styles=None, **synthesis_kwargs):
+        self._freeze()
+        return self.synthesis(self._to_device(ws), styles=styles, **synthesis_kwargs)
+
+    def infer(self, z, c=None, truncation_psi=1, truncation_cutoff=None, **synthesis_kwargs):
+        ws, styles = self.infer_styles(z, c, truncation_psi=truncation_psi, truncation_cutoff=truncation_cutoff)
+        return self.infer_images(ws, styles=styles, **synthesis_kwargs)
+
 #----------------------------------------------------------------------------
 
 @persistence.persistent_class
@@ -1,3 +1,5 @@
+import json
+import os
 import pickle
 import pandas as pd
 import re
@@ -45,10 +47,27 @@ def determine_config(state_nv):
     return n_mapping, n_layers
 
 
+def plot_w_avg(weightsNP, network_pkl, output_file):
+    input_name = str(network_pkl)
+    fig1 = px.scatter(x=weightsNP, y=np.arange(len(weightsNP)), labels={'x':'Average Weight', 'y':'Index in Tensor'},
+                      title=f"Average weights of Generator taken from: {input_name}")
+    fig = go.Figure(data=fig1)
+    fig.write_html(output_file)
+
+
 @click.command()
 @click.argument("network-pkl")
 @click.argument("output-file")
-def convert(network_pkl, output_file):
+@click.option("--catalog", help="Style catalog to read the average weights from instead of loading the pickle", metavar="PATH")
+def convert(network_pkl, output_file, catalog):
+    # The style catalog already holds w_avg, so the pickle only needs to be loaded for styles that are not in it
+    if catalog is not None and os.path.exists(catalog):
+        with open(catalog, "r") as f:
+            entry = json.load(f).get(Path(network_pkl).stem)
+        if entry is not None:
+            plot_w_avg(np.array(entry["wAvg"]), network_pkl, output_file)
+            return
+
     with dnnlib.util.open_url(network_pkl) as f:
         G_nvidia = legacy.load_network_pkl(f)["G_ema"]
 
@@ -81,11 +100,7 @@ def convert(network_pkl, output_file):
     state_dict = {"g_ema": state_ros, "latent_avg": latent_avg}
     weightsNP =latent_avg.numpy()
 
-    input_name = str(network_pkl)
-    fig1 = px.scatter(x=weightsNP, y=np.arange(512), labels={'x':'Average Weight', 'y':'Index in Tensor'},
-                      title=f"Average weights of Generator taken from: {input_name}")
-    fig = go.Figure(data=fig1)
-    fig.write_html(output_file)
+    plot_w_avg(weightsNP, network_pkl, output_file)
 
 if __name__ == "__main__":
     convert()
@@ -2,6 +2,7 @@
 import json
 import requests
 import Synthesis
+from stylegan2.torch_utils import custom_ops
 from threading import Thread
 from flask import Flask, request, jsonify
 import torch
@@ -33,6 +34,27 @@ elif (ENV_MODE == "prod"):
 isGpu = torch.cuda.is_available()
 print("GPU available: " + str(isGpu))
 
+# The custom ops are compiled when the image is built (stylegan2/prebuild_ops.py), jobs never compile them,
+# ops that have not been prebuilt fall back to the reference implementation
+custom_ops.allow_build = False
+
+# Only every k-th frame is synthesized without GPU, the frames in between are blended
+CPU_KEYFRAME_STRIDE = 4
+
+# Resolution of the preview videos
+PREVIEW_RESOLUTION = 256
+
+# Styles that are placed, loaded and run once when the service starts, so that their jobs start without delay.
+# They are configured per deployment, one style per line in /app/meta/warm_styles.txt
+# or comma separated in the WARM_STYLES environment variable
+WARM_STYLES = []
+if os.path.exists("/app/meta/warm_styles.txt"):
+    with open("/app/meta/warm_styles.txt", "r") as file:
+        WARM_STYLES = [line.strip() for line in file.read().split('\n') if line.strip()]
+else:
+    WARM_STYLES = [style.strip() for style in os.environ.get("WARM_STYLES", "").split(',') if style.strip()]
+print("Warm styles: " + str(WARM_STYLES))
+
 
 
 
@@ -61,7 +83,7 @@ def token_required(f):
 
 
 
-def startThread(jobId):
+def startThread(jobId, keyframeStride=1, previewResolution=None, keepRenderCache=False):
 
     # Start Synthesis Process in Background
         thread = Thread(
@@ -69,6 +91,9 @@ def startThread(jobId):
                 jobId,
                 apiUrl,
                 SECRET_KEY,
+                keyframeStride,
+                previewResolution,
+                keepRenderCache,
             )
         )
         thread.daemon = True
@@ -101,10 +126,13 @@ def C():
         # Fetching jobId
         jobId = request.json["jobId"]
 
+        # Jobs that will be submitted again keep their frames, so that only changed frames are rendered again
+        keepRenderCache = bool(request.json.get("keepRenderCache", False))
+
         # Determine if current system has GPU
         if isGpu:
             print("GPU found - Starting Synthesis with GPU...")
-            startThread(jobId)
+            startThread(jobId, keepRenderCache=keepRenderCache)
 
         else:
             print("No GPU available on this Server - Searching for one...")
@@ -117,13 +145,14 @@ def C():
                     "http://" + gpuIp + ":64/api/synthesis/createImageSequence",
                     headers = {"access-token" : jwt.encode({"user": "bloompipe"}, SECRET_KEY, algorithm="HS256")},
                     json = {
-                        "jobId": jobId
+                        "jobId": jobId,
+                        "keepRenderCache": keepRenderCache
                     }
                 )
 
             else:
                 print("No GPU found - Starting Synthesis with CPU...")
-                startThread(jobId)
+                startThread(jobId, keyframeStride=CPU_KEYFRAME_STRIDE, keepRenderCache=keepRenderCache)
         
         # Return Stage
         requests.post(
@@ -140,6 +169,73 @@ def C():
 
 
 
+@app.route("/api/synthesis/createPreview", methods=["POST"])
+@token_required
+def createPreview():
+    with app.app_context():
+
+        # Fetching jobId
+        jobId = request.json["jobId"]
+
+        # Previews are cheap enough to be rendered on this server
+        print("Starting preview synthesis...")
+        startThread(jobId, keyframeStride=1 if isGpu else CPU_KEYFRAME_STRIDE, previewResolution=PREVIEW_RESOLUTION)
+
+        # Return Stage
+        requests.post(
+            apiUrl + "/api/database/setJobAttr",
+            headers = {"access-token" : jwt.encode({"user": "bloompipe"}, SECRET_KEY, algorithm="HS256")},
+            json = {
+                "jobId": jobId,
+                "values": {"status": "previewRunning"}
+            }
+        )
+        return {
+            "status": "previewRunning"
+        }
+
+
+
+@app.route("/api/synthesis/modelCache", methods=["GET"])
+@token_required
+def modelCache():
+    with app.app_context():
+
+        # Hit and miss counters and the styles that are currently loaded
+        return Synthesis.getModelCacheStats()
+
+
+
+@app.route("/api/synthesis/styleCatalog", methods=["GET"])
+@token_required
+def styleCatalog():
+    with app.app_context():
+
+        # Architecture, average latent and memory of all styles, without loading them
+        return Synthesis.readCatalog(Synthesis.SOURCE_DIRECTORY)
+
+
+
+# No token required, so that load balancers and orchestrators can probe the service
+@app.route("/api/synthesis/ready", methods=["GET"])
+def ready():
+    with app.app_context():
+
+        # Not ready while the custom ops are built and the warm styles are loaded
+        warmState = Synthesis.getWarmState()
+        return warmState, 200 if warmState["ready"] else 503
+
+
+
 # ===== App Footer Statements =========================
+# Place the warm styles and the popular styles in the background, so that their first jobs start right away
+Thread(target=Synthesis.prefetchStyles, args=(WARM_STYLES,), daemon=True).start()
+
+# Add new styles to the style catalog in the background
+Thread(target=Synthesis.updateCatalog, daemon=True).start()
+
+# Load the custom ops and the warm styles, the service reports itself ready afterwards
+Thread(target=Synthesis.warmUp, args=(WARM_STYLES,), daemon=True).start()
+
 if __name__ == "__main__":
     app.run(debug=True)